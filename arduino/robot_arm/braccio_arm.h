@@ -6,6 +6,7 @@
 #include <errno.h>
 #include "braccio.h"
 #include <Servo.h>
+#include "log_msgs.h"
 
 #define DFLT_STEP_DELAY 20 // ms
 
@@ -20,12 +21,39 @@
 #define PRINT_MSG 0x1
 #define ACK       0x2
 #define FINISH    0x3
+#define SEQ_CMD_MSG 0x4 // command message tagged with a sequence id
+#define SEQ_ACK 0x5 // ack echoing the sequence id of a SEQ_CMD_MSG
+#define SEQ_FINISH 0x6 // finish echoing the sequence id of a SEQ_CMD_MSG
+#define PONG 0x7 // only reply to a PING, no ACK or FINISH
+#define SEQ_NAK 0x8 // a SEQ_CMD_MSG was not read, sent before its SEQ_FINISH
+
+/*
+ * Framed link, set to 1 to wrap every message both ways as
+ *   [FRAME_START][message][crc8 of message]
+ * A lost or corrupt byte fails the crc and the reader skips to the next
+ * FRAME_START instead of reading everything after it misaligned. The host
+ * must be run framed as well, see command_interface(framed=True).
+ */
+#define FRAMED_LINK 0
+#define FRAME_START 0xA5
+#define FRAME_OVERHEAD 2 // start marker and crc
+
+// incoming message header sizes, bytes before the parameters
+#define CMD_HEADER 3 // msg_type, cmd, param_len
+#define SEQ_CMD_HEADER 4 // msg_type, seq, cmd, param_len
+#define RESCAN_BUFF (SEQ_CMD_HEADER + PARAM_BUFF + 1) // one frame after the marker
 
 // outgoing cmd definitions
 #define PRINT_GENERAL 0x0
 #define PRINT_ERROR   0x1
 #define PRINT_VERBOSE 0x2
 #define SENT_ANGLES   0x3
+#define PRINT_LOG_ID  0x4 // interned log message, see log_msgs.h
+#define ECHO_REPLY    0x5 // parameters of an ECHO sent back
+
+// PRINT_LOG_ID params, [print cmd][log id][2 bytes per argument]
+#define LOG_ID_HEADER 2
+#define LOG_ARG_LEN 2
 
 // incomming cammands
 #define M1_ANGLE 0x1 // base
@@ -37,6 +65,49 @@
 #define MX_ANGLE 0x7 // braccio_arm for all servo angles at once
 #define REQUEST_MX_ANGLE 0x8 // requesting all angles to be sent
 #define SET_DFLT_POS 0x9
+#define TRAJECTORY 0xA // move through a list of waypoints back to back
+#define SUBSCRIBE_ANGLES 0xB // push SENT_ANGLES to the host, see TELEM_*
+#define SET_LOG_LEVEL 0xC // highest print level sent to the host, see LOG_*
+#define SET_BAUD 0xD // switch baud rate after the FINISH, see BAUD_RATES
+#define ECHO 0xE // send the parameters back in an ECHO_REPLY
+#define PING 0xF // heartbeat, answered with a PONG message
+#define CONFIRM_BAUD 0x10 // keep the rate SET_BAUD switched to
+
+// TRAJECTORY parameters are a list of waypoints, each one is the step delay
+// for the segment followed by the 6 angles to move to.
+#define TRAJ_WAYPOINT_LEN (1 + NUM_ANGLES)
+#define TRAJ_MAX_WAYPOINTS (PARAM_BUFF / TRAJ_WAYPOINT_LEN)
+
+// SUBSCRIBE_ANGLES modes, param[0]. param[1] is the period for TELEM_PERIODIC
+// in TELEM_PERIOD_UNIT ms, at least 1. A period of 0 would push the angles
+// every loop and flood the link, it is rejected.
+#define TELEM_OFF 0 // only send angles when requested
+#define TELEM_PERIODIC 1 // push angles every period
+#define TELEM_ON_CHANGE 2 // push angles before the FINISH of a command
+                          // that changed them
+#define TELEM_PERIOD_UNIT 10 // ms
+
+// SET_LOG_LEVEL levels, param[0]. Prints above the level are dropped before
+// they are formatted. Errors are always sent.
+#define LOG_ERROR 0
+#define LOG_GENERAL 1
+#define LOG_VERBOSE 2 // default until the host sets a level
+
+// SET_LOG_LEVEL formats, optional param[1]
+#define LOG_TEXT 0 // prints are formatted here and sent as text
+#define LOG_COMPACT 1 // send_log() prints are sent as PRINT_LOG_ID
+
+/*
+ * SET_BAUD param[0] is an index into BAUD_RATES. The FINISH goes out at the
+ * old rate, then the port is opened again at the new one. The host checks
+ * the new rate both ways with an ECHO and, once its ECHO_REPLY came back
+ * whole, sends CONFIRM_BAUD. If no CONFIRM_BAUD comes in within
+ * BAUD_CONFIRM_MS the old rate is restored, so a rate the link cannot carry
+ * in either direction does not lose the controller.
+ */
+#define BAUD_RATES {9600, 19200, 38400, 57600, 115200, 230400, 250000, \
+                    460800, 500000, 921600, 1000000, 2000000}
+#define BAUD_CONFIRM_MS 1000
 
 // min max angles
 #define M1_MIN_ANGLE 0
@@ -66,6 +137,7 @@
 typedef struct parsed_io_msg {
     uint8_t msg_size;
     uint8_t msg_type;
+    uint8_t seq; // only set for SEQ_CMD_MSG
     uint8_t cmd;
     uint8_t param[PARAM_BUFF];
     uint8_t param_len;
@@ -96,23 +168,37 @@ class braccio_arm {
 
         bool serial_avail();
         int serial_read(uint8_t *buff, size_t len);
+        int read_msg(uint8_t *buff, size_t len);
 
         int set_parsed_msg(parsed_msg_s *fill, uint8_t msg_type, uint8_t cmd,
                            uint8_t param_len, uint8_t *param);
 
         int parse_msg(uint8_t *msg, parsed_msg_s *in_msg);
         int exec_command(parsed_msg_s *in_msg);
+        int exec_trajectory(parsed_msg_s *in_msg);
 
         void send_ack();
+        void send_ack(parsed_msg_s *in_msg);
         void send_finish();
+        void send_finish(parsed_msg_s *in_msg);
+        void send_read_finish();
+        void send_pong();
         int send_print(const char *format, ...);
         int send_verbose(const char *format, ...);
         int send_error(const char *format, ...);
+        int send_log(uint8_t print_cmd, uint8_t id, uint8_t nargs, ...);
         int send_all_angles();
+        int set_telemetry(uint8_t mode, uint8_t period);
+        void send_telemetry();
+        int set_log_level(uint8_t level, uint8_t format=LOG_TEXT);
+        int set_baud(uint8_t index);
+        uint32_t take_baud();
+        int send_echo(parsed_msg_s *in_msg);
 
         int create_send_msg(parsed_msg_s *msg);
         int create_io_msg(parsed_msg_s *msg, io_msg_s *io_msg);
         int send_message(io_msg_s *msg);
+        size_t write_msg(const uint8_t *msg, size_t len);
 
     private:
         uint8_t check_angle(uint8_t angle, uint8_t min, uint8_t max);
@@ -124,6 +210,30 @@ class braccio_arm {
         Stream &serial;
         braccio_angles_s angles;
 
+        // angle telemetry, see SUBSCRIBE_ANGLES
+        uint8_t telem_mode;
+        unsigned long telem_period; // ms
+        unsigned long telem_last; // millis() of the last periodic push
+        braccio_angles_s telem_angles; // angles last pushed
+
+        uint8_t log_level; // see SET_LOG_LEVEL
+        uint8_t log_format;
+
+        uint32_t pending_baud; // set by SET_BAUD, 0 when none
+
+        // seq of the SEQ_CMD_MSG read_msg() last read a header for, -1 for
+        // none, see send_read_finish()
+        int16_t read_seq;
+
+        // bytes read_msg() scans again after a bad frame, see unread()
+        uint8_t rescan[RESCAN_BUFF];
+        uint8_t rescan_pos;
+        uint8_t rescan_len;
+
+        int bad_frame(uint8_t *buff, size_t len, int err);
+        int in_read(uint8_t *buff, size_t len);
+        void unread(const uint8_t *buff, size_t len);
+
         /*
          * NOTE: There is a _Braccio class object declared as extern globably in
          *       Braccio.h named Braccio. We must declare our servos globally
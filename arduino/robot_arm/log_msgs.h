@@ -0,0 +1,60 @@
+#ifndef _LOG_MSGS_H
+#define _LOG_MSGS_H
+
+/*
+ * Interned log messages sent with braccio_arm::send_log().
+ *
+ * Each message has a fixed id. With compact logging on (see SET_LOG_LEVEL)
+ * only the id and the arguments go to the host, which formats the text from
+ * the table generated by python/braccio_robot_arm/gen_log_table.py.
+ * Regenerate that table after changing this list and keep the copies of this
+ * file in robot_arm/ and simulated_robot_arm/ the same.
+ *
+ * Every argument is passed and sent as an unsigned int, 2 bytes little
+ * endian on the wire. Formats can only use %u and %d.
+ *
+ * LOG_MSG(name, id, format)
+ */
+#define LOG_MSGS(LOG_MSG) \
+    LOG_MSG(LOG_SETUP_COMPLETE,    0x01, "Setup Complete\n") \
+    LOG_MSG(LOG_STARTING,          0x02, "Starting Braccio\n") \
+    LOG_MSG(LOG_SETTING_DFLT_POS,  0x03, "setting default position\n") \
+    LOG_MSG(LOG_DFLT_POS_SET,      0x04, "default position set\n" \
+                                         "changed angles, M1: %d, M2: %d, " \
+                                         "M3: %d, M4: %d, M5: %d, M6: %d\n") \
+    LOG_MSG(LOG_CHANGED_ANGLE,     0x05, "Changed M%u angle to %u\n") \
+    LOG_MSG(LOG_CHANGED_ALL,       0x06, "Changed all angles, " \
+                                         "M1: %d, M2: %d, M3: %d, M4: %d, " \
+                                         "M5: %d, M6: %d\n") \
+    LOG_MSG(LOG_CURRENT_ANGLES,    0x07, "Current angles from controller, " \
+                                         "M1: %d, M2: %d, M3: %d, M4: %d, " \
+                                         "M5: %d, M6: %d\n") \
+    LOG_MSG(LOG_TRAJ_FINISHED,     0x08, "Finished trajectory of %u " \
+                                         "waypoints, M1: %d, M2: %d, M3: %d, " \
+                                         "M4: %d, M5: %d, M6: %d\n") \
+    LOG_MSG(LOG_TELEM_MODE,        0x09, "Telemetry mode %u, period %u ms\n") \
+    LOG_MSG(LOG_LEVEL_SET,         0x0A, "Log level %u, compact %u\n") \
+    LOG_MSG(LOG_BAUD_SET,          0x0B, "Switching to %u00 baud\n") \
+    LOG_MSG(LOG_READ_FAILED,       0x40, "Failed to read message from host\n") \
+    LOG_MSG(LOG_INVALID_MSG_TYPE,  0x41, "Invalid message type, not a " \
+                                         "command message\n") \
+    LOG_MSG(LOG_INVALID_CMD,       0x42, "Invalid command recieved.\n") \
+    LOG_MSG(LOG_INVALID_TRAJ_LEN,  0x43, "Invalid trajectory length %u\n") \
+    LOG_MSG(LOG_MISSING_TELEM,     0x44, "Missing telemetry parameters\n") \
+    LOG_MSG(LOG_INVALID_TELEM,     0x45, "Invalid telemetry mode %u\n") \
+    LOG_MSG(LOG_MISSING_LOG_LEVEL, 0x46, "Missing log level\n") \
+    LOG_MSG(LOG_INVALID_LOG_LEVEL, 0x47, "Invalid log level %u\n") \
+    LOG_MSG(LOG_BAD_FRAME,         0x48, "Bad frame crc, message dropped\n") \
+    LOG_MSG(LOG_MISSING_BAUD,      0x49, "Missing baud rate\n") \
+    LOG_MSG(LOG_INVALID_BAUD,      0x4A, "Invalid baud rate index %u\n") \
+    LOG_MSG(LOG_INVALID_TELEM_PERIOD, 0x4B, "Invalid telemetry period %u, " \
+                                            "periodic needs at least 1\n") \
+    LOG_MSG(LOG_INVALID_LOG_FORMAT, 0x4C, "Invalid log format %u\n")
+
+#define LOG_ENUM(name, id, format) name = id,
+enum log_id {
+    LOG_MSGS(LOG_ENUM)
+};
+#undef LOG_ENUM
+
+#endif
@@ -1,8 +1,60 @@
 #include "braccio_arm.h"
 
+// format string of an interned log message, NULL for unknown ids
+#define LOG_CASE(name, id, format) case id: return format;
+static const char *log_format_str(uint8_t id)
+{
+    switch (id) {
+    LOG_MSGS(LOG_CASE)
+    default:
+        return NULL;
+    }
+}
+#undef LOG_CASE
+
 #define SUCCESS 0
 #define FAILURE -1
 
+static const uint32_t baud_rates[] = BAUD_RATES;
+#define NUM_BAUD_RATES (sizeof(baud_rates) / sizeof(baud_rates[0]))
+
+// CRC-8 polynomial 0x07, 0 initial value. Must match crc8.py on the host.
+static const uint8_t crc8_table[256] = {
+    0x00, 0x07, 0x0E, 0x09, 0x1C, 0x1B, 0x12, 0x15, 0x38, 0x3F, 0x36, 0x31,
+    0x24, 0x23, 0x2A, 0x2D, 0x70, 0x77, 0x7E, 0x79, 0x6C, 0x6B, 0x62, 0x65,
+    0x48, 0x4F, 0x46, 0x41, 0x54, 0x53, 0x5A, 0x5D, 0xE0, 0xE7, 0xEE, 0xE9,
+    0xFC, 0xFB, 0xF2, 0xF5, 0xD8, 0xDF, 0xD6, 0xD1, 0xC4, 0xC3, 0xCA, 0xCD,
+    0x90, 0x97, 0x9E, 0x99, 0x8C, 0x8B, 0x82, 0x85, 0xA8, 0xAF, 0xA6, 0xA1,
+    0xB4, 0xB3, 0xBA, 0xBD, 0xC7, 0xC0, 0xC9, 0xCE, 0xDB, 0xDC, 0xD5, 0xD2,
+    0xFF, 0xF8, 0xF1, 0xF6, 0xE3, 0xE4, 0xED, 0xEA, 0xB7, 0xB0, 0xB9, 0xBE,
+    0xAB, 0xAC, 0xA5, 0xA2, 0x8F, 0x88, 0x81, 0x86, 0x93, 0x94, 0x9D, 0x9A,
+    0x27, 0x20, 0x29, 0x2E, 0x3B, 0x3C, 0x35, 0x32, 0x1F, 0x18, 0x11, 0x16,
+    0x03, 0x04, 0x0D, 0x0A, 0x57, 0x50, 0x59, 0x5E, 0x4B, 0x4C, 0x45, 0x42,
+    0x6F, 0x68, 0x61, 0x66, 0x73, 0x74, 0x7D, 0x7A, 0x89, 0x8E, 0x87, 0x80,
+    0x95, 0x92, 0x9B, 0x9C, 0xB1, 0xB6, 0xBF, 0xB8, 0xAD, 0xAA, 0xA3, 0xA4,
+    0xF9, 0xFE, 0xF7, 0xF0, 0xE5, 0xE2, 0xEB, 0xEC, 0xC1, 0xC6, 0xCF, 0xC8,
+    0xDD, 0xDA, 0xD3, 0xD4, 0x69, 0x6E, 0x67, 0x60, 0x75, 0x72, 0x7B, 0x7C,
+    0x51, 0x56, 0x5F, 0x58, 0x4D, 0x4A, 0x43, 0x44, 0x19, 0x1E, 0x17, 0x10,
+    0x05, 0x02, 0x0B, 0x0C, 0x21, 0x26, 0x2F, 0x28, 0x3D, 0x3A, 0x33, 0x34,
+    0x4E, 0x49, 0x40, 0x47, 0x52, 0x55, 0x5C, 0x5B, 0x76, 0x71, 0x78, 0x7F,
+    0x6A, 0x6D, 0x64, 0x63, 0x3E, 0x39, 0x30, 0x37, 0x22, 0x25, 0x2C, 0x2B,
+    0x06, 0x01, 0x08, 0x0F, 0x1A, 0x1D, 0x14, 0x13, 0xAE, 0xA9, 0xA0, 0xA7,
+    0xB2, 0xB5, 0xBC, 0xBB, 0x96, 0x91, 0x98, 0x9F, 0x8A, 0x8D, 0x84, 0x83,
+    0xDE, 0xD9, 0xD0, 0xD7, 0xC2, 0xC5, 0xCC, 0xCB, 0xE6, 0xE1, 0xE8, 0xEF,
+    0xFA, 0xFD, 0xF4, 0xF3
+};
+
+// table driven crc of len bytes, one lookup per byte
+static uint8_t crc8(const uint8_t *data, size_t len)
+{
+    uint8_t crc = 0;
+
+    while (len--)
+        crc = crc8_table[crc ^ *data++];
+
+    return crc;
+}
+
 /*
  * these must be declared for extern variables in the Braccio library
  * in Braccio.cpp
@@ -29,6 +81,19 @@ braccio_arm::braccio_arm(Stream &serial): serial(serial)
     angles.m4 = M4_SAFE_ANGLE;
     angles.m5 = M5_SAFE_ANGLE;
     angles.m6 = M6_SAFE_ANGLE;
+
+    telem_mode = TELEM_OFF;
+    telem_period = 0;
+    telem_last = 0;
+    telem_angles = angles;
+
+    log_level = LOG_VERBOSE;
+    log_format = LOG_TEXT;
+
+    pending_baud = 0;
+    read_seq = -1;
+    rescan_pos = 0;
+    rescan_len = 0;
 }
 
 braccio_arm::~braccio_arm()
@@ -38,7 +103,7 @@ braccio_arm::~braccio_arm()
 // initialize robot arm to default position and sets variables in braccio
 void braccio_arm::init_arm(int soft_start_level)
 {
-    send_verbose("Starting Braccio\n");
+    send_log(PRINT_VERBOSE, LOG_STARTING, 0);
     //braccio.begin(soft_start_level);
     set_default_pos();
 }
@@ -46,7 +111,7 @@ void braccio_arm::init_arm(int soft_start_level)
 // sets all servos to default position
 void braccio_arm::set_default_pos()
 {
-    send_verbose("setting default position\n");
+    send_log(PRINT_VERBOSE, LOG_SETTING_DFLT_POS, 0);
 
     angles.m1 = M1_SAFE_ANGLE;
     angles.m2 = M2_SAFE_ANGLE;
@@ -58,11 +123,9 @@ void braccio_arm::set_default_pos()
      * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
      *                     angles.m4, angles.m5, angles.m6);
      */
-    send_verbose("default position set\n"
-                 "changed angles, M1: %d, M2: %d, M3: %d, "
-                 "M4: %d, M5: %d, M6: %d\n",
-                 angles.m1, angles.m2, angles.m3,
-                 angles.m4, angles.m5, angles.m6);
+    send_log(PRINT_VERBOSE, LOG_DFLT_POS_SET, NUM_ANGLES,
+             angles.m1, angles.m2, angles.m3,
+             angles.m4, angles.m5, angles.m6);
 }
 /*
  * Checks if there is something on the serial monitor. See serial.available()
@@ -70,7 +133,7 @@ void braccio_arm::set_default_pos()
  */
 bool braccio_arm::serial_avail()
 {
-    if (serial.available())
+    if (rescan_pos < rescan_len || serial.available())
         return true;
     return false;
 }
@@ -83,6 +146,133 @@ int braccio_arm::serial_read(uint8_t *buff, size_t len)
     return num_recv;
 }
 
+/*
+ * Reads exactly one message from the host into buff. The header is read first
+ * to get the parameter length so messages the host queued up behind this one
+ * are left on the serial line for the next read.
+ * Sets and returns errno on a short read or if the message does not fit.
+ *
+ * With FRAMED_LINK bytes before the next FRAME_START are skipped, EAGAIN is
+ * returned if none is waiting and EBADMSG if the message is short, does not
+ * fit or the crc does not match. Every byte read after a bad FRAME_START is
+ * scanned again for the next one, see unread(), so a corrupt param_len loses
+ * only its own frame. A bad frame found in those rescanned bytes is most
+ * likely a FRAME_START value inside the bad frame, it is skipped like noise
+ * with EAGAIN.
+ */
+int braccio_arm::read_msg(uint8_t *buff, size_t len)
+{
+    size_t header = CMD_HEADER;
+    uint8_t param_len;
+    int got;
+    int err = EIO;
+
+    read_seq = -1;
+
+#if FRAMED_LINK
+    uint8_t marker;
+    bool rescanned;
+
+    do {
+        if (!serial_avail())
+            return errno = EAGAIN;
+        rescanned = rescan_pos < rescan_len;
+        in_read(&marker, 1);
+    } while (marker != FRAME_START);
+    // a bad frame in rescanned bytes is not one the host sent
+    err = rescanned ? EAGAIN : EBADMSG;
+#endif
+
+    if (in_read(buff, 1) != 1)
+        return errno = err;
+
+    if (buff[0] == SEQ_CMD_MSG)
+        header = SEQ_CMD_HEADER;
+
+    got = 1 + in_read(buff + 1, header - 1);
+    if (got != (int)header)
+        return bad_frame(buff, got, err);
+    if (buff[0] == SEQ_CMD_MSG)
+        read_seq = buff[1];
+
+    param_len = buff[header - 1];
+    if (header + param_len > len) {
+#if FRAMED_LINK
+        return bad_frame(buff, got, err);
+#else
+        // cannot be parsed, drop what is left of it
+        while (serial.available())
+            serial.read();
+        return errno = EINVAL;
+#endif
+    }
+
+    got += in_read(buff + header, param_len);
+    if (got != (int)(header + param_len))
+        return bad_frame(buff, got, err);
+
+#if FRAMED_LINK
+    uint8_t crc;
+
+    if (in_read(&crc, 1) != 1)
+        return bad_frame(buff, got, err);
+    if (crc != crc8(buff, got)) {
+        unread(&crc, 1);
+        return bad_frame(buff, got, err);
+    }
+#endif
+
+    return SUCCESS;
+}
+
+/*
+ * Fails a message read_msg() read len bytes of after its FRAME_START with
+ * err. On a framed link the bytes are handed back to be scanned again.
+ */
+int braccio_arm::bad_frame(uint8_t *buff, size_t len, int err)
+{
+#if FRAMED_LINK
+    unread(buff, len);
+#endif
+    return errno = err;
+}
+
+/*
+ * Reads len bytes, the bytes handed back by unread() first then the serial
+ * line. Returns number of bytes read.
+ */
+int braccio_arm::in_read(uint8_t *buff, size_t len)
+{
+    size_t num_recv = 0;
+
+    while (num_recv < len && rescan_pos < rescan_len)
+        buff[num_recv++] = rescan[rescan_pos++];
+
+    if (num_recv < len)
+        num_recv += serial_read(buff + num_recv, len - num_recv);
+    return num_recv;
+}
+
+/*
+ * Hands len bytes back to in_read(), ahead of any still waiting. Only bytes
+ * read after a dropped FRAME_START come back, so the bytes waiting never
+ * grow past one max size frame.
+ */
+void braccio_arm::unread(const uint8_t *buff, size_t len)
+{
+    size_t left = rescan_len - rescan_pos;
+
+    if (len > RESCAN_BUFF)
+        len = RESCAN_BUFF;
+    if (len + left > RESCAN_BUFF)
+        left = RESCAN_BUFF - len;
+
+    memmove(rescan + len, rescan + rescan_pos, left);
+    memcpy(rescan, buff, len);
+    rescan_pos = 0;
+    rescan_len = len + left;
+}
+
 // fills and sends message to the host, sending all current angles.
 int braccio_arm::send_all_angles()
 {
@@ -107,16 +297,195 @@ int braccio_arm::send_all_angles()
     return SUCCESS;
 }
 
+/*
+ * Sets how angles are pushed to the host, see TELEM_* in braccio_arm.h.
+ * The current angles are pushed right away so the host starts in sync.
+ */
+int braccio_arm::set_telemetry(uint8_t mode, uint8_t period)
+{
+    if (mode > TELEM_ON_CHANGE) {
+        send_log(PRINT_ERROR, LOG_INVALID_TELEM, 1, mode);
+        return errno = EINVAL;
+    }
+    if (mode == TELEM_PERIODIC && period == 0) {
+        send_log(PRINT_ERROR, LOG_INVALID_TELEM_PERIOD, 1, period);
+        return errno = EINVAL;
+    }
+
+    telem_mode = mode;
+    telem_period = (unsigned long)period * TELEM_PERIOD_UNIT;
+    telem_last = millis();
+
+    if (telem_mode != TELEM_OFF) {
+        telem_angles = angles;
+        send_all_angles();
+    }
+
+    send_log(PRINT_VERBOSE, LOG_TELEM_MODE, 2, telem_mode,
+             (unsigned int)telem_period);
+    return SUCCESS;
+}
+
+/*
+ * Pushes the angles to the host if the telemetry mode calls for it, called
+ * every loop and before the FINISH of every command.
+ */
+void braccio_arm::send_telemetry()
+{
+    unsigned long now;
+
+    switch (telem_mode) {
+    case TELEM_PERIODIC:
+        now = millis();
+        if (now - telem_last < telem_period)
+            return;
+        telem_last = now;
+    break;
+    case TELEM_ON_CHANGE:
+        if (!memcmp(&telem_angles, &angles, sizeof(angles)))
+            return;
+    break;
+    default:
+        return;
+    }
+
+    telem_angles = angles;
+    send_all_angles();
+}
+
+/*
+ * Sets the highest print level sent to the host. Suppressed prints return
+ * before formatting anything so they cost no serial time.
+ * format LOG_COMPACT sends send_log() prints as ids instead of text.
+ */
+int braccio_arm::set_log_level(uint8_t level, uint8_t format)
+{
+    if (level > LOG_VERBOSE) {
+        send_log(PRINT_ERROR, LOG_INVALID_LOG_LEVEL, 1, level);
+        return errno = EINVAL;
+    }
+    if (format > LOG_COMPACT) {
+        send_log(PRINT_ERROR, LOG_INVALID_LOG_FORMAT, 1, format);
+        return errno = EINVAL;
+    }
+
+    log_level = level;
+    log_format = format;
+    send_log(PRINT_VERBOSE, LOG_LEVEL_SET, 2, log_level, log_format);
+    return SUCCESS;
+}
+
+/*
+ * Picks the baud rate to switch to once the FINISH for SET_BAUD has gone out,
+ * see take_baud(). index is into BAUD_RATES.
+ */
+int braccio_arm::set_baud(uint8_t index)
+{
+    if (index >= NUM_BAUD_RATES) {
+        send_log(PRINT_ERROR, LOG_INVALID_BAUD, 1, index);
+        return errno = EINVAL;
+    }
+
+    pending_baud = baud_rates[index];
+    send_log(PRINT_VERBOSE, LOG_BAUD_SET, 1,
+             (unsigned int)(pending_baud / 100));
+    return SUCCESS;
+}
+
+// Returns the baud rate set by SET_BAUD and clears it, 0 if there is none
+uint32_t braccio_arm::take_baud()
+{
+    uint32_t baud = pending_baud;
+
+    pending_baud = 0;
+    return baud;
+}
+
+/*
+ * Sends the parameters of an ECHO back to the host as is, the host checks
+ * the link with them.
+ */
+int braccio_arm::send_echo(parsed_msg_s *in_msg)
+{
+    parsed_msg_s out_msg;
+
+    // not set_parsed_msg(), a param_len of 0 there is a string
+    out_msg = *in_msg;
+    out_msg.msg_type = CMD_MSG;
+    out_msg.cmd = ECHO_REPLY;
+    out_msg.msg_size = in_msg->param_len + MSG_SIZE_NO_PARAM - 1;
+
+    return create_send_msg(&out_msg);
+}
+
 void braccio_arm::send_ack()
 {
     uint8_t ack[2] = {1, ACK};
-    serial.write(ack, 2);
+    write_msg(ack, 2);
+}
+
+// acks a message from the host, echoing the id of sequence tagged commands
+void braccio_arm::send_ack(parsed_msg_s *in_msg)
+{
+    uint8_t ack[3] = {2, SEQ_ACK, in_msg->seq};
+
+    if (in_msg->msg_type != SEQ_CMD_MSG) {
+        send_ack();
+        return;
+    }
+
+    write_msg(ack, 3);
 }
 
 void braccio_arm::send_finish()
 {
     uint8_t finish[2] = {1, FINISH};
-    serial.write(finish, 2);
+    write_msg(finish, 2);
+}
+
+// finishes a message from the host, echoing the id of sequence tagged commands
+void braccio_arm::send_finish(parsed_msg_s *in_msg)
+{
+    uint8_t finish[3] = {2, SEQ_FINISH, in_msg->seq};
+
+    if (in_msg->msg_type != SEQ_CMD_MSG) {
+        send_finish();
+        return;
+    }
+
+    write_msg(finish, 3);
+}
+
+/*
+ * Finishes a message read_msg() failed on. Once the header of a sequence
+ * tagged command was read its seq is echoed in a SEQ_NAK, so the host knows
+ * the command was not run, and a SEQ_FINISH so it does not wait on it
+ * forever. Otherwise a plain FINISH goes out.
+ */
+void braccio_arm::send_read_finish()
+{
+    uint8_t nak[3] = {2, SEQ_NAK, 0};
+    uint8_t finish[3] = {2, SEQ_FINISH, 0};
+
+    if (read_seq < 0) {
+        send_finish();
+        return;
+    }
+
+    nak[2] = (uint8_t)read_seq;
+    finish[2] = (uint8_t)read_seq;
+    write_msg(nak, 3);
+    write_msg(finish, 3);
+}
+
+/*
+ * Answers a PING. A PONG is the whole reply so a heartbeat is two bytes back
+ * and can never be taken for the FINISH of a command.
+ */
+void braccio_arm::send_pong()
+{
+    uint8_t pong[2] = {1, PONG};
+    write_msg(pong, 2);
 }
 
 // Sends a general print message to the host, use like printf()
@@ -126,6 +495,9 @@ int braccio_arm::send_print(const char *format, ...)
     uint8_t set_msg[PARAM_BUFF];
     parsed_msg_s out_msg;
 
+    if (log_level < LOG_GENERAL)
+        return SUCCESS;
+
     va_start(args, format);
 
     vsnprintf_check((char*)set_msg, PARAM_BUFF, format, args);
@@ -190,6 +562,9 @@ int braccio_arm::send_verbose(const char *format, ...)
     uint8_t set_msg[PARAM_BUFF];
     parsed_msg_s out_msg;
 
+    if (log_level < LOG_VERBOSE)
+        return SUCCESS;
+
     va_start(args, format);
 
     vsnprintf_check((char*)set_msg, PARAM_BUFF, format, args);
@@ -214,6 +589,67 @@ int braccio_arm::send_verbose(const char *format, ...)
     return SUCCESS;
 }
 
+/*
+ * Sends an interned log message from log_msgs.h, print_cmd is PRINT_GENERAL,
+ * PRINT_ERROR or PRINT_VERBOSE and nargs the number of unsigned int arguments
+ * after it. With LOG_COMPACT only the id and the arguments are sent as a
+ * PRINT_LOG_ID message, otherwise the message is formatted like send_print().
+ */
+int braccio_arm::send_log(uint8_t print_cmd, uint8_t id, uint8_t nargs, ...)
+{
+    va_list args;
+    uint8_t set_msg[PARAM_BUFF];
+    parsed_msg_s out_msg;
+    const char *format;
+    unsigned int arg;
+    uint8_t param_len;
+    uint8_t i;
+
+    if ((print_cmd == PRINT_GENERAL && log_level < LOG_GENERAL) ||
+        (print_cmd == PRINT_VERBOSE && log_level < LOG_VERBOSE))
+        return SUCCESS;
+
+    va_start(args, nargs);
+
+    if (log_format == LOG_COMPACT) {
+        set_msg[0] = print_cmd;
+        set_msg[1] = id;
+        param_len = LOG_ID_HEADER;
+        for (i = 0; i < nargs && param_len + LOG_ARG_LEN <= PARAM_BUFF; ++i) {
+            arg = va_arg(args, unsigned int);
+            set_msg[param_len++] = arg & 0xFF;
+            set_msg[param_len++] = (arg >> 8) & 0xFF;
+        }
+        set_parsed_msg(&out_msg, PRINT_MSG, PRINT_LOG_ID, param_len, set_msg);
+    } else {
+        format = log_format_str(id);
+        if (!format) {
+            va_end(args);
+            send_error("Unknown log id %u\n", id);
+            return FAILURE;
+        }
+        vsnprintf_check((char*)set_msg, PARAM_BUFF, format, args);
+        set_parsed_msg(&out_msg, PRINT_MSG, print_cmd, PARAM_STRLEN, set_msg);
+    }
+
+    va_end(args);
+
+    if (errno) {
+        send_error("Failed to set parameters in parsed message.\n");
+        errno = SUCCESS;
+        return FAILURE;
+    }
+
+    create_send_msg(&out_msg);
+    if (errno) {
+        send_error("Failed to create and send message\n");
+        errno = SUCCESS;
+        return FAILURE;
+    }
+
+    return SUCCESS;
+}
+
 /*
  * Sets the parsed_io_msg struct with desired values, calculates msg_size
  * if param_len value is PARAM_STRLEN, it will strnlen the length of the param
@@ -257,6 +693,11 @@ int braccio_arm::parse_msg(uint8_t *msg, parsed_msg_s *in_msg)
     // parse msg type
     in_msg->msg_type = msg[i++];
 
+    // sequence tagged commands carry their id right after the msg type
+    in_msg->seq = 0;
+    if (in_msg->msg_type == SEQ_CMD_MSG)
+        in_msg->seq = msg[i++];
+
     // parse cmd type
     in_msg->cmd = msg[i++];
 
@@ -283,8 +724,8 @@ int braccio_arm::parse_msg(uint8_t *msg, parsed_msg_s *in_msg)
  */
 int braccio_arm::exec_command(parsed_msg_s *in_msg)
 {
-    if (in_msg->msg_type != CMD_MSG) {
-        send_error("Invalid message type, not a command message");
+    if (in_msg->msg_type != CMD_MSG && in_msg->msg_type != SEQ_CMD_MSG) {
+        send_log(PRINT_ERROR, LOG_INVALID_MSG_TYPE, 0);
         return errno = EINVAL;
     }
 
@@ -295,7 +736,7 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                     angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed M1 angle to %u\n", angles.m1);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ANGLE, 2, 1, angles.m1);
     break;
     case M2_ANGLE:
         angles.m2 = check_angle(in_msg->param[0], M2_MIN_ANGLE, M2_MAX_ANGLE);
@@ -303,7 +744,7 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                    angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed M2 angle to %u\n", angles.m2);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ANGLE, 2, 2, angles.m2);
     break;
     case M3_ANGLE:
         angles.m3 = check_angle(in_msg->param[0], M3_MIN_ANGLE, M3_MAX_ANGLE);
@@ -311,7 +752,7 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                    angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed M3 angle to %u\n", angles.m3);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ANGLE, 2, 3, angles.m3);
     break;
     case M4_ANGLE:
         angles.m4 = check_angle(in_msg->param[0], M4_MIN_ANGLE, M4_MAX_ANGLE);
@@ -319,7 +760,7 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                    angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed M4 angle to %u\n", angles.m4);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ANGLE, 2, 4, angles.m4);
     break;
     case M5_ANGLE:
         angles.m5 = check_angle(in_msg->param[0], M5_MIN_ANGLE, M5_MAX_ANGLE);
@@ -327,7 +768,7 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                    angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed M5 angle to %u\n", angles.m5);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ANGLE, 2, 5, angles.m5);
     break;
     case M6_ANGLE:
         angles.m6 = check_angle(in_msg->param[0], M6_MIN_ANGLE, M6_MAX_ANGLE);
@@ -335,7 +776,7 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                    angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed M6 angle to %u\n", angles.m6);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ANGLE, 2, 6, angles.m6);
     break;
     case MX_ANGLE:
         check_all_angles(in_msg->param[0], in_msg->param[1], in_msg->param[2],
@@ -344,29 +785,87 @@ int braccio_arm::exec_command(parsed_msg_s *in_msg)
          * braccio.ServoMovement(DFLT_STEP_DELAY, angles.m1, angles.m2, angles.m3,
          *                     angles.m4, angles.m5, angles.m6);
          */
-        send_verbose("Changed all angles, "
-                     "M1: %d, M2: %d, M3: %d, M4: %d, M5: %d, M6: %d\n",
-                     angles.m1, angles.m2, angles.m3, angles.m4, angles.m5,
-                     angles.m6);
+        send_log(PRINT_VERBOSE, LOG_CHANGED_ALL, NUM_ANGLES,
+                 angles.m1, angles.m2, angles.m3, angles.m4, angles.m5,
+                 angles.m6);
     break;
     case REQUEST_MX_ANGLE:
         send_all_angles();
-        send_verbose("Current angles from controller, "
-                     "M1: %d, M2: %d, M3: %d, M4: %d, M5: %d, M6: %d\n",
-                     angles.m1, angles.m2, angles.m3, angles.m4, angles.m5,
-                     angles.m6);
+        send_log(PRINT_VERBOSE, LOG_CURRENT_ANGLES, NUM_ANGLES,
+                 angles.m1, angles.m2, angles.m3, angles.m4, angles.m5,
+                 angles.m6);
     break;
     case SET_DFLT_POS:
         set_default_pos();
         break;
+    case TRAJECTORY:
+        return exec_trajectory(in_msg);
+    case SUBSCRIBE_ANGLES:
+        if (in_msg->param_len < 2) {
+            send_log(PRINT_ERROR, LOG_MISSING_TELEM, 0);
+            return errno = EINVAL;
+        }
+        return set_telemetry(in_msg->param[0], in_msg->param[1]);
+    case SET_LOG_LEVEL:
+        if (in_msg->param_len < 1) {
+            send_log(PRINT_ERROR, LOG_MISSING_LOG_LEVEL, 0);
+            return errno = EINVAL;
+        }
+        if (in_msg->param_len < 2)
+            return set_log_level(in_msg->param[0]);
+        return set_log_level(in_msg->param[0], in_msg->param[1]);
+    case SET_BAUD:
+        if (in_msg->param_len < 1) {
+            send_log(PRINT_ERROR, LOG_MISSING_BAUD, 0);
+            return errno = EINVAL;
+        }
+        return set_baud(in_msg->param[0]);
+    case ECHO:
+        return send_echo(in_msg);
+    case CONFIRM_BAUD:
+        break; // the rate is kept by loop()
     default:
-        send_error("Invalid command recieved.\n");
+        send_log(PRINT_ERROR, LOG_INVALID_CMD, 0);
         return errno = EINVAL;
     }
 
     return SUCCESS;
 }
 
+/*
+ * Moves through every waypoint in a TRAJECTORY message back to back, only one
+ * FINISH goes back to the host for the whole list. Each waypoint is the step
+ * delay for the segment followed by the 6 angles, see TRAJ_WAYPOINT_LEN.
+ */
+int braccio_arm::exec_trajectory(parsed_msg_s *in_msg)
+{
+    uint8_t num_waypoints;
+    uint8_t *waypoint;
+    uint8_t i;
+
+    if (in_msg->param_len % TRAJ_WAYPOINT_LEN) {
+        send_log(PRINT_ERROR, LOG_INVALID_TRAJ_LEN, 1, in_msg->param_len);
+        return errno = EINVAL;
+    }
+
+    num_waypoints = in_msg->param_len / TRAJ_WAYPOINT_LEN;
+    for (i=0; i < num_waypoints; ++i) {
+        waypoint = &in_msg->param[i * TRAJ_WAYPOINT_LEN];
+        check_all_angles(waypoint[1], waypoint[2], waypoint[3], waypoint[4],
+                         waypoint[5], waypoint[6]);
+        /*
+         * braccio.ServoMovement(waypoint[0], angles.m1, angles.m2, angles.m3,
+         *                     angles.m4, angles.m5, angles.m6);
+         */
+    }
+
+    send_log(PRINT_VERBOSE, LOG_TRAJ_FINISHED, 1 + NUM_ANGLES,
+             num_waypoints, angles.m1, angles.m2, angles.m3, angles.m4,
+             angles.m5, angles.m6);
+
+    return SUCCESS;
+}
+
 /* Takes a filled parsed_io_msg struct and converts it to an io_msg struct
  * building a serial message and sends it over serial to the host.
  */
@@ -415,7 +914,7 @@ int braccio_arm::send_message(io_msg_s *msg)
 {
     int ret;
 
-    ret = serial.write(msg->msg, msg->len);
+    ret = write_msg(msg->msg, msg->len);
     if (ret != msg->len) {
         errno = EIO;
         return FAILURE;
@@ -424,6 +923,27 @@ int braccio_arm::send_message(io_msg_s *msg)
     return ret;
 }
 
+/*
+ * Writes a whole message to the host, framed with FRAMED_LINK. Returns the
+ * number of message bytes written, not counting the frame.
+ */
+size_t braccio_arm::write_msg(const uint8_t *msg, size_t len)
+{
+#if FRAMED_LINK
+    uint8_t start = FRAME_START;
+    uint8_t crc = crc8(msg, len);
+    size_t ret;
+
+    if (serial.write(&start, 1) != 1)
+        return 0;
+    ret = serial.write(msg, len);
+    serial.write(&crc, 1);
+    return ret;
+#else
+    return serial.write(msg, len);
+#endif
+}
+
                     /* private functions */
 
 // checks if the angle is equal to or between a min and max value
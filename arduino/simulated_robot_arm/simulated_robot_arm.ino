@@ -12,10 +12,16 @@
 #include "braccio_arm.h"
 
 #define BAUD_RATE 115200
-#define S_IN_BUFF 20 // serial input buffer size
+#define S_IN_BUFF (SEQ_CMD_HEADER + PARAM_BUFF) // serial input buffer size
 
 uint8_t serial_in[S_IN_BUFF] = {'\0'};
 
+// see SET_BAUD
+uint32_t baud_rate = BAUD_RATE;
+uint32_t prev_baud_rate = BAUD_RATE;
+bool baud_unconfirmed = false; // no CONFIRM_BAUD yet at the new rate
+unsigned long baud_switched = 0; // millis() of the switch
+
 braccio_arm braccio = braccio_arm(Serial);
 
 void setup()
@@ -27,18 +33,68 @@ void setup()
     // initialize the robot arm, goes to default position
     braccio.init_arm();
     
-    braccio.send_verbose("Setup Complete\n");
+    braccio.send_log(PRINT_VERBOSE, LOG_SETUP_COMPLETE, 0);
     braccio.send_finish();
 }
 
+// Opens the port again at rate once everything sent at the old rate is out
+void switch_baud(uint32_t rate)
+{
+    Serial.flush();
+    Serial.end();
+    Serial.begin(rate);
+}
+
 void loop()
 {
     parsed_msg_s parsed_msg;
+    uint32_t new_baud;
+
     if (braccio.serial_avail()){
-        braccio.serial_read(serial_in, S_IN_BUFF);
-        braccio.send_ack();
+        // one message at a time, the host may have queued more behind it
+        if (braccio.read_msg(serial_in, S_IN_BUFF)) {
+            if (errno == EAGAIN) { // framed link, only noise came in
+                errno = 0;
+                return;
+            }
+
+            if (errno == EBADMSG)
+                braccio.send_log(PRINT_ERROR, LOG_BAD_FRAME, 0);
+            else
+                braccio.send_log(PRINT_ERROR, LOG_READ_FAILED, 0);
+            errno = 0;
+            braccio.send_read_finish();
+            return;
+        }
         braccio.parse_msg(serial_in, &parsed_msg);
+        if (parsed_msg.cmd == PING) {
+            braccio.send_pong();
+            return;
+        }
+        braccio.send_ack(&parsed_msg);
         braccio.exec_command(&parsed_msg);
-        braccio.send_finish();
+        braccio.send_telemetry(); // changed angles go out before the FINISH
+        braccio.send_finish(&parsed_msg);
+
+        // the host got its ECHO_REPLY back at this rate, keep it
+        if (parsed_msg.cmd == CONFIRM_BAUD)
+            baud_unconfirmed = false;
+
+        new_baud = braccio.take_baud();
+        if (new_baud) {
+            prev_baud_rate = baud_rate;
+            baud_rate = new_baud;
+            switch_baud(baud_rate);
+            baud_unconfirmed = true;
+            baud_switched = millis();
+        }
+    } else {
+        braccio.send_telemetry();
+    }
+
+    if (baud_unconfirmed && millis() - baud_switched >= BAUD_CONFIRM_MS) {
+        baud_rate = prev_baud_rate;
+        switch_baud(baud_rate);
+        baud_unconfirmed = false;
     }
 }
@@ -1,34 +1,302 @@
 import serial
+import threading
 import time
+from traffic_log import TO_ARM, FROM_ARM
+
+try:
+    import termios
+except ImportError: # not posix, the port cannot be kept from hanging up
+    termios = None
 
 # Communicates with the arduino controller through the serial interface
+#
+# recorder is an optional traffic_log.traffic_recorder, every write and read
+# is appended to it and it is closed with the port. stats is an optional
+# link_stats.link_stats counting the bytes each way.
+#
+# An error on the port does not raise, it is kept in link_error and the port
+# reads as empty and drops writes until reopen(), see link_monitor.
 class arduino_com:
-    def __init__(self, port, baudrate, rtimeout):
+    PORT_ERRORS = (serial.SerialException, OSError, TypeError)
+
+    def __init__(self, port, baudrate, rtimeout, recorder=None, stats=None):
         self.port = port
         self.baudrate = baudrate
         self.rtimeout = rtimeout
         self.arduino = 0 # will be serial object
+        self.recorder = recorder
+        self.stats = stats
+        self.link_error = None # exception that broke the port
+        self.link_error_time = 0 # time.monotonic() of link_error
+        self.reconnects = 0 # times reopen() opened the port again
 
-    def begin(self, delay=2):
-        self.arduino = serial.Serial(port=self.port, baudrate=self.baudrate,
-                                     timeout=self.rtimeout)
+    # Opens the port and sleeps delay seconds for the arduino to setup. Use
+    # delay=0 and command_interface.wait_setup() to return as soon as the
+    # controller is ready. reset=False opens the port without toggling DTR so
+    # a running controller is not reset, see open_port().
+    def begin(self, delay=2, reset=True):
+        self.open_port(self.rtimeout, reset)
         # arduino resets after serial connection, wait for arduino to setup
         time.sleep(delay)
 
+    # Opening the port normally pulses DTR which resets the arduino. Without
+    # reset DTR and RTS are set low before the port is opened and the port is
+    # set to not hang up (drop DTR) on close, so following opens do not reset
+    # the board either.
+    def open_port(self, timeout, reset=True):
+        self.arduino = serial.Serial(baudrate=self.baudrate, timeout=timeout)
+        self.arduino.port = self.port
+        if (not reset):
+            self.arduino.dtr = False
+            self.arduino.rts = False
+        self.arduino.open()
+
+        if (not reset and termios):
+            attrs = termios.tcgetattr(self.arduino.fileno())
+            attrs[2] &= ~termios.HUPCL # cflag
+            termios.tcsetattr(self.arduino.fileno(), termios.TCSANOW, attrs)
+
+    # Closes the port and opens it again without resetting the controller,
+    # the running controller keeps its pose. Raises the open error if the
+    # port cannot be opened.
+    def reopen(self):
+        self.close_port()
+        self.open_port(self.rtimeout, reset=False)
+        self.link_error = None
+        self.reconnects += 1
+
+    # Closes the serial object, errors from a port already gone are ignored
+    def close_port(self):
+        if (self.arduino):
+            try:
+                self.arduino.close()
+            except self.PORT_ERRORS:
+                pass
+
+    # False once an error has broken the port, until reopen()
+    def link_ok(self):
+        return self.link_error is None
+
+    # Keeps the first error that broke the port. TypeError is raised by
+    # pyserial when the port gets closed out from under a blocking read.
+    def port_error(self, err):
+        if (self.link_error is None):
+            self.link_error = err
+            self.link_error_time = time.monotonic()
+
+    # Changes the baud rate of the open port
+    def set_baudrate(self, baudrate):
+        self.baudrate = baudrate
+        self.arduino.baudrate = baudrate
+
     def write(self, msg, delay=0.05):
-        self.arduino.write(msg)
+        try:
+            self.arduino.write(msg)
+        except self.PORT_ERRORS as err:
+            self.port_error(err)
+            return
+        self.tap(TO_ARM, msg)
         time.sleep(delay)
 
     def read(self, size=1, delay=0.1):
-        reading = self.arduino.read(size)
+        reading = self.read_timeout(size, self.rtimeout)
         time.sleep(delay)
         return reading
 
+    # passes bytes written or read to the recorder and stats
+    def tap(self, direction, data):
+        if (not data):
+            return
+        if (self.recorder):
+            self.recorder.record(direction, data)
+        if (self.stats):
+            if (direction == TO_ARM):
+                self.stats.on_write(len(data))
+            else:
+                self.stats.on_read(len(data))
+
+    # Reads up to size bytes waiting at most timeout seconds, without the
+    # fixed delay read() has. A set cancel event is only seen by the caller
+    # once this read returns, there is nothing to wake a blocked port read.
+    def read_timeout(self, size, timeout, cancel=None):
+        try:
+            self.set_timeout(timeout)
+            reading = self.arduino.read(size)
+        except self.PORT_ERRORS as err:
+            self.port_error(err)
+            time.sleep(timeout) # nothing will come in, do not spin callers
+            return b""
+        self.tap(FROM_ARM, reading)
+        return reading
+
+    def set_timeout(self, timeout):
+        if (self.arduino.timeout != timeout):
+            self.arduino.timeout = timeout
+
+    # wakes reads blocked in read_timeout(), see threaded_arduino_com
+    def wake(self):
+        pass
+
     def read_line(self, delay=0.1):
+        self.set_timeout(self.rtimeout)
         reading = self.arduino.readline()
+        self.tap(FROM_ARM, reading)
         time.sleep(delay)
         return reading
 
+    # number of bytes recieved and waiting to be read
+    def in_waiting(self):
+        try:
+            return self.arduino.in_waiting
+        except self.PORT_ERRORS as err:
+            self.port_error(err)
+            return 0
+
+    # file descriptor of the open port, for select() and selectors
+    def fileno(self):
+        return self.arduino.fileno()
+
     def clear_input_buffer(self):
-        if (self.arduino.in_waiting > 0):
-            self.arduino.reset_input_buffer()
+        try:
+            if (self.arduino.in_waiting > 0):
+                self.arduino.reset_input_buffer()
+        except self.PORT_ERRORS as err:
+            self.port_error(err)
+
+    def close(self):
+        if (self.arduino):
+            self.arduino.close()
+        if (self.recorder):
+            self.recorder.close()
+            self.recorder = None
+
+# Communicates with the arduino controller through the serial interface with a
+# background reader thread that owns the input side of the serial port.
+#
+# The reader thread fills rx_buff as bytes arrive and wakes anything waiting
+# on rx_cond, so read() and read_line() return as soon as the requested bytes
+# are in the buffer (or rtimeout runs out) instead of sleeping a fixed delay.
+# write() goes straight to the port with no delay. The delay arguments are
+# kept so this can be swapped in for arduino_com without changing callers.
+class threaded_arduino_com(arduino_com):
+    RX_CHUNK = 256 # max bytes pulled off the port per reader thread read
+    READER_TIMEOUT = 0.05 # port timeout so the reader thread can see a stop
+
+    def __init__(self, port, baudrate, rtimeout, recorder=None, stats=None):
+        super().__init__(port, baudrate, rtimeout, recorder, stats)
+        self.rx_buff = bytearray()
+        self.rx_cond = threading.Condition()
+        self.reader = None
+        self.running = False
+
+    def begin(self, delay=2, reset=True):
+        self.open_port(self.READER_TIMEOUT, reset)
+        self.start_reader()
+        # arduino resets after serial connection, wait for arduino to setup
+        time.sleep(delay)
+
+    def start_reader(self):
+        self.running = True
+        self.reader = threading.Thread(target=self.reader_loop, daemon=True)
+        self.reader.start()
+
+    def stop_reader(self):
+        self.running = False
+        if (self.reader):
+            self.reader.join()
+            self.reader = None
+
+    # Same as arduino_com.reopen(), the reader thread is started again on
+    # the new port. Bytes buffered from the old port are dropped.
+    def reopen(self):
+        self.stop_reader()
+        self.close_port()
+        with self.rx_cond:
+            self.rx_buff.clear()
+        self.open_port(self.READER_TIMEOUT, reset=False)
+        self.link_error = None
+        self.reconnects += 1
+        self.start_reader()
+        self.wake() # readers waiting on the old port see the reconnect
+
+    # Runs in the reader thread, moves bytes from the port into rx_buff
+    def reader_loop(self):
+        while (self.running):
+            try:
+                waiting = self.arduino.in_waiting
+                reading = self.arduino.read(max(1, min(waiting,
+                                                       self.RX_CHUNK)))
+            except self.PORT_ERRORS as err:
+                with self.rx_cond:
+                    if (self.running):
+                        self.port_error(err)
+                    self.running = False
+                    self.rx_cond.notify_all()
+                return
+
+            if (reading):
+                # recorded as it comes off the port for accurate timestamps
+                self.tap(FROM_ARM, reading)
+                with self.rx_cond:
+                    self.rx_buff += reading
+                    self.rx_cond.notify_all()
+
+    def write(self, msg, delay=0):
+        try:
+            self.arduino.write(msg)
+        except self.PORT_ERRORS as err:
+            self.port_error(err)
+            return
+        self.tap(TO_ARM, msg)
+
+    # Waits until size bytes are buffered or rtimeout passes, returns what was
+    # available like serial.read() does on a timeout.
+    def read(self, size=1, delay=0):
+        return self.read_timeout(size, self.rtimeout)
+
+    # Same as read() waiting at most timeout seconds. Also returns as soon as
+    # cancel is set and wake() is called. With the reader thread stopped on
+    # an error the wait runs out the timeout, until reopen() wakes it.
+    def read_timeout(self, size, timeout, cancel=None):
+        reconnects = self.reconnects
+        with self.rx_cond:
+            self.rx_cond.wait_for(lambda: (len(self.rx_buff) >= size or
+                                           self.reconnects != reconnects or
+                                           (cancel is not None and
+                                            cancel.is_set())),
+                                  timeout=timeout)
+            reading = bytes(self.rx_buff[:size])
+            del self.rx_buff[:size]
+        return reading
+
+    def wake(self):
+        with self.rx_cond:
+            self.rx_cond.notify_all()
+
+    def read_line(self, delay=0):
+        with self.rx_cond:
+            self.rx_cond.wait_for(lambda: (b"\n" in self.rx_buff or
+                                           not self.running),
+                                  timeout=self.rtimeout)
+            end = self.rx_buff.find(b"\n") + 1
+            if (end == 0): # timed out, return everything like readline()
+                end = len(self.rx_buff)
+            reading = bytes(self.rx_buff[:end])
+            del self.rx_buff[:end]
+        return reading
+
+    def in_waiting(self):
+        with self.rx_cond:
+            return len(self.rx_buff)
+
+    def clear_input_buffer(self):
+        with self.rx_cond:
+            try:
+                self.arduino.reset_input_buffer()
+            except self.PORT_ERRORS as err:
+                self.port_error(err)
+            self.rx_buff.clear()
+
+    def close(self):
+        self.stop_reader()
+        super().close()
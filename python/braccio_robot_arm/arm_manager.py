@@ -0,0 +1,165 @@
+import collections
+import selectors
+import time
+from arduino_serial import arduino_com
+from command import command_interface
+from kin import kinematics
+from term import term_utility
+
+# A braccio controlled by arm_manager, each has its own port, decoder,
+# kinematics and predicted angles through its command_interface.
+class managed_arm:
+    def __init__(self, name, port, baudrate, rtimeout, term):
+        self.name = name
+        self.arduino_serial = arduino_com(port, baudrate, rtimeout)
+        self.kin = kinematics()
+        self.cmd = command_interface(self.arduino_serial, self.kin, term)
+
+        self.queue = collections.deque() # (cmd, argv) waiting to be sent
+        self.ready = False # setup FINISH recieved
+        self.busy = False # a command is waiting on its FINISH
+        self.sent = 0
+        self.finished = 0
+
+    def idle(self):
+        return self.ready and not self.busy and len(self.queue) == 0
+
+# Runs several braccio arms from one thread.
+#
+# Every port is registered with a selector, poll() blocks in one select()
+# across all of them and only reads the ports that have data, so an idle
+# arm costs nothing and CPU use does not grow with the number of arms.
+#
+# Each arm has a command queue, a command is sent when the FINISH of the one
+# before it comes back. broadcast() queues the same command on every arm so
+# they all move at once. Not thread safe, queue commands and poll() from the
+# same thread. Selecting on serial ports needs a posix system.
+class arm_manager:
+    def __init__(self, baudrate, rtimeout, verbose=False):
+        self.baudrate = baudrate
+        self.rtimeout = rtimeout
+        self.term = term_utility(verbose)
+        self.selector = selectors.DefaultSelector()
+        self.arms = {} # name -> managed_arm, in the order they were added
+
+    # Opens the port for a new arm. With reset the arm is ready once its setup
+    # FINISH comes in through poll(), without it the controller is expected
+    # to be running already.
+    def add_arm(self, name, port, reset=True):
+        if (name in self.arms):
+            raise ValueError("arm {} already added".format(name))
+
+        arm = managed_arm(name, port, self.baudrate, self.rtimeout, self.term)
+        arm.arduino_serial.begin(delay=0, reset=reset)
+        self.selector.register(arm.arduino_serial.fileno(),
+                               selectors.EVENT_READ, arm)
+        self.arms[name] = arm
+
+        if (not reset):
+            arm.cmd.clear_input()
+            self.set_ready(arm)
+        return arm
+
+    # The arms controller is setup, its angles are requested before anything
+    # queued so the angles of the commands after it can be predicted
+    def set_ready(self, arm):
+        arm.ready = True
+        arm.queue.appendleft((command_interface.REQUEST_MX_ANGLE, ()))
+        self.send_next(arm)
+
+    def remove_arm(self, name):
+        arm = self.arms.pop(name)
+        self.selector.unregister(arm.arduino_serial.fileno())
+        arm.arduino_serial.close()
+
+    def close(self):
+        for name in list(self.arms):
+            self.remove_arm(name)
+        self.selector.close()
+
+    # Queues a command for one arm, it is sent as soon as the arm is idle
+    def queue_cmd(self, name, cmd, *argv):
+        arm = self.arms[name]
+        arm.queue.append((cmd, argv))
+        self.send_next(arm)
+
+    # Queues the same command on every arm
+    def broadcast(self, cmd, *argv):
+        for name in self.arms:
+            self.queue_cmd(name, cmd, *argv)
+
+    def move_all(self, angles):
+        self.broadcast(command_interface.MX_ANGLE, angles[0], angles[1],
+                       angles[2], angles[3], angles[4], angles[5])
+
+    def set_default_pos(self):
+        self.broadcast(command_interface.SET_DFLT_POS)
+
+    def send_next(self, arm):
+        if (not arm.ready or arm.busy or len(arm.queue) == 0):
+            return
+
+        cmd, argv = arm.queue.popleft()
+        # no write delay, a broadcast would block the loop and start the
+        # arms one delay apart
+        with arm.cmd.lock:
+            arm.arduino_serial.write(arm.cmd.build_cmd_msg(cmd, *argv), 0)
+            arm.cmd.predict(cmd, *argv)
+        arm.busy = True
+        arm.sent += 1
+
+    # Waits up to timeout seconds (None blocks) for any arm to send
+    # something, then executes everything that came in. Returns the number
+    # of FINISH messages handled.
+    def poll(self, timeout=None):
+        finished = 0
+        for key, _ in self.selector.select(timeout):
+            finished += self.read_arm(key.data)
+        return finished
+
+    # Reads what is waiting on an arms port without blocking and executes
+    # every complete message
+    def read_arm(self, arm):
+        size = min(max(1, arm.arduino_serial.in_waiting()),
+                   arm.cmd.decoder.space())
+        read = arm.arduino_serial.read_timeout(size, 0)
+        if (read):
+            arm.cmd.decoder.feed(read)
+
+        finished = 0
+        for frame in arm.cmd.decoder.frames():
+            if (not arm.cmd.exec_frame(frame, wait_for_enter=True)):
+                continue
+
+            finished += 1
+            if (not arm.ready):
+                self.set_ready(arm)
+            else:
+                arm.busy = False
+                arm.finished += 1
+                self.send_next(arm)
+        return finished
+
+    def idle(self):
+        return all(arm.idle() for arm in self.arms.values())
+
+    # Polls until every arm is ready with nothing queued or in flight.
+    # Returns False if that did not happen within timeout seconds.
+    def wait_idle(self, timeout=None):
+        deadline = None
+        if (timeout is not None):
+            deadline = time.monotonic() + timeout
+
+        while (not self.idle()):
+            remaining = None
+            if (deadline is not None):
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0):
+                    return False
+            self.poll(remaining)
+        return True
+
+    # returns {name: predicted angles} for every arm
+    def angles(self):
+        return {name: list(arm.kin.angles)
+                for name, arm in self.arms.items()}
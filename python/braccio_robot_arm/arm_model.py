@@ -0,0 +1,65 @@
+# Host side model of how the controller handles angles, kept in sync with the
+# limits in braccio_arm.h and check_angle() in braccio_arm.cpp.
+#
+# The controller clamps every angle it is sent to its servos min and max, so
+# the angles a command leaves the braccio at can be predicted on the host as
+# soon as the command is sent instead of being requested back after every
+# move. Requested (or pushed) angles resync the model, resync_period sets how
+# many predicted commands can go by before a request is needed again.
+class arm_model:
+    NUM_ANGLES = 6
+
+    # M1-M6 min, max and safe angles from braccio_arm.h
+    MIN_ANGLES  = [0, 15, 0, 0, 0, 10]
+    MAX_ANGLES  = [180, 165, 180, 180, 180, 73]
+    SAFE_ANGLES = [0, 140, 0, 10, 90, 73]
+
+    DFLT_RESYNC_PERIOD = 10 # predicted commands between resyncs
+
+    def __init__(self, resync_period=DFLT_RESYNC_PERIOD, verify=False):
+        self.angles = None # predicted controller angles, None until synced
+        self.resync_period = resync_period
+        self.verify = verify # request the angles after every command
+        self.predicted = 0 # commands predicted since the last resync
+
+    # same as check_angle() on the controller, index is 0-5 for M1-M6
+    def clamp_angle(self, index, angle):
+        if (angle < self.MIN_ANGLES[index]):
+            return self.MIN_ANGLES[index]
+        if (angle > self.MAX_ANGLES[index]):
+            return self.MAX_ANGLES[index]
+        return angle
+
+    def clamp_angles(self, angles):
+        return [self.clamp_angle(i, angles[i])
+                for i in range(0, self.NUM_ANGLES)]
+
+    # angles reported by the controller
+    def sync(self, angles):
+        self.angles = list(angles[:self.NUM_ANGLES])
+        self.predicted = 0
+
+    # Applies the effect a command has on the controllers angles.
+    # motor is 0-5 for single angle commands, None for commands that set all
+    # angles. Does nothing until the model has been synced once.
+    def apply_angle(self, motor, angle):
+        if (self.angles is None):
+            return
+        self.angles[motor] = self.clamp_angle(motor, angle)
+        self.predicted += 1
+
+    def apply_all(self, angles):
+        if (self.angles is None):
+            return
+        self.angles = self.clamp_angles(angles)
+        self.predicted += 1
+
+    def apply_default(self):
+        if (self.angles is None):
+            return
+        self.angles = list(self.SAFE_ANGLES)
+        self.predicted += 1
+
+    def needs_resync(self):
+        return (self.verify or self.angles is None or
+                self.predicted >= self.resync_period)
@@ -0,0 +1,121 @@
+import asyncio
+import serial_asyncio
+from command import command_interface
+from frame_decoder import frame_decoder
+
+# asyncio protocol for the serial link to the braccio controller.
+# Feeds the incoming byte stream to a frame_decoder and hands each parsed
+# message to the async_braccio client that owns the connection.
+class braccio_protocol(asyncio.Protocol):
+    def __init__(self, client, framed=False):
+        self.client = client
+        self.transport = None
+        self.decoder = frame_decoder(framed=framed)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        # data can be larger than the decoder has room for in one go
+        data = memoryview(data)
+        while (len(data) > 0):
+            size = min(len(data), self.decoder.space())
+            self.decoder.feed(data[:size])
+            data = data[size:]
+            for frame in self.decoder.frames():
+                self.client.handle_msg(frame)
+
+    def connection_lost(self, exc):
+        self.client.connection_lost(exc)
+
+# asyncio counterpart to arduino_com and command_interface.
+#
+# Each command coroutine writes its message and resolves when the FINISH
+# message for it arrives, so the arm can share one event loop with vision and
+# telemetry code instead of blocking the process inside read_exec(). The
+# controller only runs one command at a time so commands are serialized with
+# a lock, awaiting from several tasks at once queues them up in order.
+class async_braccio:
+    def __init__(self, port, baudrate, kin, term, framed=False):
+        self.port = port
+        self.baudrate = baudrate
+        self.kin = kin
+        self.term = term
+        self.framed = framed
+
+        # used for building and parsing messages, the async client does its
+        # own reading so there is no arduino_com
+        self.cmd = command_interface(None, kin, term, framed=framed)
+
+        self.transport = None
+        self.protocol = None
+        self.lock = None
+        self.finished = None # future resolved by the next FINISH message
+
+    # Opens the serial port and waits for the controllers setup FINISH, then
+    # gets the initial angles. setup_timeout is in seconds, None waits forever.
+    async def begin(self, setup_timeout=None):
+        loop = asyncio.get_running_loop()
+        self.lock = asyncio.Lock()
+
+        self.finished = loop.create_future()
+        self.transport, self.protocol = (
+            await serial_asyncio.create_serial_connection(
+                                        loop,
+                                        lambda: braccio_protocol(self,
+                                                                 self.framed),
+                                        self.port, baudrate=self.baudrate))
+
+        # get setup messages to confirm Arduino is on
+        await asyncio.wait_for(self.finished, setup_timeout)
+
+        await self.set_log_level(self.cmd.term_log_level(),
+                                 self.cmd.LOG_COMPACT)
+
+        return await self.request_angles()
+
+    def close(self):
+        if (self.transport):
+            self.transport.close()
+            self.transport = None
+
+    # Called by braccio_protocol for every parsed incoming message
+    def handle_msg(self, frame):
+        # never wait for enter, that would block the event loop
+        if (self.cmd.exec_frame(frame, wait_for_enter=True)):
+            if (self.finished and not self.finished.done()):
+                self.finished.set_result(True)
+
+    def connection_lost(self, exc):
+        if (self.finished and not self.finished.done()):
+            if (exc is None):
+                exc = ConnectionError("serial connection closed")
+            self.finished.set_exception(exc)
+
+    # Sends a command to the controller and waits for its FINISH message
+    async def send_cmd(self, cmd, *argv):
+        msg = self.cmd.build_cmd_msg(cmd, *argv)
+        async with self.lock:
+            self.finished = asyncio.get_running_loop().create_future()
+            self.transport.write(msg)
+            await self.finished
+
+    async def move(self, motor_cmd, angle):
+        await self.send_cmd(motor_cmd, angle)
+
+    async def move_all(self, angles):
+        await self.send_cmd(self.cmd.MX_ANGLE, angles[0], angles[1],
+                            angles[2], angles[3], angles[4], angles[5])
+
+    async def set_default_pos(self):
+        await self.send_cmd(self.cmd.SET_DFLT_POS)
+
+    async def set_log_level(self, level,
+                            log_format=command_interface.LOG_TEXT):
+        await self.send_cmd(self.cmd.SET_LOG_LEVEL, level, log_format)
+
+    # Requests the angles from the controller, the SENT_ANGLES message updates
+    # kin.angles before the FINISH resolves so the returned list is current.
+    async def request_angles(self):
+        await self.send_cmd(self.cmd.REQUEST_MX_ANGLE)
+        return list(self.kin.angles)
@@ -1,23 +1,56 @@
+import numpy as np
 from command import command_interface
-from arduino_serial import arduino_com
+from arduino_serial import arduino_com, threaded_arduino_com
 from kin import kinematics
 from fuzzy_controller import fuzzy_controller
 from image_processing import image_processing
 from term import term_utility
+from traffic_log import traffic_recorder
+from link_stats import link_stats
+from link_monitor import link_monitor
 
 class braccio_interface:
     EXIT_FLAG_RET = False # Exit value to exit from menu or program
     STAY_FLAG_RET = True # return value for interfaces staying in program
     NUM_SERVOS = 6
 
-    def __init__(self, verbose, port, baudrate, rtimeout):
+    def __init__(self, verbose, port, baudrate, rtimeout, threaded=False,
+                 telemetry=False, verify=False, reset=True,
+                 setup_timeout=command_interface.SETUP_TIMEOUT, record=None,
+                 framed=False, negotiate=False, monitor=False):
         self.term = term_utility(verbose)
-
-        self.arduino_serial = arduino_com(port, baudrate, rtimeout)
+        self.telemetry = telemetry
+        self.negotiate = negotiate # step up to the fastest working baud rate
+        self.reset = reset # reset the controller when opening the port
+        self.setup_timeout = setup_timeout
+
+        # log of all serial traffic for traffic_replay.py
+        recorder = None
+        if (record):
+            recorder = traffic_recorder(record)
+
+        # latency histograms and link counters, cheap enough to always keep
+        self.stats = link_stats()
+
+        # threaded transport reads the port in the background instead of
+        # sleeping a fixed delay on every read and write
+        if (threaded):
+            self.arduino_serial = threaded_arduino_com(port, baudrate,
+                                                       rtimeout, recorder,
+                                                       self.stats)
+        else:
+            self.arduino_serial = arduino_com(port, baudrate, rtimeout,
+                                              recorder, self.stats)
 
         self.kin = kinematics()
 
-        self.cmd = command_interface(self.arduino_serial, self.kin, self.term)
+        # framed must match FRAMED_LINK in the controllers braccio_arm.h
+        self.cmd = command_interface(self.arduino_serial, self.kin, self.term,
+                                     self.stats, framed)
+
+        # request angles back after every command instead of trusting the
+        # angles predicted on the host
+        self.cmd.model.verify = verify
 
         self.fuzzy_con = fuzzy_controller(self.arduino_serial, self.kin,
                                           self.cmd, self.term)
@@ -25,18 +58,53 @@ class braccio_interface:
         self.image_proc = image_processing(self.arduino_serial, self.cmd,
                                            self.kin, self.term)
 
+        # heartbeat that reopens a lost link, started by begin_com()
+        self.monitor = None
+        if (monitor):
+            self.monitor = link_monitor(self.arduino_serial, self.cmd,
+                                        self.stats)
+
     # Starts communication with the braccio controller and gets init angles
     def begin_com(self):
         self.term.clear()
-        self.arduino_serial.begin()
+        self.arduino_serial.begin(delay=0, reset=self.reset)
+
+        if (self.reset):
+            # get setup messages to confirm Arduino is on
+            if (not self.cmd.wait_setup(self.setup_timeout)):
+                self.term.sys_print("Controller setup not finished after {} "
+                                    "seconds\n".format(self.setup_timeout))
+        else:
+            # controller is already running, drop anything left unread by
+            # the last host
+            self.cmd.clear_input()
 
-        # get setup messages to confirm Arduino is on
-        self.cmd.read_exec()
+        # verbose prints are only sent by the controller when they will be
+        # shown, without -v they are never formatted or sent. Log messages
+        # come as ids and are formatted here, see log_table.py
+        self.cmd.set_log_level(self.cmd.term_log_level(),
+                               self.cmd.LOG_COMPACT)
+
+        if (self.negotiate):
+            baudrate = self.cmd.negotiate_baud()
+            self.term.sys_print("Link running at {} baud\n".format(baudrate))
 
         # init angles from Arduino
-        msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-        self.arduino_serial.write(msg)
-        self.cmd.read_exec()
+        self.cmd.exec_cmd(self.cmd.REQUEST_MX_ANGLE)
+
+        # have the controller push angles after each move so they do not
+        # need to be requested after every command
+        if (self.telemetry):
+            self.cmd.subscribe_angles(self.cmd.TELEM_ON_CHANGE)
+
+        if (self.monitor):
+            self.monitor.start()
+
+    # Stops the link monitor and closes the port
+    def end_com(self):
+        if (self.monitor):
+            self.monitor.stop()
+        self.arduino_serial.close()
 
     # Directs the user to various interfaces and options for the braccio robot
     # arm.
@@ -131,6 +199,24 @@ class braccio_interface:
         for i in range(0, self.NUM_SERVOS):
             self.kin.angles[i] = angles[i]
 
+    # Gets an x, y, z target in cm and the end effector pitch in degrees from
+    # the user for the inverse kinematics
+    def get_user_target(self):
+        while (True):
+            print("\nEnter the target x, y, z in cm and the end effector "
+                  "pitch\nin degrees from horizontal ({} points down) "
+                  "separated with commas".format(self.kin.DFLT_PITCH))
+            read = input("Enter target (x, y, z, pitch): ").split(",")
+            try:
+                target = [float(val) for val in read]
+                if (len(target) == 3):
+                    target.append(self.kin.DFLT_PITCH)
+                if (len(target) == 4):
+                    return target
+            except ValueError:
+                pass
+            self.term.input_invalid_wait()
+
     # Get user angles for kin.angles or use the current angles from braccio
     def input_current_or_new_angles(self):
         CURRENT_ANGLES = 1
@@ -220,9 +306,7 @@ class braccio_interface:
         if (cmd_in == EXIT_PROGRAM):
             return self.EXIT_FLAG_RET
         elif (cmd_in == REQUEST_ANGS):
-            msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-            self.arduino_serial.write(msg)
-            self.cmd.read_exec()
+            self.cmd.exec_cmd(self.cmd.REQUEST_MX_ANGLE)
             return self.STAY_FLAG_RET
         elif (cmd_in == ALL_ANGLES):
             # TODO: See if how the angles are converted and checked with
@@ -245,11 +329,10 @@ class braccio_interface:
                 else:
                     print(f"Invalid input - {angles[i]}\n")
 
-            msg = self.cmd.build_cmd_msg(self.cmd.MX_ANGLE, angles[0],
-                                         angles[1], angles[2], angles[3],
-                                         angles[4], angles[5])
+            cmd_args = (self.cmd.MX_ANGLE, angles[0], angles[1], angles[2],
+                        angles[3], angles[4], angles[5])
         elif (cmd_in == SET_DFLT_POS):
-            msg = self.cmd.build_cmd_msg(self.cmd.SET_DFLT_POS)
+            cmd_args = (self.cmd.SET_DFLT_POS,)
         else:
             # TODO: Change from using isdigit to exceptions and maybe check
             # to see if the angle given is between 0 and 180 with an in_range
@@ -267,26 +350,23 @@ class braccio_interface:
                     print("Invalid input\n")
 
             if (cmd_in == M1_BASE):
-                msg = self.cmd.build_cmd_msg(self.cmd.M1_ANGLE, angle)
+                cmd_args = (self.cmd.M1_ANGLE, angle)
             elif (cmd_in == M2_SHOULDER):
-                msg = self.cmd.build_cmd_msg(self.cmd.M2_ANGLE, angle)
+                cmd_args = (self.cmd.M2_ANGLE, angle)
             elif (cmd_in == M3_ELBOW):
-                msg = self.cmd.build_cmd_msg(self.cmd.M3_ANGLE, angle)
+                cmd_args = (self.cmd.M3_ANGLE, angle)
             elif (cmd_in == M4_WRIST_V):
-                msg = self.cmd.build_cmd_msg(self.cmd.M4_ANGLE, angle)
+                cmd_args = (self.cmd.M4_ANGLE, angle)
             elif (cmd_in == M5_WRIST_R):
-                msg = self.cmd.build_cmd_msg(self.cmd.M5_ANGLE, angle)
+                cmd_args = (self.cmd.M5_ANGLE, angle)
             elif (cmd_in == M6_GRIPPER):
-                msg = self.cmd.build_cmd_msg(self.cmd.M6_ANGLE, angle)
+                cmd_args = (self.cmd.M6_ANGLE, angle)
 
-        self.arduino_serial.write(msg)
         self.term.print_verbose("\nreading/exec messages from Arduino\n")
-        self.cmd.read_exec()
-
-        # retrieve changed angles from arduino to ensure it matches in the class
-        msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-        self.arduino_serial.write(msg)
-        self.cmd.read_exec()
+        # make sure the changed angles match in the class, the angle request
+        # only goes to the arduino, in the same write as the command, when the
+        # predicted angles need a resync
+        self.cmd.exec_cmd_sync(*cmd_args)
 
         return self.STAY_FLAG_RET
 
@@ -392,15 +472,36 @@ class braccio_interface:
             self.term.wait_for_enter()
         elif (read == INV_KIN_3DOF): # Three degrees of freedom inverse kin
             print("\n-- Demonstrating Inverse Kinematics with 3 DOF --")
-            self.kin.three_dof_inverse_kin()
+            target = self.get_user_target()
+            angles, valid = self.kin.three_dof_inverse_kin(target[:3],
+                                                           target[3])
+            angles = angles[0]
+            valid = valid[0]
+
+            print("\nSolutions (M1-M6), base facing then turned away:")
+            for i in range(0, self.kin.IK_BRANCHES):
+                if (np.isnan(angles[i]).any()):
+                    print("{}. out of reach".format(i + 1))
+                else:
+                    print("{}. {}{}".format(i + 1,
+                                            np.round(angles[i], 1).tolist(),
+                                            "" if valid[i] else
+                                            " (outside servo limits)"))
+
+            if (valid.any()):
+                solution = [int(round(angle))
+                            for angle in angles[np.argmax(valid)]]
+                read = input("\nMove to the first valid solution? (y/n): ")
+                if (read.lower() == "y"):
+                    self.cmd.exec_cmd_sync(self.cmd.MX_ANGLE, *solution)
+            else:
+                print("\nNo solution inside the servo limits")
             self.term.wait_for_enter()
 
         # Make sure the angles in the kin class match the braccio in case
         # the user changed the kin class angles instead of using the current
         # braccio angles.
-        msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-        self.arduino_serial.write(msg)
-        self.cmd.read_exec()
+        self.cmd.sync_angles()
 
         self.kin.set_kin_vars()
 
@@ -443,14 +544,9 @@ class braccio_interface:
             self.fuzzy_con.fuzzy_controller_exec()
 
             # Return braccio to default position and update the kinematics class
-            msg = self.cmd.build_cmd_msg(self.cmd.SET_DFLT_POS)
-            self.arduino_serial.write(msg)
-            self.cmd.read_exec()
-
-            # update angles and displacement vectors
-            msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-            self.arduino_serial.write(msg)
-            self.cmd.read_exec()
+            # update angles and displacement vectors, the angle request goes
+            # out with the command when needed
+            self.cmd.exec_cmd_sync(self.cmd.SET_DFLT_POS)
 
             self.kin.set_kin_vars()
         elif (read == PRINT_FUZZY_SETS):
@@ -543,7 +639,7 @@ class braccio_interface:
         # change after some testing if time allows. Either way it shouldnt
         # impact anything important even if it is redundantly checking the
         # input buffer.
-        while (self.arduino_serial.arduino.in_waiting > 0):
+        while (self.arduino_serial.in_waiting() > 0):
             self.cmd.read_exec()
 
         # NOTE: In the current implementaion the kinematics class is updated
@@ -0,0 +1,219 @@
+import time
+from collections import OrderedDict
+from write_queue import write_queue
+
+# Sends sequence tagged commands to the controller without waiting for each
+# one to finish before sending the next.
+#
+# Up to window commands can be in flight at once, the controller reads them
+# one at a time off its serial buffer. Each SEQ_ACK and SEQ_FINISH from the
+# controller is matched back to its command by sequence id. Every other
+# message (prints, sent angles) is executed through command_interface the
+# same way read_exec() does.
+#
+# Commands go out through a write_queue, those sent within coalesce seconds
+# of each other are written together. With latest_wins send() never blocks
+# on a full window, MX_ANGLE commands wait in the queue and a newer one
+# drops the one waiting, so only the latest pose goes out once there is
+# room.
+#
+# The command_interface lock is held while commands are in flight so a
+# link_monitor does not read their SEQ_FINISH messages. process() marks the
+# link waiting while it reads and every write or message read counts as
+# activity, the same as read_exec(), so a stalled pipeline is still seen by
+# the link_monitor stall check. Commands written
+# before the port was reopened are failed, their SEQ_FINISH went with the
+# old port.
+#
+# A command the controller could not read is finished with a SEQ_NAK and its
+# SEQ_FINISH after an error print, or with a plain FINISH when not even its
+# header was read, then the oldest written command is taken as the one lost.
+# Commands lost that way, written before a reconnect or still in flight when
+# wait() or drain() time out are listed in lost. Their FINISH never came so
+# they can be sent again.
+class cmd_pipeline:
+    DFLT_WINDOW = 4 # keeps queued commands well inside the controllers buffer
+    SEQ_MOD = 256 # sequence id is one byte on the wire
+    WAIT_TIMEOUT = 10 # s, longer than the slowest move of the braccio
+
+    # in flight command states
+    SENT   = 0
+    ACKED  = 1
+    QUEUED = 2 # waiting in the write queue
+    NAKED  = 3 # not read by the controller, lost on its SEQ_FINISH
+
+    def __init__(self, arduino_serial, cmd, window=DFLT_WINDOW,
+                 coalesce=write_queue.DFLT_WINDOW, latest_wins=False):
+        self.arduino_serial = arduino_serial
+        self.cmd = cmd
+        self.window = window
+        self.latest_wins = latest_wins
+        self.next_seq = 0
+        self.in_flight = OrderedDict() # seq -> state, in send order
+        self.written = 0 # commands in flight that have been written
+        self.holding = False # cmd.lock is held, see hold_link()
+        self.lost = [] # seqs that will never finish, see fail()
+        self.reconnects = arduino_serial.reconnects
+        self.out_queue = write_queue(arduino_serial, coalesce, latest_wins,
+                                     (cmd.MX_ANGLE,))
+
+    # Sends a command once there is room in the window, returns its seq.
+    # With latest_wins it is queued right away instead, a dropped commands
+    # seq is never finished, is_done() is True for it.
+    def send(self, cmd, *argv):
+        if (not self.latest_wins):
+            while (len(self.in_flight) >= self.window):
+                self.process()
+
+        seq = self.next_seq
+        self.next_seq = (self.next_seq + 1) % self.SEQ_MOD
+
+        if (seq in self.lost):
+            self.lost.remove(seq)
+        self.hold_link()
+        self.in_flight[seq] = self.QUEUED
+        msg = self.cmd.build_seq_cmd_msg(seq, cmd, *argv)
+        for dropped in self.out_queue.queue(cmd, msg, seq):
+            del self.in_flight[dropped]
+        self.cmd.predict(cmd, *argv)
+
+        if (self.out_queue.expired()):
+            self.flush()
+        return seq
+
+    # Writes queued commands, as many as there is room for in the window
+    def flush(self):
+        for seq in self.out_queue.flush(self.window - self.written):
+            self.in_flight[seq] = self.SENT
+            self.written += 1
+            self.cmd.last_activity = time.monotonic()
+
+    # Holds cmd.lock from the first command in flight until the last finishes
+    def hold_link(self):
+        if (not self.holding):
+            self.cmd.lock.acquire()
+            self.holding = True
+
+    def release_link(self):
+        if (self.holding and len(self.in_flight) == 0):
+            self.holding = False
+            self.cmd.lock.release()
+
+    # Fails written commands once the port has been reopened
+    def check_reconnect(self):
+        if (self.arduino_serial.reconnects == self.reconnects):
+            return
+        self.reconnects = self.arduino_serial.reconnects
+        for seq, state in list(self.in_flight.items()):
+            if (state != self.QUEUED):
+                self.fail(seq)
+
+    # Gives up on a command in flight, it is added to lost
+    def fail(self, seq):
+        state = self.in_flight.pop(seq, None)
+        if (state is None):
+            return
+        if (state != self.QUEUED):
+            self.written -= 1
+        self.lost.append(seq)
+        self.cmd.term.print_verbose("Lost seq {}\n".format(seq))
+        self.release_link()
+
+    def is_done(self, seq):
+        return seq not in self.in_flight
+
+    # Waits at most timeout seconds for a single command to finish. Returns
+    # True if it finished, False if it was lost or timed out, then it is
+    # failed and listed in lost.
+    def wait(self, seq, timeout=WAIT_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while (seq in self.in_flight):
+            if (time.monotonic() >= deadline):
+                self.fail(seq)
+                break
+            self.process()
+        return seq not in self.lost
+
+    # Waits at most timeout seconds for every command in flight to finish.
+    # Commands left after that are failed. Returns the seqs lost while
+    # draining, an empty list when everything finished.
+    def drain(self, timeout=WAIT_TIMEOUT):
+        lost = len(self.lost)
+        deadline = time.monotonic() + timeout
+        while (len(self.in_flight) > 0):
+            if (time.monotonic() >= deadline):
+                for seq in list(self.in_flight):
+                    self.fail(seq)
+                break
+            self.process()
+        return self.lost[lost:]
+
+    # Executes buffered messages, reading from the port if there were none.
+    # Blocks at most the serial read timeout. Reads go through
+    # read_timeout() like read_exec(), arduino_com.read() sleeps after every
+    # read.
+    def process(self):
+        self.check_reconnect()
+        self.flush()
+        if (not self.exec_frames()):
+            self.cmd.waiting = True
+            try:
+                self.cmd.read_in(self.arduino_serial.rtimeout)
+            finally:
+                self.cmd.waiting = False
+            self.exec_frames()
+
+    # Executes whatever has arrived without waiting on the controller
+    # and writes queued commands that have waited out the coalesce window
+    def poll(self):
+        self.check_reconnect()
+        if (self.arduino_serial.in_waiting() > 0):
+            self.cmd.read_in(0)
+        self.exec_frames()
+        if (self.out_queue.expired()):
+            self.flush()
+
+    # Executes every message in the decoder, returns how many there were
+    def exec_frames(self):
+        count = 0
+        for frame in self.cmd.decoder.frames():
+            count += 1
+            if (frame.msg_type == self.cmd.SEQ_ACK):
+                if (frame.seq in self.in_flight):
+                    self.in_flight[frame.seq] = self.ACKED
+                self.cmd.exec_frame(frame)
+            elif (frame.msg_type == self.cmd.SEQ_NAK):
+                if (frame.seq in self.in_flight):
+                    self.in_flight[frame.seq] = self.NAKED
+                self.cmd.exec_frame(frame)
+            elif (frame.msg_type == self.cmd.SEQ_FINISH):
+                if (self.cmd.stats):
+                    self.cmd.stats.on_frame(frame.msg_type, frame.cmd)
+                    self.cmd.stats.on_finish()
+                if (self.in_flight.get(frame.seq) == self.NAKED):
+                    self.fail(frame.seq)
+                    continue
+                state = self.in_flight.pop(frame.seq, None)
+                if (state is None):
+                    self.cmd.term.print_verbose("Finish for unknown seq "
+                                                "{}\n".format(frame.seq))
+                else:
+                    if (state != self.QUEUED):
+                        self.written -= 1
+                    self.cmd.term.print_verbose("Arduino finished seq "
+                                                "{}\n".format(frame.seq))
+                self.release_link()
+            elif (frame.msg_type == self.cmd.FINISH):
+                # the controller could not read a command header, that is
+                # the oldest one written it has not acked
+                self.cmd.exec_frame(frame, wait_for_enter=True)
+                for seq, state in self.in_flight.items():
+                    if (state == self.SENT):
+                        self.fail(seq)
+                        break
+            else:
+                # never wait for enter in the middle of a pipeline
+                self.cmd.exec_frame(frame, wait_for_enter=True)
+        if (count):
+            self.cmd.last_activity = time.monotonic()
+        return count
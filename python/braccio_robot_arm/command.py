@@ -1,172 +1,762 @@
 import struct
+import threading
+import time
 from term import term_utility
+from frame_decoder import frame_decoder, parse_frame
+from frame_decoder import FRAME_START, FRAME_OVERHEAD
+from crc8 import crc8
+from telemetry import state_cache
+from arm_model import arm_model
+from log_table import LOG_MSGS
+from write_queue import write_queue
+from protocol import protocol
 
 # see docs.python.org/3/library/struct.html for more information on struct
 # methods.
 
-class command_interface:
-    # message types
-    CMD_MSG   = 0x0
-    PRINT_MSG = 0x1
-    ACK       = 0x2
-    FINISH    = 0x3
-
-    # incomming message command
-    PRINT_GENERAL = 0x0
-    PRINT_ERROR   = 0x1
-    PRINT_VERBOSE = 0x2
-    SENT_ANGLES   = 0x3
-
-    # outgoing message command
-    M1_ANGLE = 0x1
-    M2_ANGLE = 0x2
-    M3_ANGLE = 0x3
-    M4_ANGLE = 0x4
-    M5_ANGLE = 0x5
-    M6_ANGLE = 0x6
-    MX_ANGLE = 0x7
-    REQUEST_MX_ANGLE = 0x8
-    SET_DFLT_POS = 0x9
+# Result of command_interface.read_exec()
+class exec_result:
+    __slots__ = ("frames", "elapsed", "finished", "timed_out", "cancelled",
+                 "reconnected")
+
+    def __init__(self):
+        self.frames = 0 # messages executed
+        self.elapsed = 0 # s
+        self.finished = False # FINISH recieved
+        self.timed_out = False
+        self.cancelled = False
+        self.reconnected = False # port reopened, see link_monitor
+
+    def __repr__(self):
+        return ("exec_result(frames={}, elapsed={:.3f}, finished={}, "
+                "timed_out={}, cancelled={}, reconnected={})".format(
+                                                     self.frames,
+                                                     self.elapsed,
+                                                     self.finished,
+                                                     self.timed_out,
+                                                     self.cancelled,
+                                                     self.reconnected))
+
+# Message types and command ids come from protocol, see protocol.py.
+class command_interface(protocol):
+    # PRINT_LOG_ID params, [print cmd][log id][2 bytes per argument]
+    LOG_ID_HEADER = 2
+
+    # SUBSCRIBE_ANGLES modes, see braccio_arm.h
+    TELEM_OFF       = 0 # only send angles when requested
+    TELEM_PERIODIC  = 1 # push angles every period
+    TELEM_ON_CHANGE = 2 # push angles before the FINISH of a changing command
+    TELEM_PERIOD_UNIT = 10 # ms per unit of the period parameter
+
+    # SET_LOG_LEVEL levels, see braccio_arm.h
+    LOG_ERROR   = 0 # only PRINT_ERROR messages
+    LOG_GENERAL = 1 # PRINT_ERROR and PRINT_GENERAL messages
+    LOG_VERBOSE = 2 # every print message, controller default
+
+    # SET_LOG_LEVEL formats
+    LOG_TEXT    = 0 # controller formats every print, controller default
+    LOG_COMPACT = 1 # log messages are sent as PRINT_LOG_ID, see log_table.py
+
+    # SET_BAUD rates by index, see BAUD_RATES in braccio_arm.h
+    BAUD_RATES = (9600, 19200, 38400, 57600, 115200, 230400, 250000, 460800,
+                  500000, 921600, 1000000, 2000000)
+    BAUD_CONFIRM = 1.0 # s, controller goes back to the old rate without a
+                       # CONFIRM_BAUD at the new one, BAUD_CONFIRM_MS
+    BAUD_SETTLE = 0.05 # s, for the controller to open its port again
+    ECHO_TIMEOUT = 0.5 # s
+    PING_TIMEOUT = 0.5 # s
+    RESTORE_TIMEOUT = 10 # s, a move back to the commanded pose can be long
+    # loopback check, every bit set and clear next to each other
+    ECHO_PATTERN = bytes((0x00, 0xFF, 0x55, 0xAA, 0x0F, 0xF0, 0x33, 0xCC)) * 4
 
     UBYTE_MAX = 255
     UBYTE_MIN = 0
 
-    def __init__(self, arduino_serial, kin, term):
+    # see braccio_arm.h
+    PARAM_BUFF = 150 # max parameter bytes in a message to the controller
+    DFLT_STEP_DELAY = 20 # ms between each degree step of the servos
+
+    SETUP_TIMEOUT = 10 # s, setup includes the Braccio 6 s soft start
+
+    # TRAJECTORY waypoints are the step delay followed by the 6 angles
+    TRAJ_WAYPOINT_LEN = 7
+    TRAJ_MAX_WAYPOINTS = PARAM_BUFF // TRAJ_WAYPOINT_LEN
+
+    # header bytes before the parameters of outgoing messages
+    CMD_HEADER     = 3 # msg_type, cmd, param_len
+    SEQ_CMD_HEADER = 4 # msg_type, seq, cmd, param_len
+
+    # number of parameters each outgoing command takes, None when it takes
+    # a variable number of parameters
+    CMD_PARAM_COUNT = {
+        protocol.M1_ANGLE        : 1,
+        protocol.M2_ANGLE        : 1,
+        protocol.M3_ANGLE        : 1,
+        protocol.M4_ANGLE        : 1,
+        protocol.M5_ANGLE        : 1,
+        protocol.M6_ANGLE        : 1,
+        protocol.MX_ANGLE        : 6,
+        protocol.REQUEST_MX_ANGLE: 0,
+        protocol.SET_DFLT_POS    : 0,
+        protocol.TRAJECTORY      : None,
+        protocol.SUBSCRIBE_ANGLES: 2,
+        protocol.SET_LOG_LEVEL   : 2,
+        protocol.SET_BAUD        : 1,
+        protocol.ECHO            : None,
+        protocol.PING            : 0,
+        protocol.CONFIRM_BAUD    : 0,
+    }
+
+    # compiled struct per (msg_type, cmd, param_len), see msg_struct()
+    MSG_STRUCTS = {}
+
+    # compiled struct per number of PRINT_LOG_ID arguments, see format_log()
+    LOG_ARG_STRUCTS = {}
+
+    # stats is an optional link_stats.link_stats, ACK and FINISH times and
+    # frame counts are added to it
+    # framed must match FRAMED_LINK in the controllers braccio_arm.h
+    def __init__(self, arduino_serial, kin, term, stats=None, framed=False):
         self.arduino_serial = arduino_serial
         self.kin = kin
+        self.stats = stats
         self.term = term
+        self.framed = framed
+        self.decoder = frame_decoder(framed=framed)
+
+        # latest angles from the controller, see subscribe_angles()
+        self.state = state_cache()
+        self.telem_mode = self.TELEM_OFF
+
+        # predicted controller angles, see predict() and sync_angles()
+        self.model = arm_model()
+
+        # parameters of the last ECHO_REPLY, see echo()
+        self.echo_reply = None
+
+        # commands waiting to go out in one write, see queue_cmd()
+        self.out_queue = write_queue(arduino_serial)
+
+        # Held from writing a command until its FINISH is read so another
+        # thread (link_monitor) never reads the FINISH of someone elses
+        # command. Reentrant, the command methods nest.
+        self.lock = threading.RLock()
+        # time.monotonic() of the last frame or command, and whether a
+        # read_exec() is waiting on the port, for link_monitor
+        self.last_activity = time.monotonic()
+        self.waiting = False
+        self.last_pong = 0 # time.monotonic() of the last PONG
+
+        # incoming message handlers by msg_type, see exec_frame()
+        self.frame_handlers = {
+            self.ACK       : self.handle_ack,
+            self.SEQ_ACK   : self.handle_ack,
+            self.PRINT_MSG : self.handle_print,
+            self.CMD_MSG   : self.handle_command,
+            self.FINISH    : self.handle_finish,
+            self.PONG      : self.handle_pong,
+        }
 
     # Read a message from the braccio controller.
     # NOTE: Loops waiting for the finish sending command from the controller.
     #       Only call when something should be returning from the controller.
-    # TODO: Make a timer so if there is no response it moves on or calls
-    #       an error.
-    def read_exec(self, wait_for_enter=False):
-        finished = False
-        while (not finished):
-            read = self.arduino_serial.read()
-            if (read):
-                msg_size = int.from_bytes(read, byteorder="little",
-                                          signed=False)
-                read = self.arduino_serial.read(msg_size)
-                p_msg = self.parse_in_msg(read)
-                if (p_msg[0] == self.ACK):
-                    self.term.print_verbose("\nACK recieved\n")
-                elif (p_msg[0] == self.PRINT_MSG):
-                    self.exec_print(p_msg)
-                elif(p_msg[0] == self.CMD_MSG):
-                    self.exec_command(p_msg)
-                    self.kin.set_kin_vars()
-                elif(p_msg[0] == self.FINISH):
-                    self.term.print_verbose("Arduino finished sending msg\n")
-                    if (self.term.check_verbose() and not wait_for_enter):
-                        input("--- Press Enter to Continue ---")
-                    finished = True
+    # timeout bounds the wait in seconds, None waits for the FINISH forever.
+    # cancel is a threading.Event another thread can set with cancel_read()
+    # to stop the wait. Each wait is a blocking serial read of at most the
+    # time left, the port is not polled. finishes is the number of FINISH
+    # messages to wait for, one per command written together, only the last
+    # one waits for enter. Stops early if the port is reopened while waiting,
+    # the FINISH may have been lost with the old port. Returns an
+    # exec_result.
+    def read_exec(self, wait_for_enter=False, timeout=None, cancel=None,
+                  finishes=1):
+        with self.lock:
+            result = exec_result()
+            finished = 0
+            start = time.monotonic()
+            reconnects = self.arduino_serial.reconnects
+            self.last_activity = start
+            deadline = None
+            if (timeout is not None):
+                deadline = start + timeout
+
+            while (True):
+                # messages left over from the last read come first
+                for frame in self.decoder.frames():
+                    result.frames += 1
+                    last = (finished == finishes - 1)
+                    if (self.exec_frame(frame, wait_for_enter or not last)):
+                        finished += 1
+                        if (finished >= finishes):
+                            result.finished = True
+                            break
+
+                if (result.finished):
+                    break
+                if (cancel is not None and cancel.is_set()):
+                    result.cancelled = True
+                    break
+                if (self.arduino_serial.reconnects != reconnects):
+                    # anything partly read came from the old port
+                    self.decoder.reset()
+                    result.reconnected = True
+                    break
+
+                read_timeout = self.arduino_serial.rtimeout
+                if (deadline is not None):
+                    remaining = deadline - time.monotonic()
+                    if (remaining <= 0):
+                        result.timed_out = True
+                        break
+                    read_timeout = min(read_timeout, remaining)
+
+                self.waiting = True
+                try:
+                    self.read_in(read_timeout, cancel)
+                finally:
+                    self.waiting = False
+
+            result.elapsed = time.monotonic() - start
+            return result
+
+    # Stops a read_exec() waiting with cancel from another thread
+    def cancel_read(self, cancel):
+        cancel.set()
+        self.arduino_serial.wake()
+
+    # Waits for the FINISH that ends the controllers setup messages, it comes
+    # right after "Setup Complete". Returns False if it has not come within
+    # timeout seconds. Used instead of sleeping a fixed time after the port
+    # is opened.
+    def wait_setup(self, timeout=SETUP_TIMEOUT):
+        return self.read_exec(wait_for_enter=True, timeout=timeout).finished
+
+    # Reads from the serial port into the decoder. Drains everything waiting
+    # on the port in one read, at least one byte so the read waits on the
+    # controller when nothing is there. Returns the number of bytes read.
+    # With a timeout the read waits at most timeout seconds, see read_exec().
+    def read_in(self, timeout=None, cancel=None):
+        size = min(max(1, self.arduino_serial.in_waiting()),
+                   self.decoder.space())
+        if (timeout is None):
+            read = self.arduino_serial.read(size)
+        else:
+            read = self.arduino_serial.read_timeout(size, timeout, cancel)
+        if (read):
+            self.decoder.feed(read)
+        return len(read)
+
+    # Executes a parsed incoming message, returns True on FINISH
+    def exec_frame(self, frame, wait_for_enter=False):
+        self.last_activity = time.monotonic()
+        if (self.stats):
+            self.stats.on_frame(frame.msg_type, frame.cmd)
+
+        handler = self.frame_handlers.get(frame.msg_type)
+        if (handler is None):
+            return False
+        return handler(frame, wait_for_enter)
+
+    # frame_handlers, each returns True when the controller is finished
+    def handle_ack(self, frame, wait_for_enter):
+        if (self.stats):
+            self.stats.on_ack()
+
+        if (frame.seq is None):
+            self.term.print_verbose("\nACK recieved\n")
+        else:
+            self.term.print_verbose("\nACK recieved, seq {}\n".format(
+                                                                frame.seq))
+        return False
+
+    def handle_print(self, frame, wait_for_enter):
+        if (not self.stats or not self.is_verbose_print(frame)):
+            self.exec_print(frame)
+            return False
+
+        start = time.perf_counter()
+        self.exec_print(frame)
+        # msg_size, msg_type, cmd and param_len bytes plus the params
+        self.stats.on_verbose(frame.param_len + 4,
+                              time.perf_counter() - start)
+        return False
+
+    def is_verbose_print(self, frame):
+        if (frame.cmd == self.PRINT_LOG_ID):
+            return (frame.param_len > 0 and
+                    frame.param[0] == self.PRINT_VERBOSE)
+        return frame.cmd == self.PRINT_VERBOSE
+
+    def handle_command(self, frame, wait_for_enter):
+        self.exec_command(frame)
+        return False
+
+    def handle_finish(self, frame, wait_for_enter):
+        if (self.stats):
+            self.stats.on_finish()
+
+        self.term.print_verbose("Arduino finished sending msg\n")
+        if (self.term.check_verbose() and not wait_for_enter):
+            input("--- Press Enter to Continue ---")
+        return True
+
+    def handle_pong(self, frame, wait_for_enter):
+        self.last_pong = time.monotonic()
+        return False
+
+    # Clears the serial input buffer along with any partial message the
+    # decoder is holding.
+    def clear_input(self):
+        self.arduino_serial.clear_input_buffer()
+        self.decoder.reset()
+
+    # Sends a command and updates kin.angles with the angles the controller
+    # will clamp them to, without waiting on the controller.
+    def send_cmd(self, cmd, *argv):
+        with self.lock:
+            self.arduino_serial.write(self.build_cmd_msg(cmd, *argv))
+            self.predict(cmd, *argv)
+
+    # Sends a command and reads/executes messages until its FINISH
+    def exec_cmd(self, cmd, *argv, wait_for_enter=False, timeout=None):
+        with self.lock:
+            self.send_cmd(cmd, *argv)
+            return self.read_exec(wait_for_enter, timeout)
+
+    # Queues a command to go out with the next flush(), the model is updated
+    # as it is queued
+    def queue_cmd(self, cmd, *argv):
+        with self.lock:
+            self.out_queue.queue(cmd, self.build_cmd_msg(cmd, *argv))
+            self.predict(cmd, *argv)
+
+    # Writes every queued command in one write, returns how many went out.
+    # Each one sends its own FINISH.
+    def flush(self):
+        return len(self.out_queue.flush())
+
+    # exec_cmd() followed by sync_angles(), when the angles need a resync the
+    # request goes out in the same write as the command. Otherwise kin
+    # already has the predicted angles.
+    def exec_cmd_sync(self, cmd, *argv, wait_for_enter=False, timeout=None):
+        with self.lock:
+            self.queue_cmd(cmd, *argv)
+            if (self.model.needs_resync()):
+                self.queue_cmd(self.REQUEST_MX_ANGLE)
+            return self.read_exec(wait_for_enter, timeout,
+                                  finishes=self.flush())
+
+    # Updates the model with the effect of a command sent to the controller
+    # and copies the predicted angles into kin.angles.
+    def predict(self, cmd, *argv):
+        if (cmd >= self.M1_ANGLE and cmd <= self.M6_ANGLE):
+            self.model.apply_angle(cmd - self.M1_ANGLE, argv[0])
+        elif (cmd == self.MX_ANGLE):
+            self.model.apply_all(argv)
+        elif (cmd == self.SET_DFLT_POS):
+            self.model.apply_default()
+        elif (cmd == self.TRAJECTORY):
+            # ends at the last waypoint, skip its step delay
+            if (len(argv) >= self.TRAJ_WAYPOINT_LEN and
+                len(argv) % self.TRAJ_WAYPOINT_LEN == 0):
+                self.model.apply_all(argv[-self.TRAJ_WAYPOINT_LEN+1:])
+        else:
+            return
+
+        if (self.model.angles is not None):
+            for i in range(0,6):
+                self.kin.angles[i] = self.model.angles[i]
+            self.kin.set_kin_vars()
+
+    # Returns the compiled struct for an outgoing message, every field is an
+    # unsigned byte so the format only depends on the message length. Built
+    # once per message shape and cached.
+    def msg_struct(self, msg_type, cmd, param_len):
+        key = (msg_type, cmd, param_len)
+        msg_struct = self.MSG_STRUCTS.get(key)
+        if (msg_struct is None):
+            header = self.CMD_HEADER
+            if (msg_type == self.SEQ_CMD_MSG):
+                header = self.SEQ_CMD_HEADER
+            msg_struct = struct.Struct("{}B".format(header + param_len))
+            self.MSG_STRUCTS[key] = msg_struct
+        return msg_struct
+
+    # Returns the parameters sent with cmd clamped to unsigned bytes. None if
+    # cmd is not a known command. Raises ValueError if a fixed size command
+    # is not given exactly its parameters or there are more than the
+    # controller can take, it would act on stale bytes or drop its input.
+    def cmd_params(self, cmd, argv):
+        if (cmd not in self.CMD_PARAM_COUNT):
+            return None
+
+        count = self.CMD_PARAM_COUNT[cmd]
+        if (count is not None and len(argv) != count):
+            raise ValueError("command {:#x} takes {} parameters, {} "
+                             "given".format(cmd, count, len(argv)))
+        if (len(argv) > self.PARAM_BUFF):
+            raise ValueError("{} parameters for command {:#x}, the "
+                             "controller takes at most {}".format(
+                                            len(argv), cmd, self.PARAM_BUFF))
+
+        # struct is using unsigned bytes so the arguments cannot exceed
+        # UBYTE_MAX or be under UBYTE_MIN, only clamp when one is out of range
+        if (len(argv) > 0 and
+            (max(argv) > self.UBYTE_MAX or min(argv) < self.UBYTE_MIN)):
+            argv = [min(max(arg, self.UBYTE_MIN), self.UBYTE_MAX)
+                    for arg in argv]
+        return argv
 
     # Builds a command type message in proper format for writing to serial
+    # message layout: msg type, command issued, num of parameters, params*
+    # framed with frame_msg() on a framed link
     def build_cmd_msg(self, cmd, *argv):
-        msg = 0
-        arg = argv
-        checked_arg = []
-
-        # - struct classs is using unsigned bytes in our use case so the passed
-        #   arguments cannot exceed UBYTE_MAX or be under UBYTE_MIN
-        for i in range(0, len(arg)):
-            if (arg[i] > self.UBYTE_MAX):
-                checked_arg.append(self.UBYTE_MAX)
-            elif (arg[i] < self.UBYTE_MIN):
-                checked_arg.append(self.UBYTE_MIN)
-            else:
-                checked_arg.append(arg[i])
-
-        # Arguemnts for pack, pack(#ofargs->type, msg type, command issued,
-        #                          num of arguments after command issued, argv*)
-        # 9B = 9 args, unsigned char (python type - ubyte)
-        if (cmd == self.MX_ANGLE):
-            msg = struct.pack("9B", self.CMD_MSG, cmd, 6, checked_arg[0],
-                              checked_arg[1], checked_arg[2], checked_arg[3],
-                              checked_arg[4], checked_arg[5])
-        elif (cmd == self.M1_ANGLE or cmd == self.M2_ANGLE or
-              cmd == self.M3_ANGLE or cmd == self.M4_ANGLE or
-              cmd == self.M5_ANGLE or cmd == self.M6_ANGLE):
-            msg =  struct.pack("4B", self.CMD_MSG, cmd, 1, checked_arg[0])
-        elif (cmd == self.REQUEST_MX_ANGLE):
-            msg = struct.pack("3B", self.CMD_MSG, cmd, 0)
-        elif (cmd == self.SET_DFLT_POS):
-            msg = struct.pack("3B", self.CMD_MSG, cmd, 0)
+        param = self.cmd_params(cmd, argv)
+        if (param is None):
+            return 0
 
-        return msg
+        msg = self.msg_struct(self.CMD_MSG, cmd, len(param)).pack(
+                                        self.CMD_MSG, cmd, len(param), *param)
+        return self.frame_msg(msg)
 
-    # Parse out a incomming message from the arduino controller.
-    # Parsed messages unpack as a tupile even if its one value.
-    def parse_in_msg(self, msg):
-        parsed = 0
+    # Same as build_cmd_msg but packs the message into buff at offset instead
+    # of making a new bytes object. Returns the number of bytes packed, on a
+    # framed link that includes FRAME_OVERHEAD.
+    def build_cmd_msg_into(self, buff, offset, cmd, *argv):
+        param = self.cmd_params(cmd, argv)
+        if (param is None):
+            return 0
 
-        parsed = struct.unpack("B", msg[:1])
-        if (parsed[0] == self.ACK):
-            return parsed
-        elif (parsed[0] == self.FINISH):
-            return parsed
+        msg_struct = self.msg_struct(self.CMD_MSG, cmd, len(param))
+        if (not self.framed):
+            msg_struct.pack_into(buff, offset, self.CMD_MSG, cmd, len(param),
+                                 *param)
+            return msg_struct.size
 
-        parsed = struct.unpack("3B", msg[:3])
+        msg_struct.pack_into(buff, offset + 1, self.CMD_MSG, cmd, len(param),
+                             *param)
+        return self.frame_msg_into(buff, offset, msg_struct.size)
 
-        if (parsed[0] == self.PRINT_MSG):
-            parsed = struct.unpack("3B{}s".format(parsed[2]), msg)
-        elif(parsed[0] == self.CMD_MSG):
-            parsed = struct.unpack("3B{}B".format(parsed[2]), msg)
+    # Builds TRAJECTORY messages that move through waypoints, a list of 6
+    # angle lists. step_delays is the ms per degree step used to reach each
+    # waypoint, either one per waypoint or a single value for all of them.
+    # Paths longer than TRAJ_MAX_WAYPOINTS are split over several messages,
+    # returns the list of messages in order.
+    def build_trajectory_msgs(self, waypoints, step_delays=DFLT_STEP_DELAY):
+        if (isinstance(step_delays, int)):
+            step_delays = [step_delays] * len(waypoints)
 
-        return parsed
+        msgs = []
+        for start in range(0, len(waypoints), self.TRAJ_MAX_WAYPOINTS):
+            end = min(start + self.TRAJ_MAX_WAYPOINTS, len(waypoints))
+            param = []
+            for i in range(start, end):
+                param.append(step_delays[i])
+                param.extend(waypoints[i][:6])
+            msgs.append(self.build_cmd_msg(self.TRAJECTORY, *param))
 
-    # Execute a command from incoming p_msg (parsed message) and place angles
-    # in message into angles argument
-    def exec_command(self, p_msg):
-        i = 0
-        param = []
+        return msgs
 
-        msg_type = p_msg[i]
-        i += 1
+    # Moves the braccio through waypoints, one TRAJECTORY message and one
+    # FINISH per chunk of TRAJ_MAX_WAYPOINTS instead of a command per pose.
+    def exec_trajectory(self, waypoints, step_delays=DFLT_STEP_DELAY):
+        with self.lock:
+            msgs = self.build_trajectory_msgs(waypoints, step_delays)
+            for i in range(0, len(msgs)):
+                self.arduino_serial.write(msgs[i])
+                self.predict(self.TRAJECTORY, *self.cmd_msg_params(msgs[i]))
+                # only stop for enter after the last chunk
+                self.read_exec(wait_for_enter=(i != len(msgs) - 1))
 
-        if (msg_type != self.CMD_MSG):
-            print("ERROR: not command message in exec_command")
-            return
+    # Builds a sequence tagged command message, same as build_cmd_msg but the
+    # sequence id goes right after the message type. The controller echoes
+    # seq in its SEQ_ACK and SEQ_FINISH for this command.
+    def build_seq_cmd_msg(self, seq, cmd, *argv):
+        param = self.cmd_params(cmd, argv)
+        if (param is None):
+            return 0
 
-        cmd = p_msg[i]
-        i += 1
+        msg = self.msg_struct(self.SEQ_CMD_MSG, cmd, len(param)).pack(
+                                self.SEQ_CMD_MSG, seq, cmd, len(param), *param)
+        return self.frame_msg(msg)
 
-        param_len = p_msg[i]
-        i += 1
+    # Same as build_seq_cmd_msg but packs into buff at offset, returns the
+    # number of bytes packed.
+    def build_seq_cmd_msg_into(self, buff, offset, seq, cmd, *argv):
+        param = self.cmd_params(cmd, argv)
+        if (param is None):
+            return 0
 
-        for k in range(0,param_len):
-            param.append(p_msg[i])
-            i += 1
+        msg_struct = self.msg_struct(self.SEQ_CMD_MSG, cmd, len(param))
+        if (not self.framed):
+            msg_struct.pack_into(buff, offset, self.SEQ_CMD_MSG, seq, cmd,
+                                 len(param), *param)
+            return msg_struct.size
+
+        msg_struct.pack_into(buff, offset + 1, self.SEQ_CMD_MSG, seq, cmd,
+                             len(param), *param)
+        return self.frame_msg_into(buff, offset, msg_struct.size)
+
+    # Wraps a message for the framed link, [FRAME_START][msg][crc8 of msg].
+    # Returns msg as is when the link is not framed.
+    def frame_msg(self, msg):
+        if (not self.framed):
+            return msg
+        return b"".join((bytes((FRAME_START,)), msg, bytes((crc8(msg),))))
+
+    # Frames the size byte message packed into buff at offset + 1, returns
+    # the size of the framed message
+    def frame_msg_into(self, buff, offset, size):
+        buff[offset] = FRAME_START
+        buff[offset + 1 + size] = crc8(memoryview(buff)[offset + 1:
+                                                        offset + 1 + size])
+        return size + FRAME_OVERHEAD
+
+    # Returns the parameters of a command message built by build_cmd_msg()
+    def cmd_msg_params(self, msg):
+        if (self.framed):
+            return msg[1 + self.CMD_HEADER:-1]
+        return msg[self.CMD_HEADER:]
+
+    # Has the controller push its angles with SENT_ANGLES messages. mode is
+    # one of the TELEM_* values, period_ms is used with TELEM_PERIODIC and is
+    # rounded to TELEM_PERIOD_UNIT. Raises ValueError for a TELEM_PERIODIC
+    # period that rounds to 0, the controller would push every loop and
+    # flood the link.
+    def subscribe_angles(self, mode, period_ms=0):
+        period = round(period_ms / self.TELEM_PERIOD_UNIT)
+        if (mode == self.TELEM_PERIODIC and period < 1):
+            raise ValueError("TELEM_PERIODIC needs a period of at least "
+                             "{} ms".format(self.TELEM_PERIOD_UNIT))
+
+        with self.lock:
+            msg = self.build_cmd_msg(self.SUBSCRIBE_ANGLES, mode, period)
+            self.arduino_serial.write(msg)
+            self.read_exec(wait_for_enter=True)
+            self.telem_mode = mode
+
+    # Sets the highest print level the controller sends. Prints above it are
+    # never formatted or written to the port by the controller.
+    # With log_format LOG_COMPACT the controller sends its log messages as ids
+    # and arguments, they are formatted here only when printed.
+    def set_log_level(self, level, log_format=LOG_TEXT):
+        with self.lock:
+            msg = self.build_cmd_msg(self.SET_LOG_LEVEL, level, log_format)
+            self.arduino_serial.write(msg)
+            self.read_exec(wait_for_enter=True)
+
+    # Sends payload in an ECHO and checks it comes back the same within
+    # timeout seconds
+    def echo(self, payload=ECHO_PATTERN, timeout=ECHO_TIMEOUT):
+        with self.lock:
+            self.echo_reply = None
+            self.arduino_serial.write(self.build_cmd_msg(self.ECHO, *payload))
+            result = self.read_exec(wait_for_enter=True, timeout=timeout)
+            return result.finished and self.echo_reply == bytes(payload)
+
+    # Switches the link to baudrate, one of BAUD_RATES. The controller
+    # switches after the FINISH, the host follows and checks the new rate
+    # both ways with an ECHO. Only once the ECHO_REPLY came back whole is
+    # CONFIRM_BAUD sent, the controller keeps the rate when it reads it. If
+    # either step fails both sides go back to the old rate, the controller on
+    # its own after BAUD_CONFIRM. Returns True if the link is at baudrate.
+    def set_baud(self, baudrate):
+        if (baudrate not in self.BAUD_RATES):
+            raise ValueError("{} is not a SET_BAUD rate, one of {}".format(
+                                                    baudrate, self.BAUD_RATES))
+
+        with self.lock:
+            old_baudrate = self.arduino_serial.baudrate
+            msg = self.build_cmd_msg(self.SET_BAUD,
+                                     self.BAUD_RATES.index(baudrate))
+            self.arduino_serial.write(msg)
+            if (not self.read_exec(wait_for_enter=True,
+                                   timeout=self.ECHO_TIMEOUT).finished):
+                return False
+
+            self.arduino_serial.set_baudrate(baudrate)
+            switched = time.monotonic()
+            time.sleep(self.BAUD_SETTLE)
+            self.clear_input()
+            if (self.echo()):
+                if (self.confirm_baud()):
+                    return True
+                # only the FINISH of CONFIRM_BAUD may have been lost, once
+                # the controller is past BAUD_CONFIRM it is at one rate or
+                # the other for good
+                self.wait_baud_confirm(switched)
+                if (self.echo()):
+                    return True
+
+            self.term.print_verbose("no echo at {} baud, back to {}\n".format(
+                                                    baudrate, old_baudrate))
+            self.arduino_serial.set_baudrate(old_baudrate)
+            self.wait_baud_confirm(switched)
+            return False
+
+    # Sends CONFIRM_BAUD at the new rate, returns True once it finished
+    def confirm_baud(self):
+        with self.lock:
+            self.arduino_serial.write(self.build_cmd_msg(self.CONFIRM_BAUD))
+            return self.read_exec(wait_for_enter=True,
+                                  timeout=self.ECHO_TIMEOUT).finished
+
+    # Sleeps until the controller has gone back to the old rate if it did
+    # not read a CONFIRM_BAUD, switched is time.monotonic() of the switch
+    def wait_baud_confirm(self, switched):
+        remaining = switched + self.BAUD_CONFIRM + self.BAUD_SETTLE
+        time.sleep(max(remaining - time.monotonic(), 0))
+        self.clear_input()
+
+    # Steps the link up through BAUD_RATES above the current rate, up to
+    # max_baudrate, until one fails its loopback check. Returns the rate the
+    # link ends at.
+    def negotiate_baud(self, max_baudrate=None):
+        for baudrate in self.BAUD_RATES:
+            if (baudrate <= self.arduino_serial.baudrate):
+                continue
+            if (max_baudrate is not None and baudrate > max_baudrate):
+                break
+            if (not self.set_baud(baudrate)):
+                break
+        return self.arduino_serial.baudrate
+
+    # Sends a PING and waits up to timeout seconds for its PONG. The controller
+    # answers without an ACK or FINISH. Returns True if the PONG came back.
+    def ping(self, timeout=PING_TIMEOUT):
+        with self.lock:
+            sent = time.monotonic()
+            self.arduino_serial.write(self.build_cmd_msg(self.PING))
+            deadline = sent + timeout
+            while (self.last_pong < sent):
+                # prints and telemetry read on the way are executed as usual
+                for frame in self.decoder.frames():
+                    self.exec_frame(frame, True)
+                if (self.last_pong >= sent):
+                    break
+                remaining = deadline - time.monotonic()
+                if (remaining <= 0):
+                    return False
+                self.read_in(min(remaining, self.arduino_serial.rtimeout))
+            return True
+
+    # Puts the braccio back in the last commanded pose after the link was
+    # lost, without init_arm(). The angles held by the model are what was
+    # last sent, they are checked against the controller with
+    # REQUEST_MX_ANGLE and sent again with MX_ANGLE only if they differ.
+    # Returns True once the controller holds them.
+    def restore_pose(self, timeout=RESTORE_TIMEOUT):
+        with self.lock:
+            angles = self.model.angles # None when nothing was commanded
+            if (angles is not None):
+                angles = list(angles)
+            self.send_cmd(self.REQUEST_MX_ANGLE)
+            if (not self.read_exec(wait_for_enter=True,
+                                   timeout=timeout).finished):
+                return False
+            if (angles is None or self.model.angles == angles):
+                return True
+
+            self.term.print_verbose("restoring pose {}\n".format(angles))
+            self.send_cmd(self.MX_ANGLE, *angles)
+            return self.read_exec(wait_for_enter=True,
+                                  timeout=timeout).finished
+
+    # Returns the log level matching the terminals verbose setting
+    def term_log_level(self):
+        if (self.term.check_verbose()):
+            return self.LOG_VERBOSE
+        return self.LOG_GENERAL
+
+    # Makes sure kin.angles matches the controller. The model already holds
+    # the angles predicted from the commands sent (or pushed by the controller
+    # with on change telemetry), they are only requested with REQUEST_MX_ANGLE
+    # when the model needs a resync, see arm_model.
+    def sync_angles(self):
+        with self.lock:
+            if (self.model.needs_resync()):
+                msg = self.build_cmd_msg(self.REQUEST_MX_ANGLE)
+                self.arduino_serial.write(msg)
+                self.read_exec()
+                return
 
-        if (cmd == self.SENT_ANGLES):
-            # copy param list to angles list
             for i in range(0,6):
-                self.kin.angles[i] = param[i]
+                self.kin.angles[i] = self.model.angles[i]
+            self.kin.set_kin_vars()
 
-    # Execute a print from an incoming parsed message
-    def exec_print(self, p_msg):
-        i = 0
+    # Parse out a incomming message from the arduino controller, msg does
+    # not include the msg_size byte. Returns an in_frame whose param is a view
+    # into msg.
+    def parse_in_msg(self, msg):
+        return parse_frame(memoryview(msg))
 
-        msg_type = p_msg[i]
-        if (msg_type != self.PRINT_MSG):
+    # Execute a command from incoming frame and place angles in message into
+    # angles argument
+    def exec_command(self, frame):
+        if (frame.msg_type != self.CMD_MSG):
+            print("ERROR: not command message in exec_command")
+            return
+
+        if (frame.cmd == self.SENT_ANGLES):
+            # copy param list to angles list
+            for i in range(0,6):
+                self.kin.angles[i] = frame.param[i]
+            self.state.update(frame.param[:6])
+            self.model.sync(frame.param[:6])
+            self.kin.set_kin_vars()
+        elif (frame.cmd == self.ECHO_REPLY):
+            self.echo_reply = bytes(frame.param)
+
+    # Execute a print from an incoming frame
+    def exec_print(self, frame):
+        if (frame.msg_type != self.PRINT_MSG):
             print("ERROR: not print message in exec_print\n")
             return
 
-        i += 1
-        cmd = p_msg[i]
+        if (frame.cmd == self.PRINT_LOG_ID):
+            self.exec_print_log(frame)
+            return
+
+        to_print = bytes(frame.param).decode() # includes '\n'
+
+        if (frame.cmd == self.PRINT_GENERAL):
+            self.term.sys_print(to_print)
+        elif (frame.cmd == self.PRINT_ERROR):
+            self.term.sys_print("BOARD ERROR: {}".format(to_print))
+        elif (frame.cmd == self.PRINT_VERBOSE):
+            self.term.print_verbose(to_print)
+
+    # Prints a PRINT_LOG_ID message. The text is only formatted when it is
+    # going to be shown, verbose messages cost nothing without -v.
+    def exec_print_log(self, frame):
+        if (frame.param_len < self.LOG_ID_HEADER):
+            return
+
+        print_cmd = frame.param[0]
+        if (print_cmd == self.PRINT_VERBOSE and not self.term.check_verbose()):
+            return
 
-        i += 1
-        param_len = p_msg[i] # includes '\n'
+        to_print = self.format_log(frame.param[1],
+                                   frame.param[self.LOG_ID_HEADER:])
+        if (print_cmd == self.PRINT_ERROR):
+            self.term.sys_print("BOARD ERROR: {}".format(to_print))
+        elif (print_cmd == self.PRINT_VERBOSE):
+            self.term.print_verbose(to_print)
+        else:
+            self.term.sys_print(to_print)
 
-        i += 1
-        to_print = p_msg[i] # include '\n'
+    # Formats an interned log message from log_table.py, args are the packed
+    # unsigned 16 bit little endian arguments
+    def format_log(self, log_id, args):
+        if (log_id not in LOG_MSGS):
+            return "unknown log message {}\n".format(log_id)
 
-        if (cmd == self.PRINT_GENERAL):
-            self.term.sys_print(to_print.decode())
-        elif (cmd == self.PRINT_ERROR):
-            self.term.sys_print("BOARD ERROR: {}".format(to_print.decode()))
-        elif (cmd == self.PRINT_VERBOSE):
-            self.term.print_verbose(to_print.decode())
+        name, fmt, nargs = LOG_MSGS[log_id]
+        arg_struct = self.LOG_ARG_STRUCTS.get(nargs)
+        if (arg_struct is None):
+            arg_struct = struct.Struct("<{}H".format(nargs))
+            self.LOG_ARG_STRUCTS[nargs] = arg_struct
 
+        if (len(args) < arg_struct.size):
+            return "{} missing arguments\n".format(name)
+        return fmt % arg_struct.unpack_from(args)
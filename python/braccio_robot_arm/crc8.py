@@ -0,0 +1,26 @@
+# Table driven CRC-8 used by the framed link, polynomial 0x07 with a 0 initial
+# value (CRC-8/SMBUS). Must match crc8() and CRC8_TABLE in braccio_arm.cpp.
+
+CRC8_POLY = 0x07
+
+# crc of every single byte value, one lookup per byte instead of 8 shifts
+def build_crc8_table(poly=CRC8_POLY):
+    table = bytearray(256)
+    for byte in range(0, 256):
+        crc = byte
+        for _ in range(0, 8):
+            if (crc & 0x80):
+                crc = ((crc << 1) ^ poly) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table[byte] = crc
+    return bytes(table)
+
+CRC8_TABLE = build_crc8_table()
+
+# crc of data, pass the crc of earlier data as crc to continue it
+def crc8(data, crc=0):
+    table = CRC8_TABLE
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
@@ -0,0 +1,525 @@
+import argparse
+import os
+import pty
+import select
+import struct
+import threading
+import time
+import tty
+from command import command_interface
+from arm_model import arm_model
+from log_table import LOG_MSGS
+from frame_decoder import FRAME_START
+from crc8 import crc8
+
+# Emulates the braccio controller firmware (arduino/robot_arm) on a pseudo
+# terminal so the host stack can be run and benchmarked without an arm.
+#
+# Speaks the same frames as braccio_arm.cpp: ACK/SEQ_ACK, PRINT_* (text or
+# PRINT_LOG_ID), SENT_ANGLES and FINISH/SEQ_FINISH, clamps angles like
+# check_angle() and handles every command the firmware does. Point
+# arduino_com at port once start() returns.
+#
+# ServoMovement() is modeled by sleeping one step delay per degree of the
+# servo with the furthest to go, scaled by time_scale. 1.0 is real time, 0.1
+# ten times faster and 0 skips servo time entirely. baudrate paces writes to
+# the host like a real serial link, None writes as fast as the pty allows.
+#
+# framed emulates a controller built with FRAMED_LINK.
+#
+# SET_BAUD switches the emulated link rate, writes are paced at the new rate
+# when baudrate is set. Rates above max_baud garble everything both ways like
+# a link that cannot carry them, so the fallback after BAUD_CONFIRM_MS can be
+# exercised. Rates above max_reply_baud only garble what goes to the host,
+# the ECHO gets in but its ECHO_REPLY does not come back. None carries every
+# rate.
+#
+# A pty has no DTR line, the emulator does not reset when the host opens the
+# port. The setup messages are sent once on start() and wait in the pty until
+# the host reads them.
+class braccio_emulator:
+    # see braccio.cpp
+    MIN_STEP_DELAY = 10 # ms, ServoMovement() clamps its step delay
+    MAX_STEP_DELAY = 30
+    SOFT_START_TIME = 6.0 # s, _softStart() with HIGH_LIMIT_TIMEOUT
+    # servo positions after _Braccio::begin(), M1-M6
+    BEGIN_STEPS = [0, 40, 180, 0, 170, 73]
+
+    # see braccio_arm.h and robot_arm.ino
+    IN_BUFF = command_interface.SEQ_CMD_HEADER + command_interface.PARAM_BUFF
+    BITS_PER_BYTE = 10 # start, 8 data, stop
+    BAUD_RATE = 115200
+    BAUD_CONFIRM = 1.0 # s, BAUD_CONFIRM_MS
+
+    POLL_TIMEOUT = 0.01 # s, how often the loop checks telemetry and stop()
+    RX_CHUNK = 1024
+
+    # log_msgs.h name -> id
+    LOG_IDS = {entry[0]: log_id for log_id, entry in LOG_MSGS.items()}
+
+    def __init__(self, time_scale=1.0, baudrate=None, soft_start=False,
+                 framed=False, max_baud=None, max_reply_baud=None):
+        self.time_scale = time_scale
+        self.baudrate = baudrate
+        self.soft_start = soft_start
+        self.framed = framed
+        self.max_baud = max_baud
+        self.max_reply_baud = max_reply_baud
+
+        self.master = None
+        self.slave = None
+        self.port = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+        self.rx_buff = bytearray()
+        self.rescan = 0 # bytes at the front of rx_buff handed back, unread()
+        self.model = arm_model()
+        self.angles = list(arm_model.SAFE_ANGLES)
+        self.steps = list(self.BEGIN_STEPS)
+
+        self.telem_mode = command_interface.TELEM_OFF
+        self.telem_period = 0 # s
+        self.telem_last = 0
+        self.telem_angles = list(self.angles)
+
+        self.log_level = command_interface.LOG_VERBOSE
+        self.log_format = command_interface.LOG_TEXT
+
+        # see SET_BAUD and loop() in robot_arm.ino
+        self.link_baud = baudrate or self.BAUD_RATE
+        self.prev_baud = self.link_baud
+        self.pending_baud = 0
+        self.baud_unconfirmed = False
+        self.baud_switched = 0
+
+        self.cmds_executed = 0
+
+    # Opens the pty and starts the firmware loop, returns the port path
+    def start(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        self.stopped.set()
+        if (self.thread):
+            self.thread.join()
+            self.thread = None
+        if (self.master is not None):
+            os.close(self.master)
+            os.close(self.slave)
+            self.master = None
+            self.slave = None
+
+    # setup() and loop() from robot_arm.ino
+    def run(self):
+        self.setup()
+        while (not self.stopped.is_set()):
+            if (not self.read_in()):
+                self.send_telemetry()
+            else:
+                while (not self.stopped.is_set() and self.exec_next()):
+                    pass
+
+            if (self.baud_unconfirmed and
+                time.monotonic() - self.baud_switched >= self.BAUD_CONFIRM):
+                self.switch_baud(self.prev_baud)
+                self.baud_unconfirmed = False
+
+    def setup(self):
+        self.send_log(command_interface.PRINT_VERBOSE, "LOG_STARTING")
+        if (self.soft_start):
+            self.sleep(self.SOFT_START_TIME)
+        self.set_default_pos()
+        self.send_log(command_interface.PRINT_VERBOSE, "LOG_SETUP_COMPLETE")
+        self.send_finish()
+
+    # Reads whatever the host has sent, returns False if nothing came in
+    def read_in(self):
+        ready, _, _ = select.select([self.master], [], [], self.POLL_TIMEOUT)
+        if (not ready):
+            return False
+
+        try:
+            data = os.read(self.master, self.RX_CHUNK)
+        except OSError: # host side of the pty is not open
+            time.sleep(self.POLL_TIMEOUT)
+            return False
+
+        self.rx_buff.extend(data)
+        return len(data) > 0
+
+    # Executes the next complete message in rx_buff, returns False if there
+    # is not one yet. Same steps as loop() in robot_arm.ino.
+    def exec_next(self):
+        if (self.garbled()):
+            self.rx_buff.clear()
+            self.rescan = 0
+            return False
+
+        offset = 0 # FRAME_START, the crc after the message is the same size
+        rescanned = False
+        if (self.framed):
+            # read_msg() skips everything before the next FRAME_START
+            start = self.rx_buff.find(FRAME_START)
+            if (start < 0):
+                self.rx_buff.clear()
+                self.rescan = 0
+                return False
+            del self.rx_buff[:start]
+            rescanned = start < self.rescan
+            self.rescan = max(self.rescan - start, 0)
+            offset = 1
+
+        if (len(self.rx_buff) <= offset):
+            return False
+
+        msg_type = self.rx_buff[offset]
+        header = command_interface.CMD_HEADER
+        if (msg_type == command_interface.SEQ_CMD_MSG):
+            header = command_interface.SEQ_CMD_HEADER
+        if (len(self.rx_buff) < offset + header):
+            return False
+
+        # braccio_arm::send_read_finish() echoes seq once the header is read
+        seq = None
+        if (msg_type == command_interface.SEQ_CMD_MSG):
+            seq = self.rx_buff[offset + 1]
+
+        param_len = self.rx_buff[offset + header - 1]
+        if (header + param_len > self.IN_BUFF):
+            if (self.framed):
+                return self.bad_frame(header, seq, rescanned)
+            # cannot be parsed, read_msg() drops what is left
+            self.rx_buff.clear()
+            self.send_log(command_interface.PRINT_ERROR, "LOG_READ_FAILED")
+            self.send_finish(seq)
+            return False
+
+        end = offset + header + param_len
+        if (len(self.rx_buff) < end + offset):
+            return False
+
+        msg = bytes(self.rx_buff[offset:end])
+        if (self.framed):
+            if (self.rx_buff[end] != crc8(msg)):
+                return self.bad_frame(end, seq, rescanned)
+            del self.rx_buff[:end + 1]
+            self.rescan = max(self.rescan - end - 1, 0)
+        else:
+            del self.rx_buff[:end]
+
+        cmd = msg[header - 2]
+        param = msg[header:]
+
+        if (cmd == command_interface.PING):
+            self.write_msg(struct.pack("2B", 1, command_interface.PONG))
+            return True
+
+        self.send_ack(seq)
+        self.exec_command(msg_type, cmd, param)
+        self.send_telemetry()
+        self.send_finish(seq)
+        self.cmds_executed += 1
+
+        if (cmd == command_interface.CONFIRM_BAUD):
+            self.baud_unconfirmed = False
+        if (self.pending_baud):
+            self.prev_baud = self.link_baud
+            self.switch_baud(self.pending_baud)
+            self.pending_baud = 0
+            self.baud_unconfirmed = True
+            self.baud_switched = time.monotonic()
+        return True
+
+    # A frame read_msg() could not read, its read bytes after the FRAME_START
+    # are scanned again. Only a frame the host sent is answered, one found in
+    # rescanned bytes is skipped like noise.
+    def bad_frame(self, read, seq, rescanned):
+        del self.rx_buff[:1]
+        self.rescan = max(self.rescan - 1, read)
+        if (not rescanned):
+            self.send_log(command_interface.PRINT_ERROR, "LOG_BAD_FRAME")
+            self.send_read_finish(seq)
+        return True
+
+    # braccio_arm::exec_command()
+    def exec_command(self, msg_type, cmd, param):
+        ci = command_interface
+        if (msg_type != ci.CMD_MSG and msg_type != ci.SEQ_CMD_MSG):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_MSG_TYPE")
+            return
+
+        # the firmware reads stale buffer bytes past param_len, use 0 here
+        param_len = len(param)
+        echo = param
+        param = param + bytes(max(0, arm_model.NUM_ANGLES - param_len))
+
+        if (cmd >= ci.M1_ANGLE and cmd <= ci.M6_ANGLE):
+            motor = cmd - ci.M1_ANGLE
+            self.angles[motor] = self.model.clamp_angle(motor, param[0])
+            self.servo_movement(ci.DFLT_STEP_DELAY)
+            self.send_log(ci.PRINT_VERBOSE, "LOG_CHANGED_ANGLE", motor + 1,
+                          self.angles[motor])
+        elif (cmd == ci.MX_ANGLE):
+            self.angles = self.model.clamp_angles(param)
+            self.servo_movement(ci.DFLT_STEP_DELAY)
+            self.send_log(ci.PRINT_VERBOSE, "LOG_CHANGED_ALL", *self.angles)
+        elif (cmd == ci.REQUEST_MX_ANGLE):
+            self.send_all_angles()
+            self.send_log(ci.PRINT_VERBOSE, "LOG_CURRENT_ANGLES",
+                          *self.angles)
+        elif (cmd == ci.SET_DFLT_POS):
+            self.set_default_pos()
+        elif (cmd == ci.TRAJECTORY):
+            self.exec_trajectory(param, param_len)
+        elif (cmd == ci.SUBSCRIBE_ANGLES):
+            if (param_len < 2):
+                self.send_log(ci.PRINT_ERROR, "LOG_MISSING_TELEM")
+            else:
+                self.set_telemetry(param[0], param[1])
+        elif (cmd == ci.SET_LOG_LEVEL):
+            if (param_len < 1):
+                self.send_log(ci.PRINT_ERROR, "LOG_MISSING_LOG_LEVEL")
+            elif (param_len < 2):
+                self.set_log_level(param[0], ci.LOG_TEXT)
+            else:
+                self.set_log_level(param[0], param[1])
+        elif (cmd == ci.SET_BAUD):
+            if (param_len < 1):
+                self.send_log(ci.PRINT_ERROR, "LOG_MISSING_BAUD")
+            else:
+                self.set_baud(param[0])
+        elif (cmd == ci.ECHO):
+            self.send_msg(ci.CMD_MSG, ci.ECHO_REPLY, echo)
+        elif (cmd == ci.CONFIRM_BAUD):
+            pass # the rate is kept by exec_next()
+        else:
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_CMD")
+
+    def exec_trajectory(self, param, param_len):
+        ci = command_interface
+        if (param_len % ci.TRAJ_WAYPOINT_LEN):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_TRAJ_LEN", param_len)
+            return
+
+        num_waypoints = param_len // ci.TRAJ_WAYPOINT_LEN
+        for i in range(0, num_waypoints):
+            waypoint = param[i * ci.TRAJ_WAYPOINT_LEN:
+                             (i + 1) * ci.TRAJ_WAYPOINT_LEN]
+            self.angles = self.model.clamp_angles(waypoint[1:])
+            self.servo_movement(waypoint[0])
+
+        self.send_log(ci.PRINT_VERBOSE, "LOG_TRAJ_FINISHED", num_waypoints,
+                      *self.angles)
+
+    def set_default_pos(self):
+        ci = command_interface
+        self.send_log(ci.PRINT_VERBOSE, "LOG_SETTING_DFLT_POS")
+        self.angles = list(arm_model.SAFE_ANGLES)
+        self.servo_movement(ci.DFLT_STEP_DELAY)
+        self.send_log(ci.PRINT_VERBOSE, "LOG_DFLT_POS_SET", *self.angles)
+
+    def set_telemetry(self, mode, period):
+        ci = command_interface
+        if (mode > ci.TELEM_ON_CHANGE):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_TELEM", mode)
+            return
+        if (mode == ci.TELEM_PERIODIC and period == 0):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_TELEM_PERIOD", period)
+            return
+
+        self.telem_mode = mode
+        self.telem_period = period * ci.TELEM_PERIOD_UNIT / 1000
+        self.telem_last = time.monotonic()
+
+        if (self.telem_mode != ci.TELEM_OFF):
+            self.telem_angles = list(self.angles)
+            self.send_all_angles()
+
+        self.send_log(ci.PRINT_VERBOSE, "LOG_TELEM_MODE", self.telem_mode,
+                      period * ci.TELEM_PERIOD_UNIT)
+
+    def send_telemetry(self):
+        ci = command_interface
+        if (self.telem_mode == ci.TELEM_PERIODIC):
+            now = time.monotonic()
+            # wall clock like millis() on the controller, time_scale is for
+            # servo motion only
+            if (now - self.telem_last < self.telem_period):
+                return
+            self.telem_last = now
+        elif (self.telem_mode == ci.TELEM_ON_CHANGE):
+            if (self.telem_angles == self.angles):
+                return
+        else:
+            return
+
+        self.telem_angles = list(self.angles)
+        self.send_all_angles()
+
+    def set_baud(self, index):
+        ci = command_interface
+        if (index >= len(ci.BAUD_RATES)):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_BAUD", index)
+            return
+
+        self.pending_baud = ci.BAUD_RATES[index]
+        self.send_log(ci.PRINT_VERBOSE, "LOG_BAUD_SET",
+                      self.pending_baud // 100)
+
+    # switch_baud() in robot_arm.ino
+    def switch_baud(self, baud):
+        self.link_baud = baud
+        if (self.baudrate):
+            self.baudrate = baud
+
+    # True when the link rate is above what the emulated link can carry
+    def garbled(self):
+        return self.max_baud is not None and self.link_baud > self.max_baud
+
+    # True when the link rate is above what can reach the host
+    def reply_garbled(self):
+        return (self.max_reply_baud is not None and
+                self.link_baud > self.max_reply_baud)
+
+    def set_log_level(self, level, log_format):
+        ci = command_interface
+        if (level > ci.LOG_VERBOSE):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_LOG_LEVEL", level)
+            return
+        if (log_format > ci.LOG_COMPACT):
+            self.send_log(ci.PRINT_ERROR, "LOG_INVALID_LOG_FORMAT", log_format)
+            return
+
+        self.log_level = level
+        self.log_format = log_format
+        self.send_log(ci.PRINT_VERBOSE, "LOG_LEVEL_SET", self.log_level,
+                      self.log_format)
+
+    # Sleeps as long as _Braccio::ServoMovement() takes to reach self.angles,
+    # one step delay per degree of the servo with the furthest to go
+    def servo_movement(self, step_delay):
+        step_delay = min(max(step_delay, self.MIN_STEP_DELAY),
+                         self.MAX_STEP_DELAY)
+        num_steps = max(abs(self.angles[i] - self.steps[i])
+                        for i in range(0, arm_model.NUM_ANGLES))
+        self.steps = list(self.angles)
+
+        # the step loop always delays at least once
+        self.sleep(max(1, num_steps) * step_delay / 1000)
+
+    def sleep(self, seconds):
+        if (self.time_scale > 0):
+            self.stopped.wait(seconds * self.time_scale)
+
+    def write(self, data):
+        if (self.garbled() or self.reply_garbled()):
+            return
+        os.write(self.master, data)
+        if (self.baudrate):
+            time.sleep(len(data) * self.BITS_PER_BYTE / self.baudrate)
+
+    # braccio_arm::write_msg(), frames msg when framed
+    def write_msg(self, msg):
+        if (self.framed):
+            msg = b"".join((bytes((FRAME_START,)), msg, bytes((crc8(msg),))))
+        self.write(msg)
+
+    # create_send_msg(), [msg_size][msg_type][cmd][param_len][params]
+    def send_msg(self, msg_type, cmd, param):
+        self.write_msg(struct.pack("4B", len(param) + 3, msg_type, cmd,
+                                   len(param)) + param)
+
+    def send_ack(self, seq=None):
+        if (seq is None):
+            self.write_msg(struct.pack("2B", 1, command_interface.ACK))
+        else:
+            self.write_msg(struct.pack("3B", 2, command_interface.SEQ_ACK,
+                                       seq))
+
+    def send_finish(self, seq=None):
+        if (seq is None):
+            self.write_msg(struct.pack("2B", 1, command_interface.FINISH))
+        else:
+            self.write_msg(struct.pack("3B", 2, command_interface.SEQ_FINISH,
+                                       seq))
+
+    # braccio_arm::send_read_finish()
+    def send_read_finish(self, seq=None):
+        if (seq is not None):
+            self.write_msg(struct.pack("3B", 2, command_interface.SEQ_NAK,
+                                       seq))
+        self.send_finish(seq)
+
+    def send_all_angles(self):
+        self.send_msg(command_interface.CMD_MSG,
+                      command_interface.SENT_ANGLES, bytes(self.angles))
+
+    # braccio_arm::send_log(), name is the log_msgs.h name
+    def send_log(self, print_cmd, name, *args):
+        ci = command_interface
+        if ((print_cmd == ci.PRINT_GENERAL and
+             self.log_level < ci.LOG_GENERAL) or
+            (print_cmd == ci.PRINT_VERBOSE and
+             self.log_level < ci.LOG_VERBOSE)):
+            return
+
+        log_id = self.LOG_IDS[name]
+        if (self.log_format == ci.LOG_COMPACT):
+            param = struct.pack("<2B{}H".format(len(args)), print_cmd, log_id,
+                                *args)
+            self.send_msg(ci.PRINT_MSG, ci.PRINT_LOG_ID, param)
+        else:
+            text = LOG_MSGS[log_id][1] % args
+            # vsnprintf() into a PARAM_BUFF buffer
+            self.send_msg(ci.PRINT_MSG, print_cmd,
+                          text.encode()[:ci.PARAM_BUFF - 1])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulates the braccio"
+                                                 " controller on a pseudo"
+                                                 " terminal.")
+    parser.add_argument("-s", dest="time_scale", default=1.0, type=float,
+                        help="servo time scale, 1 is real time, 0 skips "
+                             "servo time")
+    parser.add_argument("-b", dest="baudrate", default=None, type=int,
+                        help="pace writes to the host at this baud rate")
+    parser.add_argument("-f", dest="soft_start", default=False,
+                        action='store_true',
+                        help="take as long as the Braccio soft start to "
+                             "setup")
+    parser.add_argument("-k", dest="framed", default=False,
+                        action='store_true',
+                        help="crc checked frames like FRAMED_LINK, run "
+                             "main.py with -k too")
+    parser.add_argument("-m", dest="max_baud", default=None, type=int,
+                        help="garble the link above this baud rate")
+    parser.add_argument("-r", dest="max_reply_baud", default=None, type=int,
+                        help="garble only writes to the host above this "
+                             "baud rate")
+    cl_args = parser.parse_args()
+
+    emulator = braccio_emulator(cl_args.time_scale, cl_args.baudrate,
+                                cl_args.soft_start, cl_args.framed,
+                                cl_args.max_baud, cl_args.max_reply_baud)
+    port = emulator.start()
+    print("emulating braccio controller on {}".format(port))
+    framed = ""
+    if (cl_args.framed):
+        framed = " -k"
+    print("run: python main.py -p {}{}".format(port, framed))
+
+    try:
+        while (True):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nexiting...")
+    finally:
+        emulator.stop()
@@ -0,0 +1,172 @@
+from crc8 import crc8
+
+# Incremental decoder for the length prefixed messages sent by the braccio
+# controller.
+#
+# Message layout from the controller, see create_io_msg() in braccio_arm.cpp
+#   [msg_size][msg_type][cmd][param_len][param 0 ... param_len-1]
+#   msg_size does not count itself.
+# ACK and FINISH messages are only [1][msg_type].
+# SEQ_ACK, SEQ_FINISH and SEQ_NAK messages are [2][msg_type][seq].
+#
+# On a framed link (FRAMED_LINK in braccio_arm.h) every message is wrapped as
+#   [FRAME_START][msg_size][msg_type]...[crc8 of msg_size through the end]
+# so a lost or corrupt byte is caught and the decoder resyncs at the next
+# FRAME_START instead of reading everything after it misaligned. Messages to
+# the controller are wrapped the same way, see command_interface.frame_msg().
+FRAME_START = 0xA5
+FRAME_OVERHEAD = 2 # start marker and crc
+
+# A parsed incoming message.
+# param is a memoryview into the buffer the message was parsed from, it is not
+# copied. For messages from frame_decoder it is only valid until the next
+# feed() call, copy it with bytes() if it needs to be kept.
+class in_frame:
+    __slots__ = ("msg_type", "cmd", "param_len", "param", "seq")
+
+    EMPTY = memoryview(b"")
+
+    def __init__(self, msg_type, cmd=0, param_len=0, param=EMPTY, seq=None):
+        self.msg_type = msg_type
+        self.cmd = cmd
+        self.param_len = param_len
+        self.param = param
+        self.seq = seq # only set for SEQ_ACK, SEQ_FINISH and SEQ_NAK
+
+    def __repr__(self):
+        return "in_frame({}, {}, {}, {}, {})".format(self.msg_type, self.cmd,
+                                                     self.param_len,
+                                                     bytes(self.param),
+                                                     self.seq)
+
+# Parses a single message (without its msg_size byte) out of a memoryview
+def parse_frame(view):
+    if (len(view) == 1): # ACK, FINISH
+        return in_frame(view[0])
+    elif (len(view) == 2): # SEQ_ACK, SEQ_FINISH, SEQ_NAK
+        return in_frame(view[0], seq=view[1])
+
+    # param_len cannot run past the end of the message
+    param_len = min(view[2], len(view) - 3)
+    return in_frame(view[0], view[1], param_len, view[3:3+param_len])
+
+# Takes arbitrary chunks of bytes read from the serial port and yields every
+# complete message in them. Partial messages are kept until the rest arrives
+# so the port can be drained with large reads.
+#
+# Bytes are kept in one reusable bytearray. head is the start of the unparsed
+# bytes and tail the end of the buffered bytes, when a chunk does not fit
+# after tail the unparsed bytes are moved back to the front of the buffer.
+#
+# With framed the messages are checked, bytes that are not part of a valid
+# frame are skipped. A bad msg_size holds the decoder up for at most one max
+# size message before its crc fails and the bytes after the marker are
+# scanned again.
+class frame_decoder:
+    BUFF_SIZE = 1024 # must hold more than one max size message (256 bytes)
+    MAX_MSG_SIZE = 3 + 150 # msg_type, cmd, param_len and PARAM_BUFF
+
+    def __init__(self, size=BUFF_SIZE, framed=False):
+        self.buff = bytearray(size)
+        self.view = memoryview(self.buff)
+        self.head = 0
+        self.tail = 0
+
+        self.framed = framed
+        self.crc_errors = 0
+        self.skipped = 0 # bytes dropped while looking for a frame
+
+    # number of buffered bytes that have not been parsed into a message yet
+    def pending(self):
+        return self.tail - self.head
+
+    # max number of bytes that feed() can take right now
+    def space(self):
+        return len(self.buff) - self.pending()
+
+    def reset(self):
+        self.head = 0
+        self.tail = 0
+
+    def feed(self, data):
+        size = len(data)
+        if (size > self.space()):
+            raise BufferError("frame_decoder: {} bytes does not fit, {} bytes "
+                              "free".format(size, self.space()))
+
+        if (self.tail + size > len(self.buff)):
+            self.compact()
+
+        self.view[self.tail:self.tail+size] = data
+        self.tail += size
+
+    # move unparsed bytes to the front of the buffer
+    def compact(self):
+        pending = self.pending()
+        self.view[:pending] = self.view[self.head:self.tail]
+        self.head = 0
+        self.tail = pending
+
+    # Yields every complete message in the buffer as an in_frame
+    def frames(self):
+        if (self.framed):
+            yield from self.checked_frames()
+            return
+
+        while (self.tail > self.head):
+            msg_size = self.buff[self.head]
+            if (msg_size == 0): # not a valid message, skip the byte
+                self.head += 1
+                continue
+
+            start = self.head + 1
+            end = start + msg_size
+            if (end > self.tail): # rest of the message has not arrived yet
+                return
+
+            self.head = end
+            yield parse_frame(self.view[start:end])
+
+        # everything parsed, start over at the front so compact() is rare
+        self.head = 0
+        self.tail = 0
+
+    # frames() for a framed link
+    def checked_frames(self):
+        while (self.tail > self.head):
+            if (self.buff[self.head] != FRAME_START):
+                start = self.buff.find(FRAME_START, self.head, self.tail)
+                if (start < 0):
+                    self.skipped += self.tail - self.head
+                    break
+                self.skipped += start - self.head
+                self.head = start
+
+            if (self.tail - self.head < 2):
+                return
+
+            msg_size = self.buff[self.head + 1]
+            if (msg_size == 0 or msg_size > self.MAX_MSG_SIZE):
+                # not a real marker
+                self.head += 1
+                self.skipped += 1
+                continue
+
+            start = self.head + 2
+            end = start + msg_size
+            if (end >= self.tail): # rest of the frame has not arrived yet
+                return
+
+            if (crc8(self.view[self.head + 1:end]) != self.buff[end]):
+                # drop the marker only, a real frame may start inside
+                self.crc_errors += 1
+                self.head += 1
+                self.skipped += 1
+                continue
+
+            self.head = end + 1
+            yield parse_frame(self.view[start:end])
+
+        # everything parsed, start over at the front so compact() is rare
+        self.head = 0
+        self.tail = 0
@@ -946,24 +946,16 @@ class fuzzy_controller:
             tmp_angle = hand_output + kin.angles[kin.GRIP_M6]
             angles[kin.GRIP_M6] = math.ceil(tmp_angle)
 
-            # change the angles on the Braccio
-            msg = self.cmd.build_cmd_msg(
-                                         self.cmd.MX_ANGLE,
-                                         angles[kin.BASE_M1],
-                                         angles[kin.SHOULDER_M2],
-                                         angles[kin.ELBOW_M3],
-                                         angles[kin.WRIST_VRT_M4],
-                                         angles[kin.WRIST_ROT_M5],
-                                         angles[kin.GRIP_M6]
-                                       )
-
-            self.arduino_serial.write(msg)
-            self.cmd.read_exec()
-
-            # set angles to match braccio
-            msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-            self.arduino_serial.write(msg)
-            self.cmd.read_exec()
+            # change the angles on the Braccio and set angles to match
+            self.cmd.exec_cmd_sync(
+                              self.cmd.MX_ANGLE,
+                              angles[kin.BASE_M1],
+                              angles[kin.SHOULDER_M2],
+                              angles[kin.ELBOW_M3],
+                              angles[kin.WRIST_VRT_M4],
+                              angles[kin.WRIST_ROT_M5],
+                              angles[kin.GRIP_M6]
+                             )
 
             in_range = False
             while (not in_range):
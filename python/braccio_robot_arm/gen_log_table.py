@@ -0,0 +1,52 @@
+import argparse
+import ast
+import re
+
+# Generates log_table.py from the interned log messages in the firmwares
+# log_msgs.h. Run again whenever log_msgs.h changes.
+
+LOG_MSGS_H = "../../arduino/robot_arm/log_msgs.h"
+LOG_TABLE_PY = "log_table.py"
+
+# LOG_MSG(name, id, "format" "format" ...)
+LOG_MSG_RE = re.compile(r'LOG_MSG\(\s*(\w+)\s*,\s*(0[xX][0-9a-fA-F]+|\d+)\s*,'
+                        r'((?:\s*\\?\s*"(?:[^"\\]|\\.)*")+)\s*\)')
+STR_RE = re.compile(r'"(?:[^"\\]|\\.)*"')
+CONV_RE = re.compile(r'%[-+ #0]*\d*(?:\.\d+)?[hl]*([a-zA-Z%])')
+
+# Returns [(name, id, format, nargs)] for every message in log_msgs.h
+def parse_log_msgs(text):
+    msgs = []
+    for match in LOG_MSG_RE.finditer(text):
+        name = match.group(1)
+        log_id = int(match.group(2), 0)
+        fmt = "".join(ast.literal_eval(lit)
+                      for lit in STR_RE.findall(match.group(3)))
+        nargs = len([c for c in CONV_RE.findall(fmt) if c != "%"])
+        msgs.append((name, log_id, fmt, nargs))
+    return msgs
+
+def write_table(msgs, path):
+    with open(path, "w") as out:
+        out.write("# Generated by gen_log_table.py from log_msgs.h, do not "
+                  "edit.\n")
+        out.write("# log id: (name, format, number of arguments)\n")
+        out.write("LOG_MSGS = {\n")
+        for name, log_id, fmt, nargs in msgs:
+            out.write("    0x{:02X}: ({!r}, {!r}, {}),\n".format(
+                                                log_id, name, fmt, nargs))
+        out.write("}\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the host log table"
+                                                 " from the firmware"
+                                                 " log_msgs.h.")
+    parser.add_argument("-i", dest="header", default=LOG_MSGS_H)
+    parser.add_argument("-o", dest="output", default=LOG_TABLE_PY)
+    cl_args = parser.parse_args()
+
+    with open(cl_args.header) as header:
+        msgs = parse_log_msgs(header.read())
+
+    write_table(msgs, cl_args.output)
+    print("{} log messages written to {}".format(len(msgs), cl_args.output))
@@ -30,14 +30,9 @@ class image_processing:
             self.term.eprint("Error on leaving webcam flow with Braccio")
 
         # Return braccio to default position and update the kinematics class
-        msg = self.cmd.build_cmd_msg(self.cmd.SET_DFLT_POS)
-        self.arduino_serial.write(msg)
-        self.cmd.read_exec()
-
-        # update angles and displacement vectors
-        msg = self.cmd.build_cmd_msg(self.cmd.REQUEST_MX_ANGLE)
-        self.arduino_serial.write(msg)
-        self.cmd.read_exec()
+        # update angles and displacement vectors, the angle request goes out
+        # with the command when needed
+        self.cmd.exec_cmd_sync(self.cmd.SET_DFLT_POS)
 
         self.kin.set_kin_vars()
 
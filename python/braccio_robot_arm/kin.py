@@ -1,4 +1,21 @@
 import numpy as np
+from arm_model import arm_model
+
+# Result of kinematics.dls_inverse_kin()
+class ik_result:
+    __slots__ = ("angles", "iterations", "residual", "converged")
+
+    def __init__(self, angles, iterations, residual, converged):
+        self.angles = angles # servo angles in degrees, M1-M6
+        self.iterations = iterations # steps taken
+        self.residual = residual # weighted pose error left, see pose_error()
+        self.converged = converged # residual within the tolerance
+
+    def __repr__(self):
+        return ("ik_result(angles={}, iterations={}, residual={:.4f}, "
+                "converged={})".format(np.round(self.angles, 2).tolist(),
+                                       self.iterations, self.residual,
+                                       self.converged))
 
 # Handles the kinematic functions definitions and variables
 class kinematics:
@@ -15,7 +32,27 @@ class kinematics:
     HOMO_MATS = 6  # Homogeneous Matricies
     DOF_ANGLES = 6 # 6 degrees of freedom
 
-    def __init__(self):
+    # per joint transforms for every integer servo angle, see joint_table()
+    TABLE_ANGLES = 181 # 0-180 degrees
+    TABLE_CACHE = {} # link lengths -> table, shared by every instance
+
+    # three_dof_inverse_kin()
+    IK_BRANCHES = 4   # base facing or turned away, elbow bent either way
+    DFLT_PITCH = -90  # degrees from horizontal, end effector pointing down
+    IK_TOLERANCE = 1e-6 # degrees past a servo limit still taken as on it
+
+    # dls_inverse_kin()
+    IK_JOINTS = 5          # M1-M5 move the end effector, M6 is the gripper
+    DLS_DAMPING = 0.5      # lambda, keeps steps small near singularities
+    DLS_MAX_ITER = 50
+    DLS_TOLERANCE = 0.01   # residual, cm of position error
+    DLS_MAX_STEP = 20      # degrees, largest joint change per iteration
+    ORIENT_WEIGHT = 10     # cm of error one radian of orientation is worth
+
+    # use_table looks the joint transforms up in joint_table() when the
+    # angles are whole degrees instead of computing them
+    def __init__(self, use_table=True):
+        self.use_table = use_table
 
         self.angles = []
         for i in range(0,self.DOF_ANGLES,1):
@@ -44,59 +81,68 @@ class kinematics:
         self.link_len[self.A3] = self.A3_LEN # wrist vertial to wrist rotation
         self.link_len[self.A4] = self.A4_LEN # wrist rotation to end effector
 
-        # displacement vectors
-        self.disp_vec = []
-        for i in range(0,self.DISP_VECTS,1):
-            self.disp_vec.append(np.array([[0],
-                                           [0],
-                                           [0]]))
-        # initialize displacement vectors
+        # Every transform lives in one preallocated array updated in place,
+        # H_0_1 to H_4_5 then H_0_5. homo_trans_mat, rot_mat and disp_vec
+        # are read only views into it, index 5 of rot_mat is R_0_5.
+        self.trans = np.zeros((self.HOMO_MATS, 4, 4))
+        self.trans[:, 3, 3] = 1
+        self.homo_trans_mat = [self.read_only(self.trans[i])
+                               for i in range(0, self.HOMO_MATS)]
+        self.rot_mat = [self.read_only(self.trans[i, :3, :3])
+                        for i in range(0, self.ROT_MATS)]
+        self.disp_vec = [self.read_only(self.trans[i, :3, 3:])
+                         for i in range(0, self.DISP_VECTS)]
+
+        # scratch space so updates do not allocate
+        self.rad = np.zeros(self.DOF_ANGLES)
+        self.cos = np.zeros(self.DOF_ANGLES)
+        self.sin = np.zeros(self.DOF_ANGLES)
+        self.chain_buff = np.zeros((2, 4, 4))
+        self.rot_buff = np.zeros((2, 3, 3))
+
+        self.fill_rot_consts()
         self.create_fill_disp_vects()
-
-        # rotation matricies 0-1, 1-2, 2-3, etc. up to 5 frames
-        self.rot_mat = []
-        for i in range(0,self.ROT_MATS,1):
-            self.rot_mat.append(np.array([[0],
-                                          [0],
-                                          [0]]))
-        # fills the rotation matricies and provides rot_mat_0_[1-5]
         self.create_rot_matrix()
-
-        self.homo_trans_mat = []
-        for i in range(0,self.HOMO_MATS,1):
-            self.homo_trans_mat.append(np.array([[0,0,0,0],
-                                                 [0,0,0,0],
-                                                 [0,0,0,0],
-                                                 [0,0,0,0]]))
         self.create_homo_trans()
 
+        # last dls_inverse_kin() solution, where the next one starts
+        self.last_ik = None
+
+    # view of array that cannot be written through
+    def read_only(self, array):
+        view = array.view()
+        view.flags.writeable = False
+        return view
+
+    # radians, cos and sin of self.angles into their buffers. self.angles is
+    # copied in one element at a time, handing the list to numpy would build
+    # a temporary array from it on every call.
+    def angle_trig(self):
+        rad = self.rad
+        for i, angle in enumerate(self.angles):
+            rad[i] = angle
+        np.deg2rad(rad, out=rad)
+        np.cos(rad, out=self.cos)
+        np.sin(self.rad, out=self.sin)
 
     # set kinematic variables with angles that are set
     def set_kin_vars(self):
+        if (self.use_table and self.fill_from_table()):
+            return
         self.create_rot_matrix()
         self.create_fill_disp_vects()
         self.create_homo_trans()
 
-    # creates and fills the homogenous transform matricies, last index is 0_5
-    # returns H_0_5 matrix which is index 5 of the homo_trans_mat list
-    # NOTE: @ syntax multiplies the matricies
+    # The homogenous transform matricies 0_1 to 4_5 are the rotation matricies
+    # and displacement vectors already in self.trans, this multiplies them
+    # out into H_0_5 in place. Returns H_0_5, index 5 of homo_trans_mat.
     def create_homo_trans(self):
-        for i in range(0,self.HOMO_MATS-1,1):
-            axis = 1 # concat matrix vertically
-            # combine rot_mat with disp_vect (disp column to the right)
-            self.homo_trans_mat[i] = np.concatenate((self.rot_mat[i],
-                                                    self.disp_vec[i]), axis)
-            axis = 0 # concat matrix horizontally
-            # combine current matrix a new row so we can multiply later
-            self.homo_trans_mat[i] = np.concatenate((self.homo_trans_mat[i],
-                                                    [[0,0,0,1]]), axis)
-
+        buff = self.chain_buff
+        np.matmul(self.trans[0], self.trans[1], out=buff[0])
+        np.matmul(buff[0], self.trans[2], out=buff[1])
+        np.matmul(buff[1], self.trans[3], out=buff[0])
         # This index holds H_0_5 which contains R_0_5 and D_0_5
-        self.homo_trans_mat[5] = (self.homo_trans_mat[0] @
-                                  self.homo_trans_mat[1] @
-                                  self.homo_trans_mat[2] @
-                                  self.homo_trans_mat[3] @
-                                  self.homo_trans_mat[4])
+        np.matmul(buff[0], self.trans[4], out=self.trans[5])
         return self.homo_trans_mat[5]
 
     def print_homo_trans_mats(self):
@@ -128,51 +174,53 @@ class kinematics:
 
     # Creates the displacement vectors and places them in self.disp_vec
     def create_fill_disp_vects(self):
-        # Convert servo angles from degrees to radians
-        a0_rad = np.deg2rad(self.angles[self.BASE_M1])
-        a1_rad = np.deg2rad(self.angles[self.SHOULDER_M2])
-        a2_rad = np.deg2rad(self.angles[self.ELBOW_M3])
-        a3_rad = np.deg2rad(self.angles[self.WRIST_VRT_M4])
-        a4_rad = np.deg2rad(self.angles[self.WRIST_ROT_M5])
-        a5_rad = np.deg2rad(self.angles[self.GRIP_M6])
+        self.angle_trig()
+        cos = self.cos
+        sin = self.sin
+        disp = self.trans[:self.DISP_VECTS, :3, 3]
 
         # displacement vector 0-1
-        self.disp_vec[0] = np.array([[0],
-                                     [0],
-                                     [self.link_len[self.A0]]])
+        disp[0, 0] = 0
+        disp[0, 1] = 0
+        disp[0, 2] = self.link_len[self.A0]
+
         # disp vect 1-2
-        self.disp_vec[1] = np.array([[self.link_len[self.A1]*np.cos(a1_rad)],
-                                     [self.link_len[self.A1]*np.sin(a1_rad)],
-                                     [0]])
+        disp[1, 0] = self.link_len[self.A1] * cos[self.SHOULDER_M2]
+        disp[1, 1] = self.link_len[self.A1] * sin[self.SHOULDER_M2]
+        disp[1, 2] = 0
 
         # disp vect 2-3
-        self.disp_vec[2] = np.array([[self.link_len[self.A2]*np.cos(a2_rad)],
-                                     [self.link_len[self.A2]*np.sin(a2_rad)],
-                                     [0]])
+        disp[2, 0] = self.link_len[self.A2] * cos[self.ELBOW_M3]
+        disp[2, 1] = self.link_len[self.A2] * sin[self.ELBOW_M3]
+        disp[2, 2] = 0
 
         # TODO: Finish figuring out disp vect 3-4
         # disp vect 3-4
-        self.disp_vec[3] = np.array([[0],
-                                     [0],
-                                     [0]])
+        disp[3] = 0
 
         # disp vect 4-5
-        self.disp_vec[4] = np.array([[0],
-                                     [0],
-                                     [self.link_len[self.A4]]])
+        disp[4, 0] = 0
+        disp[4, 1] = 0
+        disp[4, 2] = self.link_len[self.A4]
+
+    # The 0 and 1 entries of the joint rotation matricies do not depend on the
+    # angles, they are written once here and create_rot_matrix() only writes
+    # the cos and sin entries
+    def fill_rot_consts(self):
+        rot = self.trans[:, :3, :3]
+        rot[0] = ((0, 0, 0),
+                  (0, 0, 0),
+                  (0, 1, 0))
+        rot[3] = rot[0]
+        for i in (1, 2, 4):
+            rot[i] = ((0, 0, 0),
+                      (0, 0, 0),
+                      (0, 0, 1))
 
     # returns a numpy array matrix, on error returns zero matrix, finds the
     # rotation matrix for the angles on the braccio
     # NOTE: @ syntax multiplies the matricies
     def create_rot_matrix(self, start_frame=0, end_frame=5):
-        # Convert servo angles from degrees to radians
-        a0_rad = np.deg2rad(self.angles[self.BASE_M1])
-        a1_rad = np.deg2rad(self.angles[self.SHOULDER_M2])
-        a2_rad = np.deg2rad(self.angles[self.ELBOW_M3])
-        a3_rad = np.deg2rad(self.angles[self.WRIST_VRT_M4])
-        a4_rad = np.deg2rad(self.angles[self.WRIST_ROT_M5])
-        a5_rad = np.deg2rad(self.angles[self.GRIP_M6])
-
         if (end_frame < 1 or end_frame > 5 or
             start_frame < 0 or start_frame > 4 or
             start_frame >= end_frame):
@@ -182,35 +230,66 @@ class kinematics:
                               [0,0,0]])
             return error
 
+        self.angle_trig()
+        cos = self.cos
+        sin = self.sin
+        rot = self.trans[:, :3, :3]
+
+        # Only the cos and sin entries are written, see fill_rot_consts().
+        # Writing whole rows would build a temporary array for each matrix.
+
         # This matrix helps convert the servo_1 frame to the servo_0 frame.
-        self.rot_mat[0] = np.array([[np.cos(a0_rad), 0, np.sin(a0_rad)],
-                                    [np.sin(a0_rad), 0, -np.cos(a0_rad)],
-                                    [0, 1, 0]])
+        #   ((c, 0, s), (s, 0, -c), (0, 1, 0))
+        c, s = cos[self.BASE_M1], sin[self.BASE_M1]
+        mat = rot[0]
+        mat[0, 0] = c
+        mat[0, 2] = s
+        mat[1, 0] = s
+        mat[1, 2] = -c
 
         # This matrix helps convert the servo_2 frame to the servo_1 frame.
-        self.rot_mat[1] = np.array([[np.cos(a1_rad), -np.sin(a1_rad), 0],
-                                    [np.sin(a1_rad), np.cos(a1_rad), 0],
-                                    [0, 0, 1]])
+        #   ((c, -s, 0), (s, c, 0), (0, 0, 1))
+        c, s = cos[self.SHOULDER_M2], sin[self.SHOULDER_M2]
+        mat = rot[1]
+        mat[0, 0] = c
+        mat[0, 1] = -s
+        mat[1, 0] = s
+        mat[1, 1] = c
 
         # This matrix helps convert the servo_3 frame to the servo_2 frame.
-        self.rot_mat[2] = np.array([[np.cos(a2_rad), -np.sin(a2_rad), 0],
-                                    [np.sin(a2_rad), np.cos(a2_rad), 0],
-                                    [0, 0, 1]])
+        #   ((c, -s, 0), (s, c, 0), (0, 0, 1))
+        c, s = cos[self.ELBOW_M3], sin[self.ELBOW_M3]
+        mat = rot[2]
+        mat[0, 0] = c
+        mat[0, 1] = -s
+        mat[1, 0] = s
+        mat[1, 1] = c
 
         # This matrix helps convert the servo_4 frame to the servo_3 frame.
-        self.rot_mat[3] = np.array([[-np.sin(a3_rad), 0, np.cos(a3_rad)],
-                                    [np.cos(a3_rad), 0, np.sin(a3_rad)],
-                                    [0, 1, 0]])
+        #   ((-s, 0, c), (c, 0, s), (0, 1, 0))
+        c, s = cos[self.WRIST_VRT_M4], sin[self.WRIST_VRT_M4]
+        mat = rot[3]
+        mat[0, 0] = -s
+        mat[0, 2] = c
+        mat[1, 0] = c
+        mat[1, 2] = s
 
         # This matrix helps convert the servo_5 frame to the servo_4 frame.
-        self.rot_mat[4] = np.array([[np.cos(a4_rad), -np.sin(a4_rad), 0],
-                                    [np.sin(a4_rad), np.cos(a4_rad), 0],
-                                    [0, 0, 1]])
+        #   ((c, -s, 0), (s, c, 0), (0, 0, 1))
+        c, s = cos[self.WRIST_ROT_M5], sin[self.WRIST_ROT_M5]
+        mat = rot[4]
+        mat[0, 0] = c
+        mat[0, 1] = -s
+        mat[1, 0] = s
+        mat[1, 1] = c
 
         # Calculate the rotation matrix that converts the
         # end-effector frame (frame 5) to the servo_0 frame. rot_mat_0_5
-        self.rot_mat[5] = (self.rot_mat[0] @ self.rot_mat[1] @ self.rot_mat[2] @
-                           self.rot_mat[3] @ self.rot_mat[4])
+        buff = self.rot_buff
+        np.matmul(rot[0], rot[1], out=buff[0])
+        np.matmul(buff[0], rot[2], out=buff[1])
+        np.matmul(buff[1], rot[3], out=buff[0])
+        np.matmul(buff[0], rot[4], out=rot[5])
 
         if (start_frame == 0):
             if (end_frame == 1):
@@ -261,5 +340,283 @@ class kinematics:
 
         return self.rot_mat[5] # default return rot_mat_0_5
 
-    def three_dof_inverse_kin(self):
-        return
+    # Homogeneous transforms 0_1 to 4_5 for every pose in angles, an (N, 6)
+    # array of servo angles in degrees (a single pose of 6 works too). The
+    # same matricies create_homo_trans() builds one pose at a time, stacked
+    # in an (N, 5, 4, 4) array with the sin and cos of every angle taken in
+    # one call.
+    def batch_joint_trans(self, angles):
+        rad = np.deg2rad(np.asarray(angles, dtype=float).reshape(
+                                                        -1, self.DOF_ANGLES))
+        cos = np.cos(rad)
+        sin = np.sin(rad)
+        trans = np.zeros((rad.shape[0], self.LINKS, 4, 4))
+        trans[:, :, 3, 3] = 1
+
+        # 0_1, base rotation with the shoulder frame turned up
+        c, s = cos[:, self.BASE_M1], sin[:, self.BASE_M1]
+        trans[:, 0, 0, 0] = c
+        trans[:, 0, 0, 2] = s
+        trans[:, 0, 1, 0] = s
+        trans[:, 0, 1, 2] = -c
+        trans[:, 0, 2, 1] = 1
+        trans[:, 0, 2, 3] = self.link_len[self.A0]
+
+        # 1_2 and 2_3, rotation about z with the link along the new x
+        for i, servo, link in ((1, self.SHOULDER_M2, self.A1),
+                               (2, self.ELBOW_M3, self.A2)):
+            c, s = cos[:, servo], sin[:, servo]
+            trans[:, i, 0, 0] = c
+            trans[:, i, 0, 1] = -s
+            trans[:, i, 1, 0] = s
+            trans[:, i, 1, 1] = c
+            trans[:, i, 2, 2] = 1
+            trans[:, i, 0, 3] = self.link_len[link] * c
+            trans[:, i, 1, 3] = self.link_len[link] * s
+
+        # 3_4, no displacement, see create_fill_disp_vects()
+        c, s = cos[:, self.WRIST_VRT_M4], sin[:, self.WRIST_VRT_M4]
+        trans[:, 3, 0, 0] = -s
+        trans[:, 3, 0, 2] = c
+        trans[:, 3, 1, 0] = c
+        trans[:, 3, 1, 2] = s
+        trans[:, 3, 2, 1] = 1
+
+        # 4_5, wrist rotation out to the end effector
+        c, s = cos[:, self.WRIST_ROT_M5], sin[:, self.WRIST_ROT_M5]
+        trans[:, 4, 0, 0] = c
+        trans[:, 4, 0, 1] = -s
+        trans[:, 4, 1, 0] = s
+        trans[:, 4, 1, 1] = c
+        trans[:, 4, 2, 2] = 1
+        trans[:, 4, 2, 3] = self.link_len[self.A4]
+        return trans
+
+    # Every joints 4x4 transform at every whole degree, (LINKS, TABLE_ANGLES,
+    # 4, 4) indexed by joint then servo angle. Built from batch_joint_trans()
+    # the first time it is needed and cached for the link lengths, read only
+    # so views into it can be handed out.
+    def joint_table(self):
+        key = tuple(self.link_len)
+        table = self.TABLE_CACHE.get(key)
+        if (table is None):
+            degrees = np.arange(0, self.TABLE_ANGLES)
+            table = np.ascontiguousarray(self.batch_joint_trans(
+                        np.repeat(degrees[:, None], self.DOF_ANGLES,
+                                  axis=1)).swapaxes(0, 1))
+            table.flags.writeable = False
+            self.TABLE_CACHE[key] = table
+        return table
+
+    # Copies the single pose matricies out of joint_table() into self.trans.
+    # Returns False without changing anything if an angle is not a whole
+    # degree from 0-180.
+    def fill_from_table(self):
+        index = []
+        for angle in self.angles[:self.LINKS]:
+            if (angle != int(angle) or angle < 0 or
+                angle >= self.TABLE_ANGLES):
+                return False
+            index.append(int(angle))
+
+        table = self.joint_table()
+        for i in range(0, self.LINKS):
+            self.trans[i] = table[i, index[i]]
+        self.create_homo_trans()
+        return True
+
+    # Forward kinematics for every pose in angles, see batch_joint_trans().
+    # Returns the (N, 4, 4) H_0_5 transforms, or with frames the (N, 5, 4, 4)
+    # transforms H_0_1 to H_0_5 of every joint frame, the last one being
+    # H_0_5. Does not touch self.angles or the single pose matricies.
+    # NOTE: @ syntax multiplies the matricies, stacked over the first axis
+    def batch_forward_kin(self, angles, frames=False):
+        return self.chain_trans(self.batch_joint_trans(angles), frames)
+
+    # Same as batch_forward_kin() for whole degree servo angles from 0-180,
+    # the joint transforms are picked out of joint_table() with one fancy
+    # index instead of computed. Float angles are rounded to whole degrees.
+    # Raises ValueError for angles outside 0-180.
+    def table_forward_kin(self, angles, frames=False):
+        index = np.rint(np.asarray(angles)).astype(np.intp).reshape(
+                                                        -1, self.DOF_ANGLES)
+        index = index[:, :self.LINKS]
+        if (index.size and (index.min() < 0 or
+                            index.max() >= self.TABLE_ANGLES)):
+            raise ValueError("servo angles must be 0-{}".format(
+                                                    self.TABLE_ANGLES - 1))
+        trans = self.joint_table()[np.arange(0, self.LINKS), index]
+        return self.chain_trans(trans, frames)
+
+    # Multiplies (N, LINKS, 4, 4) joint transforms down the chain, returns
+    # H_0_5 per pose or with frames H_0_1 to H_0_5 per pose
+    def chain_trans(self, trans, frames=False):
+        if (not frames):
+            return (trans[:, 0] @ trans[:, 1] @ trans[:, 2] @ trans[:, 3] @
+                    trans[:, 4])
+
+        chain = np.empty_like(trans)
+        chain[:, 0] = trans[:, 0]
+        for i in range(1, self.LINKS):
+            np.matmul(chain[:, i-1], trans[:, i], out=chain[:, i])
+        return chain
+
+    # Closed form inverse kinematics for the base, shoulder, elbow and wrist
+    # vertical servos. Places the end effector at each target pitched pitch
+    # degrees from horizontal, -90 points it straight down. targets is an
+    # (N, 3) array of x, y, z points in cm in the base frame (a single point
+    # works too), pitch is one value or one per target. Uses the same chain
+    # as the forward kinematics, the wrist vertical servo is the start of
+    # the A4 link.
+    #
+    # The base either faces the target or turns away and reaches back over
+    # the top, and the elbow bends one way or the other. The IK_BRANCHES
+    # solutions per target are in the order (facing, elbow +), (facing,
+    # elbow -), (away, elbow +), (away, elbow -).
+    #
+    # Returns (angles, valid). angles is (N, IK_BRANCHES, 6) servo angles in
+    # degrees, nan where the target is out of reach, with M5 and M6 kept
+    # from self.angles. valid is (N, IK_BRANCHES), True for the branches
+    # with M1-M4 inside the controllers servo limits, see arm_model. M5 and
+    # M6 are not solved for so they do not count.
+    def three_dof_inverse_kin(self, targets, pitch=DFLT_PITCH):
+        targets = np.asarray(targets, dtype=float).reshape(-1, 3)
+        count = targets.shape[0]
+        pitch = np.deg2rad(np.broadcast_to(np.asarray(pitch, dtype=float),
+                                           (count,)))
+        a1_len = self.link_len[self.A1]
+        a2_len = self.link_len[self.A2]
+        a4_len = self.link_len[self.A4]
+
+        # the arm moves in the vertical plane the base turns to
+        reach = np.hypot(targets[:, 0], targets[:, 1])
+        height = targets[:, 2] - self.link_len[self.A0]
+        yaw = np.arctan2(targets[:, 1], targets[:, 0])
+
+        angles = np.full((count, self.IK_BRANCHES, self.DOF_ANGLES), np.nan)
+        branch = 0
+        for facing in (True, False):
+            plane_x = reach
+            link_dir = pitch # end effector link direction in the plane
+            base = yaw
+            if (not facing):
+                plane_x = -reach
+                link_dir = np.pi - pitch
+                base = yaw + np.pi
+
+            # wrist vertical joint, two link problem from the shoulder
+            wrist_x = plane_x - a4_len * np.cos(link_dir)
+            wrist_y = height - a4_len * np.sin(link_dir)
+            cos_elbow = ((wrist_x**2 + wrist_y**2 - a1_len**2 - a2_len**2) /
+                         (2 * a1_len * a2_len))
+            with np.errstate(invalid="ignore"): # out of reach is nan
+                elbow = np.arccos(cos_elbow)
+
+            for bend in (elbow, -elbow):
+                shoulder = (np.arctan2(wrist_y, wrist_x) -
+                            np.arctan2(a2_len * np.sin(bend),
+                                       a1_len + a2_len * np.cos(bend)))
+                angles[:, branch, self.BASE_M1] = base
+                angles[:, branch, self.SHOULDER_M2] = shoulder
+                angles[:, branch, self.ELBOW_M3] = bend
+                angles[:, branch, self.WRIST_VRT_M4] = (link_dir - shoulder -
+                                                        bend)
+                branch += 1
+
+        # degrees wrapped to (-90, 270], centered on the 0-180 servo range
+        joints = np.rad2deg(angles[:, :, :self.WRIST_ROT_M5])
+        angles[:, :, :self.WRIST_ROT_M5] = 270 - (270 - joints) % 360
+        angles[:, :, self.WRIST_ROT_M5] = self.angles[self.WRIST_ROT_M5]
+        angles[:, :, self.GRIP_M6] = self.angles[self.GRIP_M6]
+
+        solved = angles[:, :, :self.WRIST_ROT_M5]
+        lower = np.array(arm_model.MIN_ANGLES[:self.WRIST_ROT_M5])
+        upper = np.array(arm_model.MAX_ANGLES[:self.WRIST_ROT_M5])
+        with np.errstate(invalid="ignore"):
+            valid = np.all((solved >= lower - self.IK_TOLERANCE) &
+                           (solved <= upper + self.IK_TOLERANCE), axis=-1)
+        return angles, valid
+
+    # Geometric Jacobian of the end effector for servo angles in degrees.
+    # Each of M1-M5 turns about the z axis of the frame before it, the base
+    # about z of the base frame, so column i is z x (p - o) over z for that
+    # frames z axis and origin o and the end effector position p. Returns
+    # (jacobian, H_0_5), the jacobian is (6, IK_JOINTS), linear rows in cm
+    # per radian over angular rows.
+    def jacobian(self, angles):
+        frames = self.batch_forward_kin(angles, frames=True)[0]
+        axes = np.empty((self.IK_JOINTS, 3))
+        origins = np.zeros((self.IK_JOINTS, 3))
+        axes[0] = (0, 0, 1)
+        axes[1:] = frames[:self.IK_JOINTS-1, :3, 2]
+        origins[1:] = frames[:self.IK_JOINTS-1, :3, 3]
+
+        jac = np.empty((6, self.IK_JOINTS))
+        jac[:3] = np.cross(axes, frames[-1, :3, 3] - origins).T
+        jac[3:] = axes.T
+        return jac, frames[-1]
+
+    # Error from the end effector transform end to target, either an H_0_5
+    # like 4x4 transform or a 3 element position when only the position
+    # matters. The orientation error is the rotation vector taking end to
+    # target for small errors, scaled by ORIENT_WEIGHT so both parts are in
+    # cm.
+    def pose_error(self, end, target):
+        if (target.ndim == 1):
+            return target - end[:3, 3]
+
+        error = target[:3, 3] - end[:3, 3]
+        orient = 0.5 * (np.cross(end[:3, 0], target[:3, 0]) +
+                        np.cross(end[:3, 1], target[:3, 1]) +
+                        np.cross(end[:3, 2], target[:3, 2]))
+        return np.concatenate((error, self.ORIENT_WEIGHT * orient))
+
+    # Damped least squares inverse kinematics for the full 5 DOF pose of the
+    # end effector. target is a 4x4 transform like H_0_5 from the forward
+    # kinematics, or an x, y, z position in cm to leave the orientation free.
+    #
+    # Starts from start, by default the last solution found here or
+    # self.angles before the first one, so a target that moved a little
+    # since the last call takes one or two steps. Every step is
+    #   dq = J^T (J J^T + damping^2 I)^-1 e
+    # limited to DLS_MAX_STEP degrees and clamped to the servo limits in
+    # arm_model. A 5 DOF arm cannot reach every orientation, the residual
+    # left is reported instead. Stops after max_iter steps or once the
+    # residual is within tol. Returns an ik_result, self.angles is not
+    # changed.
+    def dls_inverse_kin(self, target, start=None, max_iter=DLS_MAX_ITER,
+                        tol=DLS_TOLERANCE, damping=DLS_DAMPING):
+        target = np.asarray(target, dtype=float)
+        if (start is None):
+            start = self.last_ik
+            if (start is None):
+                start = self.angles
+        angles = np.array(start, dtype=float)
+        lower = np.array(arm_model.MIN_ANGLES[:self.IK_JOINTS], dtype=float)
+        upper = np.array(arm_model.MAX_ANGLES[:self.IK_JOINTS], dtype=float)
+        np.clip(angles[:self.IK_JOINTS], lower, upper,
+                out=angles[:self.IK_JOINTS])
+
+        rows = 3 if target.ndim == 1 else 6
+        damp = damping**2 * np.eye(rows)
+        iterations = 0
+        while (True):
+            jac, end = self.jacobian(angles)
+            error = self.pose_error(end, target)
+            residual = np.linalg.norm(error)
+            if (residual <= tol or iterations >= max_iter):
+                break
+
+            jac = jac[:rows]
+            jac[3:] *= self.ORIENT_WEIGHT
+            step = np.rad2deg(jac.T @ np.linalg.solve(jac @ jac.T + damp,
+                                                      error))
+            largest = np.abs(step).max()
+            if (largest > self.DLS_MAX_STEP):
+                step *= self.DLS_MAX_STEP / largest
+            angles[:self.IK_JOINTS] = np.clip(angles[:self.IK_JOINTS] + step,
+                                              lower, upper)
+            iterations += 1
+
+        self.last_ik = angles.copy()
+        return ik_result(angles, iterations, residual, residual <= tol)
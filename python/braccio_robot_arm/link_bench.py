@@ -0,0 +1,188 @@
+import argparse
+import time
+from arduino_serial import threaded_arduino_com
+from cmd_pipeline import cmd_pipeline
+from command import command_interface
+from emulator import braccio_emulator
+from kin import kinematics
+from link_stats import histogram, link_stats
+from term import term_utility
+
+# Measures the serial link at each baud rate, against the controller or, with
+# no port, against braccio_emulator paced like a real serial line.
+#
+# At each rate the link is switched with SET_BAUD and checked with an ECHO,
+# then
+#   round trip: ECHO commands one at a time, each waits for its FINISH
+#   throughput: ECHO commands through a cmd_pipeline for duration seconds,
+#               counted as commands, frames and bytes per second
+# The first rate that fails its loopback check ends the run. The link is put
+# back to the starting rate when done. Every rate, the starting one too, must
+# be one of command_interface.BAUD_RATES, they are checked before the link is
+# touched.
+class link_bench:
+    DFLT_ROUND_TRIPS = 50
+    DFLT_DURATION = 2.0 # s of pipelined commands per rate
+    DFLT_PAYLOAD = 32 # ECHO parameter bytes
+
+    def __init__(self, port=None, baudrate=115200, rtimeout=0.5, framed=False,
+                 payload=DFLT_PAYLOAD, max_baud=None):
+        check_rates((baudrate,))
+        self.emulator = None
+        if (port is None):
+            self.emulator = braccio_emulator(time_scale=0, baudrate=baudrate,
+                                             framed=framed, max_baud=max_baud)
+            port = self.emulator.start()
+
+        self.start_baud = baudrate
+        self.stats = link_stats()
+        self.com = threaded_arduino_com(port, baudrate, rtimeout,
+                                        stats=self.stats)
+        self.cmd = command_interface(self.com, kinematics(),
+                                     term_utility(False), self.stats, framed)
+        self.payload = bytes(i & 0xFF for i in range(0, payload))
+        self.results = [] # one dict per rate, see run()
+
+    # Opens the port and keeps prints off the link while measuring
+    def begin(self, reset=True, setup_timeout=command_interface.SETUP_TIMEOUT):
+        self.com.begin(delay=0, reset=reset)
+        if (reset):
+            if (not self.cmd.wait_setup(setup_timeout)):
+                raise TimeoutError("controller setup not finished after {} "
+                                   "seconds".format(setup_timeout))
+        else:
+            self.cmd.clear_input()
+        self.cmd.set_log_level(self.cmd.LOG_ERROR, self.cmd.LOG_COMPACT)
+
+    # Returns (histogram of round trip times, failed echoes)
+    def round_trip(self, count):
+        times = histogram()
+        failed = 0
+        for _ in range(0, count):
+            start = time.perf_counter()
+            if (not self.cmd.echo(self.payload)):
+                failed += 1
+            times.record(time.perf_counter() - start)
+        return times, failed
+
+    # Returns (commands, frames, bytes in) per second of pipelined ECHOs
+    def throughput(self, duration):
+        pipeline = cmd_pipeline(self.com, self.cmd)
+        frames = sum(self.stats.frames.values())
+        bytes_in = self.stats.bytes_in
+        commands = 0
+
+        start = time.perf_counter()
+        while (time.perf_counter() - start < duration):
+            pipeline.send(self.cmd.ECHO, *self.payload)
+            commands += 1
+        pipeline.drain()
+        elapsed = time.perf_counter() - start
+
+        frames = sum(self.stats.frames.values()) - frames
+        bytes_in = self.stats.bytes_in - bytes_in
+        return commands / elapsed, frames / elapsed, bytes_in / elapsed
+
+    # Measures every rate in rates, lowest first
+    def run(self, rates, round_trips=DFLT_ROUND_TRIPS,
+            duration=DFLT_DURATION):
+        check_rates(rates)
+        for baudrate in sorted(rates):
+            result = {"baudrate": baudrate, "ok": True}
+            self.results.append(result)
+            if (baudrate != self.com.baudrate and
+                not self.cmd.set_baud(baudrate)):
+                result["ok"] = False
+                break
+
+            times, result["echo_failed"] = self.round_trip(round_trips)
+            result["round_trip"] = times.snapshot()
+            (result["cmds_per_s"], result["frames_per_s"],
+             result["bytes_per_s"]) = self.throughput(duration)
+
+        if (self.com.baudrate != self.start_baud):
+            self.cmd.set_baud(self.start_baud)
+        return self
+
+    def summary(self):
+        lines = ["{:>8} {:>9} {:>9} {:>9} {:>8} {:>9} {:>10}".format(
+                        "baud", "rtt mean", "rtt p99", "cmds/s", "frames/s",
+                        "bytes/s", "echo fail")]
+        for result in self.results:
+            if (not result["ok"]):
+                lines.append("{:>8} loopback check failed".format(
+                                                        result["baudrate"]))
+                continue
+            times = result["round_trip"]
+            lines.append("{:>8} {:>7.2f}ms {:>7.2f}ms {:>9.1f} {:>8.1f} "
+                         "{:>9.0f} {:>10}".format(result["baudrate"],
+                                                  times["mean_ms"],
+                                                  times["p99_ms"],
+                                                  result["cmds_per_s"],
+                                                  result["frames_per_s"],
+                                                  result["bytes_per_s"],
+                                                  result["echo_failed"]))
+        return "\n".join(lines)
+
+    def close(self):
+        self.com.close()
+        if (self.emulator):
+            self.emulator.stop()
+
+# Raises ValueError if a rate is not one SET_BAUD can switch to
+def check_rates(rates):
+    for rate in rates:
+        if (rate not in command_interface.BAUD_RATES):
+            raise ValueError("{} is not a SET_BAUD rate, one of {}".format(
+                                    rate, command_interface.BAUD_RATES))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure round trip latency"
+                                                 " and throughput of the"
+                                                 " serial link at each baud"
+                                                 " rate.")
+    parser.add_argument("-p", dest="port", default=None,
+                        help="controller port, runs against emulator.py "
+                             "when not given")
+    parser.add_argument("-b", dest="baudrate", default=115200, type=int,
+                        help="baud rate the controller starts at")
+    parser.add_argument("-r", dest="rates", default=None,
+                        help="comma separated rates to measure, every "
+                             "SET_BAUD rate from -b up by default")
+    parser.add_argument("-c", dest="round_trips",
+                        default=link_bench.DFLT_ROUND_TRIPS, type=int,
+                        help="round trips per rate")
+    parser.add_argument("-d", dest="duration",
+                        default=link_bench.DFLT_DURATION, type=float,
+                        help="seconds of pipelined commands per rate")
+    parser.add_argument("-s", dest="payload",
+                        default=link_bench.DFLT_PAYLOAD, type=int,
+                        help="ECHO payload bytes, at most {}".format(
+                                                command_interface.PARAM_BUFF))
+    parser.add_argument("-k", dest="framed", default=False,
+                        action='store_true',
+                        help="crc checked frames, see FRAMED_LINK")
+    parser.add_argument("-n", dest="reset", default=True,
+                        action='store_false',
+                        help="do not reset the controller when opening the "
+                             "port")
+    parser.add_argument("-m", dest="max_baud", default=None, type=int,
+                        help="emulator only, garble the link above this rate")
+    cl_args = parser.parse_args()
+
+    rates = [rate for rate in command_interface.BAUD_RATES
+             if rate >= cl_args.baudrate]
+    try:
+        if (cl_args.rates):
+            rates = [int(rate) for rate in cl_args.rates.split(",")]
+        check_rates([cl_args.baudrate] + rates)
+    except ValueError as err:
+        parser.error(str(err))
+
+    bench = link_bench(cl_args.port, cl_args.baudrate, framed=cl_args.framed,
+                       payload=cl_args.payload, max_baud=cl_args.max_baud)
+    try:
+        bench.begin(cl_args.reset)
+        print(bench.run(rates, cl_args.round_trips, cl_args.duration).summary())
+    finally:
+        bench.close()
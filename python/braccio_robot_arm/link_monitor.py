@@ -0,0 +1,136 @@
+import threading
+import time
+
+# Background heartbeat on the serial link that reopens the port when the
+# link is lost and puts the braccio back in the last commanded pose.
+#
+# Every period seconds, when no command is using the link and nothing came
+# in for a period, a PING goes out and its PONG is waited for. The link is
+# lost when
+#   missed PINGs in a row go without a PONG
+#   the port reports an error, see arduino_com.link_error
+#   a command waits on the controller for stall_timeout seconds with nothing
+#   coming in, longer than the slowest move the braccio makes
+# The port is then opened again without resetting the controller and the
+# next free beat checks the pose with command_interface.restore_pose().
+# The reconnect time given to link_stats runs from when the link was last
+# known good, the first missed PING, the port error or the last activity of
+# the stalled command, to when the port is open again.
+# init_arm() is not run again, the controller keeps running through a lost
+# link. A command waiting on the lost link returns with
+# exec_result.reconnected set.
+class link_monitor:
+    DFLT_PERIOD = 0.5 # s between beats
+    DFLT_MISSED = 2 # PINGs without a PONG before the link is lost
+    STALL_TIMEOUT = 10 # s
+    REOPEN_TIMEOUT = 5 # s of retries before a reconnect fails
+    REOPEN_RETRY = 0.1 # s between tries to open the port
+
+    def __init__(self, arduino_serial, cmd, stats=None, period=DFLT_PERIOD,
+                 missed=DFLT_MISSED, stall_timeout=STALL_TIMEOUT):
+        self.arduino_serial = arduino_serial
+        self.cmd = cmd
+        self.stats = stats
+        self.period = period
+        self.missed = missed
+        self.stall_timeout = stall_timeout
+
+        self.missed_beats = 0
+        self.first_missed = 0 # time.monotonic() the first missed PING went out
+        self.lost_at = None # time.monotonic() the link was lost, see reconnect()
+        self.restore_pending = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if (self.thread):
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while (not self.stop_event.wait(self.period)):
+            self.beat()
+
+    # One heartbeat, see the class comment
+    def beat(self):
+        if (not self.arduino_serial.link_ok()):
+            self.reconnect(self.arduino_serial.link_error_time)
+            return
+
+        # a command owns the link, only check it is not stuck
+        if (not self.cmd.lock.acquire(blocking=False)):
+            if (self.cmd.waiting and
+                time.monotonic() - self.cmd.last_activity >=
+                self.stall_timeout):
+                self.reconnect(self.cmd.last_activity)
+            return
+
+        try:
+            if (self.restore_pending):
+                self.restore()
+                return
+            if (time.monotonic() - self.cmd.last_activity < self.period):
+                return # the link was just used, no need to ask
+
+            sent = time.monotonic()
+            if (self.cmd.ping(min(self.period, self.cmd.PING_TIMEOUT))):
+                self.missed_beats = 0
+                return
+        finally:
+            self.cmd.lock.release()
+
+        if (self.missed_beats == 0):
+            self.first_missed = sent
+        self.missed_beats += 1
+        if (self.stats):
+            self.stats.on_missed_beat()
+        if (self.missed_beats >= self.missed):
+            self.reconnect(self.first_missed)
+
+    # Opens the port again, retrying for REOPEN_TIMEOUT seconds. lost_at is
+    # the time.monotonic() the link was lost, kept over failed reconnects so
+    # the time given to link_stats covers the whole outage. Returns True once
+    # the port is open.
+    def reconnect(self, lost_at):
+        start = time.monotonic()
+        if (self.lost_at is None):
+            self.lost_at = lost_at
+        self.cmd.term.print_verbose("link lost, reopening {}\n".format(
+                                                    self.arduino_serial.port))
+        while (True):
+            try:
+                self.arduino_serial.reopen()
+                break
+            except self.arduino_serial.PORT_ERRORS:
+                if (time.monotonic() - start >= self.REOPEN_TIMEOUT or
+                    self.stop_event.wait(self.REOPEN_RETRY)):
+                    if (self.stats):
+                        self.stats.on_reconnect(
+                                    time.monotonic() - self.lost_at, False)
+                    return False
+
+        if (self.stats):
+            self.stats.on_reconnect(time.monotonic() - self.lost_at, True)
+        self.lost_at = None
+        self.missed_beats = 0
+        self.restore_pending = True
+        # the stall clock starts over, a command may still be waiting
+        self.cmd.last_activity = time.monotonic()
+        # a command waiting on the old port drops its partial message itself
+        if (self.cmd.lock.acquire(blocking=False)):
+            self.cmd.decoder.reset()
+            self.cmd.lock.release()
+        return True
+
+    # Puts the controller back in the commanded pose, tried again next beat
+    # if the link drops on the way
+    def restore(self):
+        if (self.cmd.restore_pose()):
+            self.restore_pending = False
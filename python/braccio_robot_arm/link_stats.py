@@ -0,0 +1,213 @@
+import bisect
+import time
+from protocol import protocol
+
+# Histogram with fixed bucket bounds, recording is a bisect and two adds so
+# it can stay on all the time.
+class histogram:
+    # bucket upper bounds in ms, the last bucket holds everything above
+    DFLT_BOUNDS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000,
+                   2000, 5000)
+
+    def __init__(self, bounds=DFLT_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0 # ms
+        self.max = 0 # ms
+
+    # seconds is converted to ms
+    def record(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds, ms)] += 1
+        self.count += 1
+        self.total += ms
+        if (ms > self.max):
+            self.max = ms
+
+    def mean(self):
+        if (self.count == 0):
+            return 0
+        return self.total / self.count
+
+    # ms value below which fraction of the recorded values fall, as the
+    # upper bound of the bucket it lands in
+    def percentile(self, fraction):
+        if (self.count == 0):
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if (seen >= target):
+                if (i < len(self.bounds)):
+                    return min(self.bounds[i], self.max)
+                return self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count"   : self.count,
+            "mean_ms" : self.mean(),
+            "p50_ms"  : self.percentile(0.5),
+            "p99_ms"  : self.percentile(0.99),
+            "max_ms"  : self.max,
+            "buckets" : list(zip(self.bounds + (None,), self.counts)),
+        }
+
+# Serial link statistics shared by arduino_com and command_interface.
+#
+# arduino_com counts bytes each way and marks when each command is written,
+# command_interface marks every ACK and FINISH and counts frames by type.
+# Latencies are paired in order, with a pipeline of commands in flight an
+# ACK is paired with the latest write.
+class link_stats:
+    # message type names for the frame counts
+    MSG_NAMES = protocol.MSG_NAMES
+    # message types that carry a cmd, counted per cmd
+    CMD_TYPES = (protocol.CMD_MSG, protocol.PRINT_MSG)
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.writes = 0
+
+        self.write_to_ack = histogram()
+        self.ack_to_finish = histogram()
+        self.finish_to_next = histogram()
+
+        self.frames = {} # (msg_type, cmd) -> count
+
+        self.verbose_frames = 0
+        self.verbose_bytes = 0
+        self.verbose_time = 0 # s spent executing verbose prints
+
+        self.last_write = None
+        self.last_ack = None
+        self.last_finish = None
+
+        # link_monitor, time from a lost link to the port open again
+        self.reconnect_time = histogram()
+        self.reconnects = 0
+        self.reconnect_failures = 0
+        self.missed_beats = 0
+
+    def on_write(self, nbytes):
+        now = time.monotonic()
+        self.bytes_out += nbytes
+        self.writes += 1
+        if (self.last_finish is not None):
+            self.finish_to_next.record(now - self.last_finish)
+            self.last_finish = None
+        self.last_write = now
+
+    def on_read(self, nbytes):
+        self.bytes_in += nbytes
+
+    def on_ack(self):
+        now = time.monotonic()
+        if (self.last_write is not None):
+            self.write_to_ack.record(now - self.last_write)
+            self.last_write = None
+        self.last_ack = now
+
+    def on_finish(self):
+        now = time.monotonic()
+        if (self.last_ack is not None):
+            self.ack_to_finish.record(now - self.last_ack)
+            self.last_ack = None
+        self.last_finish = now
+
+    def on_frame(self, msg_type, cmd):
+        key = (msg_type, cmd)
+        self.frames[key] = self.frames.get(key, 0) + 1
+
+    # size is the whole message on the wire, seconds the time to print it
+    def on_verbose(self, size, seconds):
+        self.verbose_frames += 1
+        self.verbose_bytes += size
+        self.verbose_time += seconds
+
+    def on_missed_beat(self):
+        self.missed_beats += 1
+
+    # ok is False when the port could not be opened again
+    def on_reconnect(self, seconds, ok):
+        if (not ok):
+            self.reconnect_failures += 1
+            return
+        self.reconnects += 1
+        self.reconnect_time.record(seconds)
+
+    def frame_name(self, key):
+        msg_type, cmd = key
+        name = self.MSG_NAMES.get(msg_type, str(msg_type))
+        if (msg_type in self.CMD_TYPES):
+            name = "{}/{}".format(name, cmd)
+        return name
+
+    def snapshot(self):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        return {
+            "elapsed_s"        : elapsed,
+            "writes"           : self.writes,
+            "bytes_out"        : self.bytes_out,
+            "bytes_in"         : self.bytes_in,
+            "bytes_out_per_s"  : self.bytes_out / elapsed,
+            "bytes_in_per_s"   : self.bytes_in / elapsed,
+            "write_to_ack"     : self.write_to_ack.snapshot(),
+            "ack_to_finish"    : self.ack_to_finish.snapshot(),
+            "finish_to_next"   : self.finish_to_next.snapshot(),
+            "frames"           : {self.frame_name(key): count
+                                  for key, count in self.frames.items()},
+            "verbose_frames"   : self.verbose_frames,
+            "verbose_bytes"    : self.verbose_bytes,
+            "verbose_time_s"   : self.verbose_time,
+            "missed_beats"     : self.missed_beats,
+            "reconnects"       : self.reconnects,
+            "reconnect_fails"  : self.reconnect_failures,
+            "reconnect_time"   : self.reconnect_time.snapshot(),
+        }
+
+    # Text report of snapshot()
+    def dump(self):
+        snap = self.snapshot()
+        lines = ["link stats over {:.1f} s, {} writes".format(
+                                            snap["elapsed_s"], snap["writes"]),
+                 "  out {} bytes ({:.1f} B/s), in {} bytes ({:.1f} B/s)".format(
+                                            snap["bytes_out"],
+                                            snap["bytes_out_per_s"],
+                                            snap["bytes_in"],
+                                            snap["bytes_in_per_s"])]
+
+        for name in ("write_to_ack", "ack_to_finish", "finish_to_next"):
+            hist = snap[name]
+            lines.append("  {:<15} n={:<6} mean={:.2f} p50<={:.2f} "
+                         "p99<={:.2f} max={:.2f} ms".format(name, hist["count"],
+                                                hist["mean_ms"],
+                                                hist["p50_ms"], hist["p99_ms"],
+                                                hist["max_ms"]))
+
+        frames = ", ".join("{}: {}".format(name, count)
+                           for name, count in sorted(snap["frames"].items()))
+        lines.append("  frames {}".format(frames))
+
+        verbose_share = 0
+        if (snap["bytes_in"] > 0):
+            verbose_share = snap["verbose_bytes"] / snap["bytes_in"] * 100
+        lines.append("  verbose {} frames, {} bytes ({:.1f}% of in), "
+                     "{:.3f} s printing".format(snap["verbose_frames"],
+                                                snap["verbose_bytes"],
+                                                verbose_share,
+                                                snap["verbose_time_s"]))
+
+        hist = snap["reconnect_time"]
+        lines.append("  link {} missed beats, {} reconnects ({} failed), "
+                     "mean={:.2f} max={:.2f} ms".format(
+                                                snap["missed_beats"],
+                                                snap["reconnects"],
+                                                snap["reconnect_fails"],
+                                                hist["mean_ms"],
+                                                hist["max_ms"]))
+        return "\n".join(lines)
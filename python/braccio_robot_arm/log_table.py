@@ -0,0 +1,28 @@
+# Generated by gen_log_table.py from log_msgs.h, do not edit.
+# log id: (name, format, number of arguments)
+LOG_MSGS = {
+    0x01: ('LOG_SETUP_COMPLETE', 'Setup Complete\n', 0),
+    0x02: ('LOG_STARTING', 'Starting Braccio\n', 0),
+    0x03: ('LOG_SETTING_DFLT_POS', 'setting default position\n', 0),
+    0x04: ('LOG_DFLT_POS_SET', 'default position set\nchanged angles, M1: %d, M2: %d, M3: %d, M4: %d, M5: %d, M6: %d\n', 6),
+    0x05: ('LOG_CHANGED_ANGLE', 'Changed M%u angle to %u\n', 2),
+    0x06: ('LOG_CHANGED_ALL', 'Changed all angles, M1: %d, M2: %d, M3: %d, M4: %d, M5: %d, M6: %d\n', 6),
+    0x07: ('LOG_CURRENT_ANGLES', 'Current angles from controller, M1: %d, M2: %d, M3: %d, M4: %d, M5: %d, M6: %d\n', 6),
+    0x08: ('LOG_TRAJ_FINISHED', 'Finished trajectory of %u waypoints, M1: %d, M2: %d, M3: %d, M4: %d, M5: %d, M6: %d\n', 7),
+    0x09: ('LOG_TELEM_MODE', 'Telemetry mode %u, period %u ms\n', 2),
+    0x0A: ('LOG_LEVEL_SET', 'Log level %u, compact %u\n', 2),
+    0x0B: ('LOG_BAUD_SET', 'Switching to %u00 baud\n', 1),
+    0x40: ('LOG_READ_FAILED', 'Failed to read message from host\n', 0),
+    0x41: ('LOG_INVALID_MSG_TYPE', 'Invalid message type, not a command message\n', 0),
+    0x42: ('LOG_INVALID_CMD', 'Invalid command recieved.\n', 0),
+    0x43: ('LOG_INVALID_TRAJ_LEN', 'Invalid trajectory length %u\n', 1),
+    0x44: ('LOG_MISSING_TELEM', 'Missing telemetry parameters\n', 0),
+    0x45: ('LOG_INVALID_TELEM', 'Invalid telemetry mode %u\n', 1),
+    0x46: ('LOG_MISSING_LOG_LEVEL', 'Missing log level\n', 0),
+    0x47: ('LOG_INVALID_LOG_LEVEL', 'Invalid log level %u\n', 1),
+    0x48: ('LOG_BAD_FRAME', 'Bad frame crc, message dropped\n', 0),
+    0x49: ('LOG_MISSING_BAUD', 'Missing baud rate\n', 0),
+    0x4A: ('LOG_INVALID_BAUD', 'Invalid baud rate index %u\n', 1),
+    0x4B: ('LOG_INVALID_TELEM_PERIOD', 'Invalid telemetry period %u, periodic needs at least 1\n', 1),
+    0x4C: ('LOG_INVALID_LOG_FORMAT', 'Invalid log format %u\n', 1),
+}
@@ -4,6 +4,7 @@ import argparse
 BAUD_RATE = 115200
 SERIAL_PORT = "/dev/ttyACM0"
 RTIMEOUT = 0.5 # read serial timeout
+SETUP_TIMEOUT = 10 # s
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Interface to control and test"
@@ -12,10 +13,48 @@ if __name__ == "__main__":
     parser.add_argument("-v", dest="verbose", default=False, 
                         action='store_true')
     parser.add_argument("-p", dest="port", default=SERIAL_PORT)
+    parser.add_argument("-t", dest="threaded", default=False,
+                        action='store_true',
+                        help="read serial with a background thread instead "
+                             "of fixed sleeps")
+    parser.add_argument("-a", dest="telemetry", default=False,
+                        action='store_true',
+                        help="controller pushes angles when they change "
+                             "instead of the host requesting them")
+    parser.add_argument("-c", dest="verify", default=False,
+                        action='store_true',
+                        help="request angles after every command to check "
+                             "the angles predicted on the host")
+    parser.add_argument("-n", dest="reset", default=True,
+                        action='store_false',
+                        help="do not reset the controller when opening the "
+                             "port, it is already running")
+    parser.add_argument("-w", dest="setup_timeout", default=SETUP_TIMEOUT,
+                        type=float,
+                        help="seconds to wait for the controller setup")
+    parser.add_argument("-r", dest="record", default=None,
+                        help="append all serial traffic to this file, replay "
+                             "it with traffic_replay.py")
+    parser.add_argument("-k", dest="framed", default=False,
+                        action='store_true',
+                        help="crc checked frames, the controller must be "
+                             "built with FRAMED_LINK")
+    parser.add_argument("-b", dest="negotiate", default=False,
+                        action='store_true',
+                        help="step the link up to the fastest baud rate that "
+                             "passes a loopback check, see link_bench.py")
+    parser.add_argument("-l", dest="monitor", default=False,
+                        action='store_true',
+                        help="heartbeat on the link, reopens the port and "
+                             "restores the pose if the link is lost")
     cl_args = parser.parse_args()
     
-    braccio = braccio_interface(cl_args.verbose, cl_args.port, 
-                                BAUD_RATE, RTIMEOUT)
+    braccio = braccio_interface(cl_args.verbose, cl_args.port,
+                                BAUD_RATE, RTIMEOUT, cl_args.threaded,
+                                cl_args.telemetry, cl_args.verify,
+                                cl_args.reset, cl_args.setup_timeout,
+                                cl_args.record, cl_args.framed,
+                                cl_args.negotiate, cl_args.monitor)
 
     braccio.begin_com()
 
@@ -27,5 +66,7 @@ if __name__ == "__main__":
         print("\nexiting...")
     finally:
         print("\nexiting...")
+        braccio.end_com()
+        print(braccio.stats.dump())
         
 
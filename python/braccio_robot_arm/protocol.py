@@ -0,0 +1,53 @@
+# Message types and command ids of the serial protocol, kept in sync with
+# braccio_arm.h. command_interface gets them as class attributes, modules
+# that only need an id (write_queue) import this instead of command.
+class protocol:
+    # message types
+    CMD_MSG   = 0x0
+    PRINT_MSG = 0x1
+    ACK       = 0x2
+    FINISH    = 0x3
+    SEQ_CMD_MSG = 0x4 # command message tagged with a sequence id
+    SEQ_ACK     = 0x5 # ack echoing the sequence id of a SEQ_CMD_MSG
+    SEQ_FINISH  = 0x6 # finish echoing the sequence id of a SEQ_CMD_MSG
+    PONG        = 0x7 # only reply to a PING
+    SEQ_NAK     = 0x8 # a SEQ_CMD_MSG was not read, before its SEQ_FINISH
+
+    # message type names, add new types here too
+    MSG_NAMES = {
+        CMD_MSG     : "CMD",
+        PRINT_MSG   : "PRINT",
+        ACK         : "ACK",
+        FINISH      : "FINISH",
+        SEQ_CMD_MSG : "SEQ_CMD",
+        SEQ_ACK     : "SEQ_ACK",
+        SEQ_FINISH  : "SEQ_FINISH",
+        PONG        : "PONG",
+        SEQ_NAK     : "SEQ_NAK",
+    }
+
+    # incomming message command
+    PRINT_GENERAL = 0x0
+    PRINT_ERROR   = 0x1
+    PRINT_VERBOSE = 0x2
+    SENT_ANGLES   = 0x3
+    PRINT_LOG_ID  = 0x4 # interned log message, see log_msgs.h
+    ECHO_REPLY    = 0x5 # parameters of an ECHO sent back
+
+    # outgoing message command
+    M1_ANGLE = 0x1
+    M2_ANGLE = 0x2
+    M3_ANGLE = 0x3
+    M4_ANGLE = 0x4
+    M5_ANGLE = 0x5
+    M6_ANGLE = 0x6
+    MX_ANGLE = 0x7
+    REQUEST_MX_ANGLE = 0x8
+    SET_DFLT_POS = 0x9
+    TRAJECTORY = 0xA
+    SUBSCRIBE_ANGLES = 0xB
+    SET_LOG_LEVEL = 0xC
+    SET_BAUD = 0xD # switches after its FINISH
+    ECHO = 0xE # parameters come back in an ECHO_REPLY
+    PING = 0xF # heartbeat, answered with a PONG message
+    CONFIRM_BAUD = 0x10 # keep the rate SET_BAUD switched to
@@ -0,0 +1,34 @@
+import threading
+import time
+
+# Thread safe cache of the latest angles reported by the controller.
+#
+# Updated for every SENT_ANGLES message, whether it was requested with
+# REQUEST_MX_ANGLE or pushed by the controller after SUBSCRIBE_ANGLES, so
+# other threads can read the current angles without going to the controller.
+class state_cache:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.angles = None # None until the first SENT_ANGLES
+        self.timestamp = None # time.monotonic() of the last update
+        self.updates = 0
+
+    def update(self, angles):
+        with self.lock:
+            self.angles = list(angles)
+            self.timestamp = time.monotonic()
+            self.updates += 1
+
+    # returns (angles, timestamp), angles is a copy
+    def get(self):
+        with self.lock:
+            if (self.angles is None):
+                return None, None
+            return list(self.angles), self.timestamp
+
+    # seconds since the last update, None if there never was one
+    def age(self):
+        with self.lock:
+            if (self.timestamp is None):
+                return None
+            return time.monotonic() - self.timestamp
@@ -0,0 +1,86 @@
+import mmap
+import os
+import struct
+import threading
+import time
+
+# Binary log of the raw bytes sent to and recieved from the controller.
+#
+# File layout, all little endian:
+#   MAGIC
+#   records: [direction u8][time.monotonic_ns() u64][length u16][bytes]
+# direction is TO_ARM or FROM_ARM. Records are appended as the bytes are
+# written or read, a recieved record is whatever one read returned so it can
+# hold part of a message or several messages.
+MAGIC = b"BRCLOG1\n"
+RECORD = struct.Struct("<BQH")
+TO_ARM   = 0
+FROM_ARM = 1
+
+# Appends records to a traffic log, see arduino_com(recorder=...). Safe to
+# call from the threaded transports reader thread and the host thread.
+class traffic_recorder:
+    MAX_RECORD = 0xFFFF # length is 2 bytes, longer data is split
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.log = open(path, "ab")
+        if (self.log.tell() == 0):
+            self.log.write(MAGIC)
+
+    def record(self, direction, data):
+        timestamp = time.monotonic_ns()
+        with self.lock:
+            for start in range(0, len(data), self.MAX_RECORD):
+                chunk = data[start:start + self.MAX_RECORD]
+                self.log.write(RECORD.pack(direction, timestamp, len(chunk)))
+                self.log.write(chunk)
+
+    def flush(self):
+        with self.lock:
+            self.log.flush()
+
+    def close(self):
+        with self.lock:
+            self.log.close()
+
+# Reads a traffic log through mmap, records are scanned in place without
+# reading the file into memory.
+class traffic_log:
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = None
+        self.view = memoryview(b"")
+        if (os.fstat(self.file.fileno()).st_size > 0):
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+
+        if (self.view[:len(MAGIC)] != MAGIC):
+            self.close()
+            raise ValueError("{} is not a traffic log".format(path))
+
+    # Yields (direction, timestamp ns, data) for every record, data is a
+    # memoryview into the map. A record cut short by a crash ends the log.
+    def records(self):
+        offset = len(MAGIC)
+        end = len(self.view)
+        while (offset + RECORD.size <= end):
+            direction, timestamp, length = RECORD.unpack_from(self.view,
+                                                              offset)
+            offset += RECORD.size
+            if (offset + length > end):
+                return
+            yield direction, timestamp, self.view[offset:offset + length]
+            offset += length
+
+    def __iter__(self):
+        return self.records()
+
+    def close(self):
+        self.view.release()
+        if (self.map):
+            self.map.close()
+            self.map = None
+        self.file.close()
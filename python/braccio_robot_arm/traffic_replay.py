@@ -0,0 +1,181 @@
+import argparse
+import time
+from command import command_interface
+from kin import kinematics
+from term import term_utility
+from traffic_log import traffic_log, TO_ARM, FROM_ARM
+
+# Transport that plays back the controller side of a traffic log, used in
+# place of arduino_com by command_interface.
+#
+# Recieved records are split into segments by the recorded writes. Bytes of a
+# segment are only handed out after the write that started it has been made,
+# and with speed above 0 not before the recorded time since that write
+# divided by speed. speed 1 is recorded speed and 0 is as fast as possible.
+class replay_com:
+    def __init__(self, log, speed=1.0, rtimeout=0.5):
+        self.rtimeout = rtimeout
+        self.speed = speed
+        self.records = [(direction, timestamp, bytes(data))
+                        for direction, timestamp, data in log.records()]
+        self.pos = 0 # next record
+        self.rx_buff = bytearray()
+
+        # wall time and recorded time that recieved records are timed from
+        self.anchor = time.monotonic()
+        self.anchor_ts = self.records[0][1] if self.records else 0
+
+        self.mismatched = 0 # writes that differ from the recorded write
+
+    def begin(self, delay=0, reset=True):
+        pass
+
+    # Time left until the next recieved record is due, None if the segment
+    # has no more records
+    def next_due(self):
+        if (self.pos >= len(self.records) or
+            self.records[self.pos][0] != FROM_ARM):
+            return None
+        if (self.speed <= 0):
+            return 0
+        recorded = (self.records[self.pos][1] - self.anchor_ts) / 1e9
+        return self.anchor + recorded / self.speed - time.monotonic()
+
+    # Moves every due recieved record into rx_buff
+    def refill(self):
+        due = self.next_due()
+        while (due is not None and due <= 0):
+            self.rx_buff += self.records[self.pos][2]
+            self.pos += 1
+            due = self.next_due()
+        return due
+
+    # True when everything recieved before the next recorded write has been
+    # read
+    def segment_done(self):
+        return self.next_due() is None and len(self.rx_buff) == 0
+
+    # Returns the next recorded write, None at the end of the log
+    def next_write(self):
+        for direction, timestamp, data in self.records[self.pos:]:
+            if (direction == TO_ARM):
+                return data
+        return None
+
+    def write(self, msg, delay=0):
+        # what is left of this segment came before the write
+        while (self.pos < len(self.records) and
+               self.records[self.pos][0] == FROM_ARM):
+            self.rx_buff += self.records[self.pos][2]
+            self.pos += 1
+
+        if (self.pos >= len(self.records)):
+            return
+
+        direction, timestamp, data = self.records[self.pos]
+        if (data != bytes(msg)):
+            self.mismatched += 1
+        self.anchor = time.monotonic()
+        self.anchor_ts = timestamp
+        self.pos += 1
+
+    def read(self, size=1, delay=0):
+        return self.read_timeout(size, self.rtimeout)
+
+    def read_timeout(self, size, timeout, cancel=None):
+        deadline = time.monotonic() + timeout
+        due = self.refill()
+        while (len(self.rx_buff) < size and due is not None):
+            wait = min(due, deadline - time.monotonic())
+            if (wait <= 0 or (cancel is not None and cancel.is_set())):
+                break
+            time.sleep(wait)
+            due = self.refill()
+
+        reading = bytes(self.rx_buff[:size])
+        del self.rx_buff[:size]
+        return reading
+
+    def in_waiting(self):
+        self.refill()
+        return len(self.rx_buff)
+
+    def clear_input_buffer(self):
+        self.rx_buff.clear()
+
+    def wake(self):
+        pass
+
+    def close(self):
+        pass
+
+# Drives command_interface from a traffic log. Each recorded write is made
+# through replay_com and everything the controller sent after it is read and
+# executed like read_exec() does. Reports how long the host spent handling
+# the frames, without an arm or the emulator.
+class traffic_replayer:
+    def __init__(self, path, speed=1.0, verbose=False, framed=False):
+        self.log = traffic_log(path)
+        self.com = replay_com(self.log, speed)
+        self.cmd = command_interface(self.com, kinematics(),
+                                     term_utility(verbose), framed=framed)
+
+        self.writes = 0
+        self.frames = 0
+        self.bytes_read = 0
+        self.exec_time = 0 # s spent in exec_frame()
+        self.elapsed = 0
+
+    def run(self):
+        start = time.monotonic()
+        while (True):
+            if (self.com.segment_done()):
+                msg = self.com.next_write()
+                if (msg is None):
+                    break
+                self.com.write(msg)
+                self.writes += 1
+                continue
+
+            self.bytes_read += self.cmd.read_in(self.com.rtimeout)
+            for frame in self.cmd.decoder.frames():
+                exec_start = time.perf_counter()
+                self.cmd.exec_frame(frame, wait_for_enter=True)
+                self.exec_time += time.perf_counter() - exec_start
+                self.frames += 1
+
+        self.elapsed = time.monotonic() - start
+        return self
+
+    def summary(self):
+        per_frame = 0
+        if (self.frames > 0):
+            per_frame = self.exec_time / self.frames * 1e6
+        return ("{} writes, {} frames, {} bytes read in {:.3f} s, "
+                "{:.1f} us per frame handled".format(self.writes, self.frames,
+                                                     self.bytes_read,
+                                                     self.elapsed, per_frame))
+
+    def close(self):
+        self.log.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a traffic log"
+                                                 " recorded with main.py -r.")
+    parser.add_argument("log")
+    parser.add_argument("-s", dest="speed", default=1.0, type=float,
+                        help="replay speed, 1 is recorded speed and 0 is as "
+                             "fast as possible")
+    parser.add_argument("-v", dest="verbose", default=False,
+                        action='store_true')
+    parser.add_argument("-k", dest="framed", default=False,
+                        action='store_true',
+                        help="the log was recorded on a crc framed link")
+    cl_args = parser.parse_args()
+
+    replayer = traffic_replayer(cl_args.log, cl_args.speed, cl_args.verbose,
+                                cl_args.framed)
+    try:
+        print(replayer.run().summary())
+    finally:
+        replayer.close()
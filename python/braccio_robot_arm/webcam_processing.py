@@ -2,6 +2,7 @@ import cv2
 from collections import deque
 import numpy as np
 from term import term_utility
+from cmd_pipeline import cmd_pipeline
 import time
 
 class background_buffer:
@@ -64,6 +65,11 @@ class motion_detection:
         self.cmd = cmd
         self.term = term
 
+        # moves are sent without waiting on the controller so frames keep
+        # being pulled while the braccio moves, a pose still waiting to go
+        # out is replaced by the newest one instead of backing up
+        self.pipeline = cmd_pipeline(arduino_serial, cmd, latest_wins=True)
+
         # gaussian blur options
         self.gaus_blur_ksize_ds = (5,5)
         self.gaus_blur_sigmax_ds = 0
@@ -255,32 +261,29 @@ class motion_detection:
             roi_right_movement = roi_right.any()
             if (roi_left_movement and roi_right_movement):
                 self.term.print_verbose("BOTH SIDES MOVEMENT\n")
-                msg = self.cmd.build_cmd_msg(self.cmd.SET_DFLT_POS)
-                self.arduino_serial.write(msg)
+                self.pipeline.send(self.cmd.SET_DFLT_POS)
                 movement = True
             elif (roi_left_movement):
                 self.term.print_verbose("LEFT SIDE MOVEMENT\n")
-                msg = self.cmd.build_cmd_msg(self.cmd.MX_ANGLE,
-                                             left_move_pos[0],
-                                             left_move_pos[1],
-                                             left_move_pos[2],
-                                             left_move_pos[3],
-                                             left_move_pos[4],
-                                             left_move_pos[5],
-                                             )
-                self.arduino_serial.write(msg)
+                self.pipeline.send(self.cmd.MX_ANGLE,
+                                   left_move_pos[0],
+                                   left_move_pos[1],
+                                   left_move_pos[2],
+                                   left_move_pos[3],
+                                   left_move_pos[4],
+                                   left_move_pos[5],
+                                   )
                 movement = True
             elif (roi_right_movement):
                 self.term.print_verbose("RIGHT SIDE MOVEMENT\n")
-                msg = self.cmd.build_cmd_msg(self.cmd.MX_ANGLE,
-                                             right_move_pos[0],
-                                             right_move_pos[1],
-                                             right_move_pos[2],
-                                             right_move_pos[3],
-                                             right_move_pos[4],
-                                             right_move_pos[5],
-                                             )
-                self.arduino_serial.write(msg)
+                self.pipeline.send(self.cmd.MX_ANGLE,
+                                   right_move_pos[0],
+                                   right_move_pos[1],
+                                   right_move_pos[2],
+                                   right_move_pos[3],
+                                   right_move_pos[4],
+                                   right_move_pos[5],
+                                   )
                 movement = True
             else:
                 self.term.print_verbose("NO MOVEMENT\n")
@@ -293,8 +296,9 @@ class motion_detection:
                                       self.COLOR_CODE_GREEN,
                                       self.contour_rect_thickness,
                                       self.down_scale)
-        if (movement):
-            self.arduino_serial.clear_input_buffer()
+
+        # handle whatever the controller sent back for moves in flight
+        self.pipeline.poll()
 
         return True, movement, new_frame
 
@@ -433,7 +437,8 @@ class webcam_processing():
                 cv2.destroyAllWindows()
                 exit_flag = True
 
-        self.arduino_serial.clear_input_buffer()
+        # let the moves still in flight finish so nothing is left on the line
+        motion_detect.pipeline.drain()
         return 0
 
     def webcam_flow_no_braccio(self):
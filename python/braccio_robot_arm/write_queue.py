@@ -0,0 +1,81 @@
+import time
+from protocol import protocol
+
+# Outbound frame queue, frames queued within window seconds of the first one
+# waiting go out joined in a single arduino_com.write(), one syscall instead
+# of one per frame. The write has no delay after it, callers wait on the
+# controller for their FINISH instead.
+#
+# Nothing is written until flush(), callers flush once expired() says the
+# window has run out and always before waiting on the controller for the
+# commands queued.
+#
+# With latest_wins a queued MX_ANGLE frame is dropped when a newer one is
+# queued, every angle is set by the newer one so only the latest pose still
+# has to be sent. A fast producer never builds up a backlog of stale poses.
+#
+# The default window is 0 on purpose, expired() is True as soon as anything
+# is queued so no frame waits on a timer. Frames still go out together when
+# a caller queues several before its flush(), like
+# command_interface.queue_cmd(), or when cmd_pipeline has no room in its
+# window to flush, and only then can latest_wins drop a pose. A window above
+# 0 holds every frame back that long so more of them share a write, trading
+# latency for fewer writes. It only pays off when frames are queued faster
+# than the window and the caller checks expired() at least that often, so it
+# is left for the caller to choose, see cmd_pipeline coalesce.
+class write_queue:
+    DFLT_WINDOW = 0 # s, expired() once anything is queued, see above
+
+    def __init__(self, arduino_serial, window=DFLT_WINDOW, latest_wins=False,
+                 supersede=(protocol.MX_ANGLE,)):
+        self.arduino_serial = arduino_serial
+        self.window = window
+        self.latest_wins = latest_wins
+        self.supersede = supersede
+        self.pending = [] # (cmd, msg, tag) in queue order
+        self.first_queued = None # time.monotonic() of the oldest pending
+        self.dropped = 0
+
+    # Queues a built message for cmd. tag is handed back by flush() when the
+    # message is written, and returned here if an earlier message it
+    # supersedes was dropped. Returns the tags dropped.
+    def queue(self, cmd, msg, tag=None):
+        dropped = []
+        if (self.latest_wins and cmd in self.supersede):
+            kept = []
+            for entry in self.pending:
+                if (entry[0] == cmd):
+                    dropped.append(entry[2])
+                else:
+                    kept.append(entry)
+            self.pending = kept
+            self.dropped += len(dropped)
+
+        if (len(self.pending) == 0):
+            self.first_queued = time.monotonic()
+        self.pending.append((cmd, msg, tag))
+        return dropped
+
+    def __len__(self):
+        return len(self.pending)
+
+    # True once the oldest pending frame has waited out the window
+    def expired(self):
+        return (len(self.pending) > 0 and
+                time.monotonic() - self.first_queued >= self.window)
+
+    # Writes up to limit pending frames (None for all) in one write. Returns
+    # the tags of the frames written, in order.
+    def flush(self, limit=None):
+        if (limit is None or limit > len(self.pending)):
+            limit = len(self.pending)
+        if (limit <= 0):
+            return []
+
+        sent = self.pending[:limit]
+        del self.pending[:limit]
+        if (len(self.pending) > 0):
+            self.first_queued = time.monotonic()
+
+        self.arduino_serial.write(b"".join([entry[1] for entry in sent]), 0)
+        return [entry[2] for entry in sent]